@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Accounts receivable aging. The balance of every invoice as of a date is
+# summed from its lot splits in one query; only invoices with an open
+# balance come back, as compact tuples, and are put in their aging bucket
+# in a single pass. Bucketing happens in Python because date arithmetic
+# differs between the databases GnuCash supports.
+
+import bisect
+import datetime
+
+from django.db import connections
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+from dateutil import tz
+
+import fact.models
+import fact.owners
+
+
+# Upper limits, in days overdue, of every bucket but the last.
+LIMITS = (0, 30, 60, 90)
+
+BUCKETS = (_('Current'), _('1-30 days'), _('31-60 days'), _('61-90 days'), _('Over 90 days'))
+
+# Balance of every posted invoice as of a date. Payments are counted
+# when their transaction is posted on or before that date.
+AGING_SQL = """
+    SELECT i.guid, i.owner_guid, i.date_posted, b.duedays,
+        SUM(1.0 * sp.value_num / sp.value_denom) AS balance
+    FROM invoices i
+    LEFT JOIN billterms b ON b.guid = i.terms
+    JOIN splits sp ON sp.lot_guid = i.post_lot AND sp.action = 'Invoice'
+    JOIN transactions tx ON tx.guid = sp.tx_guid
+    WHERE i.owner_type IN (2, 3)
+    AND i.date_posted < %s
+    AND tx.post_date < %s
+    GROUP BY i.guid, i.owner_guid, i.date_posted, b.duedays
+    HAVING ROUND(SUM(1.0 * sp.value_num / sp.value_denom), 2) <> 0
+"""
+
+
+class AgingRow(object):
+
+    def __init__(self, customer_guid, customer_name):
+        self.customer_guid = customer_guid
+        self.customer_name = customer_name
+        self.buckets = [0.0] * len(BUCKETS)
+        self.invoice_count = 0
+
+    @property
+    def total(self):
+        return sum(self.buckets)
+
+    def add(self, bucket, balance):
+        self.buckets[bucket] += balance
+        self.invoice_count += 1
+
+
+def bucket(days):
+    # Returns the index of the bucket for an invoice the given number of
+    # days past its due date. Zero or fewer days is current.
+    return bisect.bisect_left(LIMITS, days)
+
+
+def due_date(date_posted, duedays):
+    # Same rules as Invoice.date_due, as a local date. Invoices without
+    # payment terms are due when posted.
+    date = date_posted.replace(tzinfo=tz.gettz('UTC')).astimezone(tz.tzlocal()).date()
+    return date + datetime.timedelta(days=duedays or 0)
+
+
+def balances(as_of):
+    # Returns a list of (invoice guid, owner guid, due date, balance) for
+    # every invoice with an open balance at the end of the given date.
+    db = fact.models.Invoice.objects.db
+    connection = connections[db]
+    end = datetime.datetime.combine(as_of + datetime.timedelta(days=1), datetime.time())
+    end = connection.ops.value_to_db_datetime(timezone.make_aware(end, timezone.get_current_timezone()))
+    cursor = connection.cursor()
+    cursor.execute(AGING_SQL, (end, end))
+    return [(guid, owner, due_date(posted, duedays), float(balance))
+            for guid, owner, posted, duedays, balance in cursor.fetchall()]
+
+
+def report(as_of, owner_map=None):
+    # Returns a tuple of (rows per customer, sorted by name, total row).
+    if owner_map is None:
+        owner_map = fact.owners.graph()
+    customers = {}
+    total = AgingRow(None, None)
+    for guid, owner, due, balance in balances(as_of):
+        customer_guid, customer_name = owner_map.get(owner)[:2]
+        row = customers.get(customer_guid)
+        if row is None:
+            row = customers[customer_guid] = AgingRow(customer_guid, customer_name)
+        index = bucket((as_of - due).days)
+        row.add(index, balance)
+        total.add(index, balance)
+    rows = sorted(customers.values(), key=lambda row: (row.customer_name or '').lower())
+    return rows, total
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Read-only JSON API. Every resource accepts a "fields" parameter with a
+# comma separated list of the fields to return; only those columns are
+# read, and related entries and payments are only loaded when asked for.
+# Related rows for many invoices are prefetched together, with one IN query
+# per table.
+
+import hashlib
+import json
+import re
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Sum
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, Http404
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from django.views.decorators.csrf import csrf_exempt
+
+import fact.gnucash
+import fact.models
+import fact.paging
+import fact.payments
+import fact.search
+import fact.views
+
+
+INVOICE_FIELDS = ('guid', 'id', 'number', 'customer_guid', 'customer_name', 'job_guid', 'job_name', 'notes',
+        'date_invoice', 'date_due', 'net', 'tax', 'gross', 'paid_amount', 'balance', 'paid')
+INVOICE_RELATIONS = ('entries', 'payments')
+ENTRY_FIELDS = ('guid', 'description', 'action', 'quantity', 'unitprice', 'tax_percent', 'net', 'tax', 'gross')
+PAYMENT_FIELDS = ('guid', 'date', 'amount')
+CUSTOMER_FIELDS = ('guid', 'name', 'addr_name', 'addr_addr1', 'addr_addr2', 'addr_addr3', 'addr_addr4')
+CUSTOMER_TOTALS = ('invoice_count', 'total_gross', 'total_paid', 'total_balance')
+
+DEFAULT_INVOICE_FIELDS = ('guid', 'id', 'customer_name', 'date_invoice', 'date_due', 'gross', 'balance', 'paid')
+
+GUID = re.compile(r'[0-9a-f]{32}\Z')
+
+# Keep IN lists below SQLite's parameter limit.
+CHUNK_SIZE = 500
+
+
+def json_response(request, data):
+    body = json.dumps(data, cls=DjangoJSONEncoder)
+    etag = hashlib.md5(body).hexdigest()
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and etag in parse_etags(if_none_match):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = quote_etag(etag)
+    patch_cache_control(response, private=True, max_age=settings.FACT_API_MAX_AGE)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def requested_fields(request, allowed, default):
+    # Returns the requested fields in the order given, or None if any of
+    # them is unknown.
+    value = request.GET.get('fields')
+    if not value:
+        return list(default)
+    fields = [x.strip() for x in value.split(',') if x.strip()]
+    if any(x not in allowed for x in fields):
+        return None
+    return fields
+
+
+def serialize_invoices(rows, fields):
+    # Adds the requested relations to a list of InvoiceSummary value
+    # dictionaries, loading them for all rows at once.
+    relations = [x for x in fields if x in INVOICE_RELATIONS]
+    if not relations:
+        return rows
+    guids = [row['guid'] for row in rows]
+    if 'entries' in relations:
+        invoices = fact.models.Invoice.objects.in_bulk(guids)
+        fact.models.Invoice.prefetch(invoices.values(), ('entry_set__taxtable__entries',), payments=False)
+        for row in rows:
+            invoice = invoices.get(row['guid'])
+            row['entries'] = [dict((f, getattr(x, f)) for f in ENTRY_FIELDS)
+                    for x in (invoice.entries if invoice is not None else [])]
+    if 'payments' in relations:
+        statuses = fact.payments.load(guids)
+        for row in rows:
+            status = statuses.get(row['guid'])
+            row['payments'] = [{'guid' : x.guid, 'date' : x.date, 'amount' : float(x.amount)}
+                    for x in (status.payments if status is not None else [])]
+    return rows
+
+
+def columns(fields, allowed, extra=()):
+    # Database columns needed for the requested fields.
+    result = [x for x in fields if x in allowed]
+    for x in ('guid',) + tuple(extra):
+        if x not in result:
+            result.append(x)
+    return result
+
+
+def strip(row, fields):
+    for key in row.keys():
+        if key not in fields:
+            del row[key]
+    return row
+
+
+def select_invoices(queryset, fields):
+    rows = list(queryset.values(*columns(fields, INVOICE_FIELDS)))
+    return [strip(row, fields) for row in serialize_invoices(rows, fields)]
+
+
+@login_required
+@fact.gnucash.guarded
+def invoices(request):
+    fields = requested_fields(request, INVOICE_FIELDS + INVOICE_RELATIONS, DEFAULT_INVOICE_FIELDS)
+    if fields is None:
+        return HttpResponseBadRequest()
+    form, queryset, sort = fact.views.filter_invoices(request)
+    key = sort.lstrip('-')
+    queryset = queryset.values(*columns(fields, INVOICE_FIELDS, (key,)))
+    page = fact.paging.paginate(queryset, key, sort.startswith('-'), request.GET.get('after'),
+            fact.views.page_size(request))
+    rows = serialize_invoices(page.rows, fields)
+    return json_response(request, {
+            'invoices' : [strip(row, fields) for row in rows],
+            'next' : page.next_cursor,
+        })
+
+
+@login_required
+@fact.gnucash.guarded
+def invoice(request, guid):
+    fields = requested_fields(request, INVOICE_FIELDS + INVOICE_RELATIONS, INVOICE_FIELDS + INVOICE_RELATIONS)
+    if fields is None:
+        return HttpResponseBadRequest()
+    rows = select_invoices(fact.models.InvoiceSummary.objects.filter(guid=guid), fields)
+    if not rows:
+        raise Http404
+    return json_response(request, rows[0])
+
+
+@csrf_exempt
+@login_required
+@fact.gnucash.guarded
+def bulk(request):
+    # Many invoices by GUID in one round trip. The GUIDs are given either
+    # as repeated "guid" parameters, or as a JSON list in a POST body.
+    fields = requested_fields(request, INVOICE_FIELDS + INVOICE_RELATIONS, DEFAULT_INVOICE_FIELDS)
+    if fields is None:
+        return HttpResponseBadRequest()
+    if request.method == 'POST':
+        try:
+            guids = json.loads(request.body)
+        except ValueError:
+            return HttpResponseBadRequest()
+        if not isinstance(guids, list):
+            return HttpResponseBadRequest()
+    else:
+        guids = request.GET.getlist('guid')
+    if len(guids) > settings.FACT_MAX_PAGE_SIZE:
+        return HttpResponseBadRequest()
+    if not all(isinstance(x, basestring) and GUID.match(x) for x in guids):
+        return HttpResponseBadRequest()
+    queryset = fact.models.InvoiceSummary.objects.filter(guid__in=guids)
+    rows = list(queryset.values(*columns(fields, INVOICE_FIELDS)))
+    rows = dict((row['guid'], row) for row in serialize_invoices(rows, fields))
+    return json_response(request, {
+            'invoices' : [strip(rows[guid], fields) for guid in guids if guid in rows],
+        })
+
+
+@login_required
+@fact.gnucash.guarded
+def search(request):
+    # Invoices matching the "q" parameter, best match first.
+    fields = requested_fields(request, INVOICE_FIELDS + INVOICE_RELATIONS, DEFAULT_INVOICE_FIELDS)
+    if fields is None:
+        return HttpResponseBadRequest()
+    guids = fact.search.search(request.GET.get('q', ''), fact.views.page_size(request))
+    queryset = fact.models.InvoiceSummary.objects.filter(guid__in=guids)
+    rows = list(queryset.values(*columns(fields, INVOICE_FIELDS)))
+    rows = dict((row['guid'], row) for row in serialize_invoices(rows, fields))
+    return json_response(request, {
+            'invoices' : [strip(rows[guid], fields) for guid in guids if guid in rows],
+        })
+
+
+def customer_rows(queryset, fields):
+    rows = list(queryset.values(*columns(fields, CUSTOMER_FIELDS)))
+    totals = [x for x in fields if x in CUSTOMER_TOTALS]
+    if totals:
+        guids = [row['guid'] for row in rows]
+        sums = {}
+        for i in range(0, len(guids), CHUNK_SIZE):
+            chunk = fact.models.InvoiceSummary.objects.filter(customer_guid__in=guids[i:i+CHUNK_SIZE]) \
+                    .values('customer_guid') \
+                    .annotate(invoice_count=Count('guid'), total_gross=Sum('gross'), total_paid=Sum('paid_amount'), total_balance=Sum('balance'))
+            sums.update((x['customer_guid'], x) for x in chunk)
+        for row in rows:
+            for key in totals:
+                row[key] = sums.get(row['guid'], {}).get(key) or 0
+    return [strip(row, fields) for row in rows]
+
+
+@login_required
+@fact.gnucash.guarded
+def customers(request):
+    fields = requested_fields(request, CUSTOMER_FIELDS + CUSTOMER_TOTALS, ('guid', 'name'))
+    if fields is None:
+        return HttpResponseBadRequest()
+    return json_response(request, {
+            'customers' : customer_rows(fact.models.Customer.objects.order_by('name'), fields),
+        })
+
+
+@login_required
+@fact.gnucash.guarded
+def customer(request, guid):
+    fields = requested_fields(request, CUSTOMER_FIELDS + CUSTOMER_TOTALS, CUSTOMER_FIELDS + CUSTOMER_TOTALS)
+    if fields is None:
+        return HttpResponseBadRequest()
+    rows = customer_rows(fact.models.Customer.objects.filter(guid=guid), fields)
+    if not rows:
+        raise Http404
+    return json_response(request, rows[0])
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# GnuCash change detection and the invalidation event log.
+#
+# Detector.poll() compares a cheap stamp of every table the application
+# reads: row counts and sums of the columns that matter. Only when the
+# stamps of invoice data moved, or on a full pass, does it compare
+# per-invoice fingerprints (see fact.summary.fingerprints), which hash
+# every entry and split, to find the invoices that changed. The
+# changes are sent as signals from fact.signals in the detecting process,
+# and written to the ChangeEvent table. Other processes call receive() to
+# replay new events to their own receivers.
+
+import datetime
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+import fact.models
+import fact.owners
+import fact.signals
+import fact.summary
+
+
+# One row per table: (name, count, and two sums or maxima). Every column is
+# numeric, so the stamps can be read in a single UNION query. Sums of
+# products and squares move when values are swapped between lines, where
+# sums of single columns would not. Anything the stamps still miss is
+# found by the full pass of Detector.poll().
+STAMP_SQL = """
+    SELECT 'invoices', COUNT(*), COUNT(post_lot), COUNT(date_posted) FROM invoices
+    UNION ALL SELECT 'entries', COUNT(*),
+        SUM(1.0 * quantity_num * i_price_num / quantity_denom / i_price_denom),
+        SUM(1.0 * i_taxable * quantity_num * i_price_num) + SUM(1.0 * quantity_num * quantity_num) + SUM(LENGTH(description))
+        FROM entries
+    UNION ALL SELECT 'splits', COUNT(*), SUM(1.0 * value_num * value_num), SUM(value_num) + COUNT(lot_guid) FROM splits
+    UNION ALL SELECT 'billterms', COUNT(*), SUM(duedays), 0 FROM billterms
+    UNION ALL SELECT 'taxtable_entries', COUNT(*), SUM(amount_num), SUM(amount_denom) FROM taxtable_entries
+    UNION ALL SELECT 'customers', COUNT(*), 0, 0 FROM customers
+    UNION ALL SELECT 'jobs', COUNT(*), SUM(owner_type), 0 FROM jobs
+    UNION ALL SELECT 'company', COUNT(id), MAX(id), 0 FROM slots WHERE name LIKE %s
+"""
+
+INVOICE_TABLES = frozenset(['invoices', 'entries', 'splits', 'billterms', 'taxtable_entries', 'customers', 'jobs'])
+OWNER_TABLES = frozenset(['customers', 'jobs'])
+
+SIGNALS = {
+    'invoices' : fact.signals.invoices_changed,
+    'company' : fact.signals.company_changed,
+    'owners' : fact.signals.owners_changed,
+}
+
+
+def stamps():
+    cursor = connections[fact.models.Invoice.objects.db].cursor()
+    cursor.execute(STAMP_SQL, ['options/Business/%'])
+    return dict((row[0], tuple(row[1:])) for row in cursor.fetchall())
+
+
+class Detector(object):
+
+    def __init__(self):
+        self.stamps = None
+        self.fingerprints = None
+        self.owners = None
+
+    def poll(self, full=False):
+        # Returns a list of (kind, guids) events since the last poll. The
+        # first poll only records the current state. With full set, the
+        # invoice fingerprints and the ownership graph are compared even if
+        # no stamp moved, which catches edits the stamps do not cover, like
+        # renamed customers or changed addresses.
+        current = stamps()
+        if self.stamps is None:
+            self.stamps = current
+            graph = fact.owners.Graph.load()
+            self.owners = graph.digest()
+            self.fingerprints = fact.summary.fingerprints(graph)
+            return []
+        moved = set(table for table, stamp in current.items() if self.stamps.get(table) != stamp)
+        self.stamps = current
+
+        events = []
+        graph = None
+        if full or moved & INVOICE_TABLES:
+            graph = fact.owners.Graph.load()
+            owners = graph.digest()
+            if owners != self.owners:
+                moved.add('customers')
+            self.owners = owners
+        if moved & OWNER_TABLES:
+            events.append(('owners', []))
+        if 'company' in moved:
+            events.append(('company', []))
+        if graph is not None:
+            fingerprints = fact.summary.fingerprints(graph)
+            guids = [guid for guid, fp in fingerprints.items() if self.fingerprints.get(guid) != fp]
+            guids.extend(guid for guid in self.fingerprints if guid not in fingerprints)
+            self.fingerprints = fingerprints
+            if guids:
+                events.append(('invoices', sorted(guids)))
+        return events
+
+
+def send(kind, guids, detected):
+    if kind == 'invoices':
+        SIGNALS[kind].send(sender=Detector, guids=guids, detected=detected)
+    else:
+        SIGNALS[kind].send(sender=Detector, detected=detected)
+
+
+def publish(events):
+    # Sends events to the receivers in this process, and records them for
+    # the other processes.
+    for kind, guids in events:
+        fact.models.ChangeEvent.objects.create(kind=kind, guids=' '.join(guids))
+        send(kind, guids, True)
+
+
+_state = {'last' : None, 'checked' : 0}
+
+
+def receive():
+    # Sends the events published since the last call to the receivers in
+    # this process. Checks at most every FACT_CHANGES_CHECK seconds. The
+    # first call only notes where the log ends.
+    now = time.time()
+    if now - _state['checked'] < getattr(settings, 'FACT_CHANGES_CHECK', 2):
+        return
+    _state['checked'] = now
+    events = fact.models.ChangeEvent.objects.order_by('id')
+    if _state['last'] is None:
+        last = events.reverse().values_list('id', flat=True).first()
+        _state['last'] = last or 0
+        return
+    for event in events.filter(id__gt=_state['last']):
+        send(event.kind, event.guids.split(), False)
+        _state['last'] = event.id
+
+
+def prune(keep):
+    # Deletes events older than keep seconds.
+    cutoff = timezone.now() - datetime.timedelta(seconds=keep)
+    fact.models.ChangeEvent.objects.filter(created__lt=cutoff).delete()
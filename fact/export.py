@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Streaming ZIP export of invoice PDFs. The archive is produced as a
+# generator of byte chunks, one per invoice, so neither the web worker nor
+# the command line tool ever holds more than one PDF in memory.
+
+import time
+import zipfile
+
+from django.utils import translation
+from django.utils.translation import ugettext as _
+
+import fact.models
+import fact.owners
+import fact.render
+import fact.summary
+import fact.views
+
+
+# Keep IN lists below SQLite's parameter limit.
+CHUNK_SIZE = 500
+
+
+class ZipBuffer(object):
+
+    # Write-only file object for zipfile.ZipFile. Written data is kept
+    # until drained, and tell() reports the total number of bytes written,
+    # which is all ZipFile.writestr() and close() need.
+
+    def __init__(self):
+        self.data = []
+        self.offset = 0
+
+    def write(self, data):
+        self.data.append(data)
+        self.offset += len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = ''.join(self.data)
+        self.data = []
+        return data
+
+
+def select_invoices(date_from=None, date_to=None, customer=None, unpaid=False):
+    # Returns a list of posted invoice GUIDs matching the given filters.
+    # The dates are days in the current time zone, like on the invoice list.
+    invoices = fact.models.Invoice.invoices().filter(date_posted__isnull=False)
+    if date_from:
+        invoices = invoices.filter(date_posted__gte=fact.views.start_of_day(date_from))
+    if date_to:
+        invoices = invoices.filter(date_posted__lt=fact.views.start_of_day(date_to))
+    if customer:
+        invoices = invoices.filter(owner_guid__in=fact.owners.graph().owned_by(customer))
+    if unpaid:
+        return [row.guid for row in fact.summary.load(invoices) if not row.paid]
+    return list(invoices.values_list('guid', flat=True))
+
+
+def iter_invoices(guids, skipped=None):
+    # Yields the invoices that can be rendered. The IDs of the others,
+    # which have no due date, are appended to skipped if it is given.
+    for i in range(0, len(guids), CHUNK_SIZE):
+        chunk = guids[i:i+CHUNK_SIZE]
+        invoices = fact.models.Invoice.objects.in_bulk(chunk)
+        fact.models.Invoice.prefetch(invoices.values())
+        for guid in chunk:
+            if guid not in invoices:
+                continue
+            if not invoices[guid].printable:
+                if skipped is not None:
+                    skipped.append(invoices[guid].id)
+                continue
+            yield invoices[guid]
+
+
+def stream_zip(guids, lang, skipped=None):
+    # Invoices that cannot be rendered are listed in a text file at the
+    # end of the archive, and appended to skipped.
+    if skipped is None:
+        skipped = []
+    buf = ZipBuffer()
+    archive = zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED, allowZip64=True)
+    with translation.override(lang):
+        prefix = _('invoice')
+    for invoice in iter_invoices(list(guids), skipped):
+        key, mtime, data = fact.render.render_cached(invoice, lang)
+        info = zipfile.ZipInfo('%s-%s.pdf' % (prefix, invoice.id), time.localtime(mtime)[:6])
+        info.external_attr = 0o644 << 16
+        archive.writestr(info, data)
+        yield buf.drain()
+    if skipped:
+        with translation.override(lang):
+            name = _('skipped') + '.txt'
+            text = _('Invoices without a due date, not included:')
+        info = zipfile.ZipInfo(name, time.localtime()[:6])
+        info.external_attr = 0o644 << 16
+        archive.writestr(info, '\n'.join([text] + sorted(skipped)).encode('utf-8') + '\n')
+    archive.close()
+    yield buf.drain()
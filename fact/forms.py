@@ -1,4 +1,5 @@
 from django import forms
+from django.utils.translation import ugettext_lazy as _
 
 class LoginForm(forms.Form):
     username = forms.CharField(required=True, widget=forms.TextInput({ 'placeholder': 'Brukernavn' }))
@@ -10,3 +11,41 @@ class OptionForm(forms.Form):
     bank_swift_bic = forms.CharField(required=False)
     bank_address = forms.CharField(widget=forms.Textarea, required=False)
     payment_text = forms.CharField(widget=forms.Textarea, required=False)
+
+class ExportForm(forms.Form):
+    guid = forms.CharField(required=False)
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    customer = forms.CharField(required=False)
+    unpaid = forms.BooleanField(required=False)
+
+class AgingForm(forms.Form):
+    date = forms.DateField(required=False)
+
+class SearchForm(forms.Form):
+    q = forms.CharField(required=False, max_length=200)
+
+class InvoiceFilterForm(forms.Form):
+    customer = forms.ChoiceField(required=False)
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    status = forms.ChoiceField(required=False, choices=(
+        ('', _('All')),
+        ('paid', _('Paid')),
+        ('unpaid', _('Unpaid')),
+        ('overpaid', _('Overpaid')),
+        ('overdue', _('Overdue')),
+    ))
+    sort = forms.ChoiceField(required=False, choices=(
+        ('-number', _('Newest first')),
+        ('number', _('Oldest first')),
+        ('-date_invoice', _('Invoice date, descending')),
+        ('date_invoice', _('Invoice date, ascending')),
+        ('-date_due', _('Due date, descending')),
+        ('date_due', _('Due date, ascending')),
+    ))
+
+    def __init__(self, *args, **kwargs):
+        customers = kwargs.pop('customers', [])
+        super(InvoiceFilterForm, self).__init__(*args, **kwargs)
+        self.fields['customer'].choices = [('', _('All customers'))] + list(customers)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Connection handling for the GnuCash database.
+#
+# Every new connection to GnuCash, or to one of its replicas (see
+# fact.routers), is made read-only and, on PostgreSQL, gets a
+# statement timeout of FACT_GNUCASH_TIMEOUT milliseconds. Set CONN_MAX_AGE
+# on the gnucash database to keep connections open between requests.
+#
+# A circuit breaker protects the views: after FACT_GNUCASH_FAILURES
+# connection errors or timeouts in a row, guard() raises Unavailable
+# straight away for FACT_GNUCASH_RETRY seconds instead of waiting on the
+# database. After that, one request is let through to try again.
+
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, OperationalError, InterfaceError
+from django.db.backends.signals import connection_created
+from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.http import HttpResponse
+
+import fact.metrics
+import fact.routers
+
+
+class Unavailable(Exception):
+    pass
+
+
+class Breaker(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened = None
+
+    def allow(self):
+        with self.lock:
+            if self.opened is None:
+                return True
+            if time.time() - self.opened >= settings.FACT_GNUCASH_RETRY:
+                # Let this request through, and open again if it fails.
+                self.opened = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= settings.FACT_GNUCASH_FAILURES:
+                if self.opened is None:
+                    fact.metrics.GNUCASH_TRIPS.inc()
+                self.opened = time.time()
+
+
+breaker = Breaker()
+
+
+def configure(sender, connection, **kwargs):
+    fact.metrics.CONNECTIONS.inc(alias=connection.alias)
+    if not fact.routers.is_gnucash(connection.alias):
+        return
+    # Use the DB-API cursor, so these statements are not counted as queries.
+    cursor = connection.connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute('SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY')
+        cursor.execute('SET statement_timeout = %d' % settings.FACT_GNUCASH_TIMEOUT)
+    elif connection.vendor == 'sqlite':
+        cursor.execute('PRAGMA query_only = ON')
+    elif connection.vendor == 'mysql':
+        cursor.execute('SET SESSION TRANSACTION READ ONLY')
+    cursor.close()
+
+
+connection_created.connect(configure)
+
+
+class guard(object):
+
+    # Context manager around code that queries GnuCash. Raises Unavailable
+    # if the breaker is open, and turns connection errors and timeouts
+    # into Unavailable while counting them against the breaker.
+
+    def __enter__(self):
+        if not breaker.allow():
+            fact.metrics.GNUCASH_ERRORS.inc(kind='rejected')
+            raise Unavailable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        aliases = fact.routers.replicas()
+        if exc_type is None:
+            # Blocks that did not need GnuCash tell nothing about its health.
+            if any(connections[alias].connection is not None for alias in aliases):
+                breaker.success()
+            return False
+        failed = [alias for alias in aliases if connections[alias].errors_occurred]
+        if issubclass(exc_type, (OperationalError, InterfaceError)) and failed:
+            fact.metrics.GNUCASH_ERRORS.inc(kind='timeout' if 'timeout' in str(exc).lower() else 'error')
+            breaker.failure()
+            for alias in failed:
+                # The connection may be broken; open a new one next time,
+                # and prefer the other replicas until this one recovers.
+                connections[alias].close()
+                fact.routers.mark_down(alias)
+            raise Unavailable(str(exc))
+        return False
+
+
+def unavailable(request):
+    response = HttpResponse(render_to_string('fact/unavailable.html', {}, context_instance=RequestContext(request)), status=503)
+    response['Retry-After'] = str(settings.FACT_GNUCASH_RETRY)
+    return response
+
+
+def guarded(view):
+    # Decorator for views that need GnuCash. Answers 503 Service
+    # Unavailable when GnuCash is down, slow or the breaker is open.
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            with guard():
+                return view(request, *args, **kwargs)
+        except Unavailable:
+            return unavailable(request)
+    return wrapper
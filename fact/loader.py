@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Request-scoped identity map and batching loader for GnuCash lookups.
+#
+# Lookups are keyed by (model, field). Values can be primed ahead of time;
+# the first lookup that misses the map then fetches every pending value
+# for that model and field with a single IN query. LoaderMiddleware keeps
+# one loader per request. Outside a request, current() returns a fresh
+# loader, so nothing is cached across calls.
+
+import contextlib
+import threading
+
+
+# Keep IN lists below SQLite's parameter limit.
+CHUNK_SIZE = 500
+
+_local = threading.local()
+
+
+class Loader(object):
+
+    def __init__(self):
+        # (model, field) -> {value: [objects]}
+        self.loaded = {}
+        # (model, field) -> set of values waiting to be fetched
+        self.pending = {}
+
+    def prime(self, model, values, field='pk'):
+        loaded = self.loaded.get((model, field), {})
+        pending = self.pending.setdefault((model, field), set())
+        for value in values:
+            if value is not None and value not in loaded:
+                pending.add(value)
+
+    def get(self, model, value, field='pk'):
+        # Returns the first object whose field matches value, or None.
+        objects = self.filter(model, value, field)
+        if objects:
+            return objects[0]
+        return None
+
+    def filter(self, model, value, field='pk'):
+        # Returns the list of objects whose field matches value.
+        if value is None:
+            return []
+        loaded = self.loaded.setdefault((model, field), {})
+        if value not in loaded:
+            self.prime(model, [value], field)
+            self.fetch(model, field)
+        return loaded[value]
+
+    def fetch(self, model, field):
+        pending = list(self.pending.pop((model, field), ()))
+        loaded = self.loaded.setdefault((model, field), {})
+        identity = self.loaded.setdefault((model, 'pk'), {})
+        attname = model._meta.pk.attname if field == 'pk' else model._meta.get_field(field).attname
+        for value in pending:
+            loaded[value] = []
+        for i in range(0, len(pending), CHUNK_SIZE):
+            chunk = pending[i:i+CHUNK_SIZE]
+            for obj in model.objects.filter(**{field + '__in' : chunk}):
+                # Reuse the instance already in the identity map, if any.
+                existing = identity.get(obj.pk)
+                if existing:
+                    obj = existing[0]
+                else:
+                    identity[obj.pk] = [obj]
+                if field != 'pk':
+                    loaded.setdefault(getattr(obj, attname), []).append(obj)
+
+
+@contextlib.contextmanager
+def scope():
+    # Use a loader for the duration of the block, unless one is active.
+    if getattr(_local, 'loader', None) is not None:
+        yield _local.loader
+        return
+    begin()
+    try:
+        yield _local.loader
+    finally:
+        end()
+
+
+def begin():
+    _local.loader = Loader()
+
+
+def end():
+    _local.loader = None
+
+
+def current():
+    loader = getattr(_local, 'loader', None)
+    if loader is None:
+        return Loader()
+    return loader
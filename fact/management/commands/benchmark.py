@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from optparse import make_option
+import cPickle as pickle
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.client import RequestFactory
+
+import fact.models
+import fact.owners
+import fact.queries
+import fact.routers
+import fact.summary
+import fact.synthetic
+import fact.views
+
+
+def use_databases(directory, book):
+    # Point both database aliases at SQLite files in directory, and create
+    # the application tables in the default one.
+    for alias, name in (('default', os.path.join(directory, 'default.db')), ('gnucash', book)):
+        if hasattr(connections._connections, alias):
+            getattr(connections._connections, alias).close()
+            delattr(connections._connections, alias)
+        settings.DATABASES[alias] = connections.databases[alias] = {
+            'ENGINE' : 'django.db.backends.sqlite3',
+            'NAME' : name,
+        }
+    settings.FACT_GNUCASH_REPLICAS = ('gnucash',)
+    fact.routers.unpin()
+    call_command('syncdb', interactive=False, verbosity=0, database='default')
+    settings.FACT_PDF_CACHE_DIR = os.path.join(directory, 'pdf')
+    fact.models.Option._store.clear()
+    fact.models.Slot._company = (None, None, 0)
+    fact.owners.invalidate()
+
+
+class Result(object):
+
+    def __init__(self, name, calls, elapsed, stats, memory):
+        self.name = name
+        self.calls = calls
+        self.elapsed = elapsed
+        self.queries = dict((alias, s.count) for alias, s in stats.items())
+        self.query_time = sum(s.time for s in stats.values())
+        self.memory = memory
+
+
+def peak_rss():
+    # The peak resident set size of this process, in bytes.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run(name, func, args_list):
+    recorder = fact.queries.QueryRecorder()
+    before = peak_rss()
+    recorder.start()
+    start = time.time()
+    for args in args_list:
+        func(*args)
+    elapsed = time.time() - start
+    stats = recorder.stop()
+    return Result(name, len(args_list), elapsed, stats, peak_rss() - before)
+
+
+def measure(name, func, args_list):
+    # Calls func once for each tuple of arguments in args_list, and
+    # returns a Result with wall time, queries and memory use. Every
+    # benchmark runs in a child process forked from this one, so its
+    # memory is how far the peak resident set size grew over the size at
+    # the fork, whatever ran before it.
+    for conn in connections.all():
+        conn.close()
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read)
+            try:
+                result = run(name, func, args_list)
+            except Exception:
+                result = traceback.format_exc()
+            with os.fdopen(write, 'wb') as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read, 'rb') as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    result = pickle.loads(data) if data else 'The benchmark process exited without a result.'
+    if not isinstance(result, Result):
+        raise CommandError('%s failed:\n%s' % (name, result))
+    return result
+
+
+def totals(guid):
+    invoice = fact.models.Invoice.related().get(pk=guid)
+    return invoice.net, invoice.tax, invoice.gross, invoice.due, invoice.customer, invoice.date_due
+
+
+class Command(BaseCommand):
+
+    help = 'Benchmark the data layer and views against synthetic GnuCash books.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', default='1000,10000,100000',
+            help='Comma separated list of book sizes, in invoices.'),
+        make_option('--samples', type='int', default=20,
+            help='Number of invoices to time the per-invoice views with.'),
+        make_option('--keep', action='store_true', default=False,
+            help='Keep the generated databases.'),
+    )
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        user = User(username='benchmark', is_active=True)
+
+        def request(path):
+            request = factory.get(path)
+            request.user = user
+            request.LANGUAGE_CODE = settings.LANGUAGE_CODE
+            return request
+
+        for size in [int(x) for x in options['sizes'].split(',')]:
+            directory = tempfile.mkdtemp(prefix='fact-benchmark-')
+            try:
+                book = os.path.join(directory, 'book.db')
+                start = time.time()
+                fact.synthetic.generate(book, customers=max(1, size // 20), jobs=max(1, size // 10), invoices=size)
+                self.stdout.write('\n%d invoices, generated in %.1fs (%s)' % (size, time.time() - start, directory))
+                use_databases(directory, book)
+
+                guids = list(fact.models.Invoice.invoices().filter(date_posted__isnull=False)
+                        .values_list('guid', flat=True)[:options['samples']])
+                samples = [(guid,) for guid in guids]
+                results = [
+                    measure('sync', fact.summary.sync, [()]),
+                    measure('totals (properties)', totals, samples),
+                    measure('totals (summary.load)', lambda: fact.summary.load(fact.models.Invoice.invoices()), [()]),
+                    measure('index', lambda: fact.views.index(request('/')), [()]),
+                    measure('customers', lambda: fact.views.customers(request('/customers/')), [()]),
+                    measure('detailed', lambda guid: fact.views.detailed(request('/invoice/%s/' % guid), guid), samples),
+                ]
+                if getattr(settings, 'FACT_LOGO', None):
+                    pdf = lambda guid: fact.views.pdf(request('/invoice/pdf/%s/' % guid), guid)
+                    results.append(measure('pdf (cold)', pdf, samples))
+                    results.append(measure('pdf (cached)', pdf, samples))
+                self.report(results)
+            finally:
+                if not options['keep']:
+                    shutil.rmtree(directory, ignore_errors=True)
+
+    def report(self, results):
+        self.stdout.write('%-24s %6s %10s %10s %9s %9s %10s %10s' % (
+            'benchmark', 'calls', 'total s', 'ms/call', 'default', 'gnucash', 'db ms', 'peak KiB'))
+        for r in results:
+            self.stdout.write('%-24s %6d %10.3f %10.2f %9d %9d %10.1f %10d' % (
+                r.name, r.calls, r.elapsed, r.elapsed * 1000 / max(r.calls, 1),
+                r.queries.get('default', 0), r.queries.get('gnucash', 0), r.query_time * 1000,
+                r.memory // 1024))
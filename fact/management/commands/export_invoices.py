@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from optparse import make_option
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+import fact.export
+from fact.management.commands.render_invoices import FILTER_OPTIONS, parse_date
+
+
+class Command(BaseCommand):
+
+    help = 'Write a ZIP archive of invoice PDFs, optionally limited to the given GUIDs.'
+
+    option_list = BaseCommand.option_list + FILTER_OPTIONS + (
+        make_option('--lang', default=settings.LANGUAGE_CODE,
+            help='Language to render the invoices in.'),
+        make_option('--output',
+            help='File to write the archive to. Defaults to standard output.'),
+    )
+
+    def handle(self, *args, **options):
+        guids = list(args) or fact.export.select_invoices(parse_date(options['date_from']), parse_date(options['date_to']),
+                options['customer'], options['unpaid'])
+        if options['output']:
+            output = open(options['output'], 'wb')
+        else:
+            output = sys.stdout
+        skipped = []
+        try:
+            for chunk in fact.export.stream_zip(guids, options['lang'], skipped):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        if skipped:
+            self.stderr.write('Skipped %d invoices without a due date: %s' % (len(skipped), ' '.join(sorted(skipped))))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from optparse import make_option
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+import fact.synthetic
+
+
+class Command(BaseCommand):
+
+    args = '<path>'
+    help = 'Write a synthetic GnuCash book to a new SQLite database.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--customers', type='int', default=50),
+        make_option('--jobs', type='int', default=100),
+        make_option('--invoices', type='int', default=1000),
+        make_option('--entries', type='int', default=4,
+            help='Average number of entries per invoice.'),
+        make_option('--taxtables', type='int', default=3),
+        make_option('--payments', type='int', default=1,
+            help='Average number of payments per paid invoice.'),
+        make_option('--seed', type='int', default=1),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: generate_book %s' % self.args)
+        if os.path.exists(args[0]):
+            raise CommandError('%s already exists' % args[0])
+        counts = fact.synthetic.generate(args[0], options['customers'], options['jobs'], options['invoices'],
+                options['entries'], options['taxtables'], options['payments'], options['seed'])
+        self.stdout.write(', '.join('%d %s' % (counts[key], key) for key in sorted(counts)))
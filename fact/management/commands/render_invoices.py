@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from optparse import make_option
+import multiprocessing
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import dateparse
+
+import fact.export
+import fact.models
+import fact.render
+
+
+def init_worker():
+    # Database connections inherited from the parent process must not be
+    # shared between workers.
+    for conn in connections.all():
+        conn.close()
+
+
+def render_one(args):
+    guid, lang, output = args
+    start = time.time()
+    invoice = fact.models.Invoice.related().get(pk=guid)
+    if not invoice.printable:
+        return guid, invoice.id, None, time.time() - start
+    key, mtime, data = fact.render.render_cached(invoice, lang)
+    if output:
+        with open(os.path.join(output, 'invoice-%s.pdf' % invoice.id), 'wb') as f:
+            f.write(data)
+    return guid, invoice.id, len(data), time.time() - start
+
+
+def parse_date(value):
+    if value is None:
+        return None
+    date = dateparse.parse_date(value)
+    if date is None:
+        raise CommandError('Invalid date: %s' % value)
+    return date
+
+
+# Invoice selection options, shared with the export_invoices command.
+FILTER_OPTIONS = (
+    make_option('--from', dest='date_from',
+        help='Only invoices posted on or after this date (YYYY-MM-DD).'),
+    make_option('--to', dest='date_to',
+        help='Only invoices posted before this date (YYYY-MM-DD).'),
+    make_option('--customer',
+        help='Only invoices for this customer GUID, including its jobs.'),
+    make_option('--unpaid', action='store_true', default=False,
+        help='Only invoices that are not fully paid.'),
+)
+
+
+class Command(BaseCommand):
+
+    help = 'Render invoice PDFs in parallel, storing them in the PDF cache.'
+
+    option_list = BaseCommand.option_list + FILTER_OPTIONS + (
+        make_option('--workers', type='int', default=multiprocessing.cpu_count(),
+            help='Number of worker processes.'),
+        make_option('--lang', default=settings.LANGUAGE_CODE,
+            help='Language to render the invoices in.'),
+        make_option('--output',
+            help='Also write the PDFs to this directory.'),
+    )
+
+    def handle(self, *args, **options):
+        guids = list(args) or fact.export.select_invoices(parse_date(options['date_from']), parse_date(options['date_to']),
+                options['customer'], options['unpaid'])
+        if options['output'] and not os.path.isdir(options['output']):
+            os.makedirs(options['output'])
+
+        jobs = [(guid, options['lang'], options['output']) for guid in guids]
+        init_worker()
+        pool = multiprocessing.Pool(max(1, options['workers']), init_worker)
+        start = time.time()
+        total = 0
+        timings = []
+        skipped = []
+        try:
+            for guid, id, size, elapsed in pool.imap_unordered(render_one, jobs):
+                if size is None:
+                    skipped.append(id)
+                    continue
+                total += size
+                timings.append(elapsed)
+                if int(options['verbosity']) > 0:
+                    self.stdout.write('%s\t%d bytes\t%.3fs' % (id, size, elapsed))
+        finally:
+            pool.close()
+            pool.join()
+        elapsed = time.time() - start
+
+        rendered = len(jobs) - len(skipped)
+        rate = rendered / elapsed if elapsed else 0
+        self.stdout.write('Rendered %d invoices (%d bytes) in %.2fs with %d workers, %.1f invoices/s' % (
+            rendered, total, elapsed, options['workers'], rate))
+        if skipped:
+            self.stdout.write('Skipped %d invoices without a due date: %s' % (len(skipped), ' '.join(sorted(skipped))))
+        if timings:
+            self.stdout.write('Per invoice: min %.3fs, mean %.3fs, max %.3fs' % (
+                min(timings), sum(timings) / len(timings), max(timings)))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand
+
+import fact.search
+import fact.summary
+
+
+class Command(BaseCommand):
+
+    help = 'Copy changed GnuCash invoices into the InvoiceSummary table and the search index.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--interval', type='int', default=0,
+            help='Keep running, syncing every INTERVAL seconds.'),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.time()
+            changed, deleted = fact.summary.sync(args or None)
+            self.stdout.write('Updated %d, deleted %d invoice summaries in %.2fs' % (len(changed), len(deleted), time.time() - start))
+            start = time.time()
+            changed, deleted = fact.search.sync(args or None)
+            self.stdout.write('Updated %d, deleted %d search documents in %.2fs' % (len(changed), len(deleted), time.time() - start))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
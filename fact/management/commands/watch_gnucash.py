@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand
+
+import fact.changes
+import fact.pdfcache
+import fact.search
+import fact.summary
+
+
+class Command(BaseCommand):
+
+    help = 'Watch the GnuCash database for changes, and invalidate cached invoice data.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--interval', type='int', default=5,
+            help='Check for changes every INTERVAL seconds.'),
+        make_option('--full-every', type='int', default=60,
+            help='Compare every invoice fingerprint every N checks, even if no table changed.'),
+        make_option('--keep', type='int', default=3600,
+            help='Keep change events for KEEP seconds.'),
+    )
+
+    def handle(self, *args, **options):
+        # Bring the summaries up to date before watching for changes, so
+        # nothing that changed while no one was watching is missed.
+        changed, deleted = fact.summary.sync()
+        self.stdout.write('Updated %d, deleted %d invoice summaries' % (len(changed), len(deleted)))
+        fact.pdfcache.invalidate(changed + deleted)
+        changed, deleted = fact.search.sync()
+        self.stdout.write('Updated %d, deleted %d search documents' % (len(changed), len(deleted)))
+
+        detector = fact.changes.Detector()
+        detector.poll()
+        polls = 0
+        while True:
+            time.sleep(options['interval'])
+            polls += 1
+            start = time.time()
+            events = detector.poll(full=options['full_every'] and polls % options['full_every'] == 0)
+            fact.changes.publish(events)
+            fact.changes.prune(options['keep'])
+            for kind, guids in events:
+                if guids:
+                    self.stdout.write('%s: %d changed in %.2fs' % (kind, len(guids), time.time() - start))
+                else:
+                    self.stdout.write('%s changed' % kind)
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Prometheus metrics. Every process keeps its counters and histograms in
+# memory and writes them to its own shard file in FACT_METRICS_DIR, at
+# most once every FACT_METRICS_FLUSH seconds. exposition() adds up the
+# shards of all processes, so the numbers stay correct behind a server
+# running several worker processes. When the metrics are collected, the
+# shards of workers that have exited are added to a retired shard and
+# removed, so the totals never go down and Prometheus does not see a
+# counter reset. The directory must not be shared between hosts, since
+# process IDs are only checked on this one.
+
+import atexit
+import errno
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (10000, 25000, 50000, 100000, 250000, 500000, 1000000, 2500000)
+
+# The retired shard holds the added up values of dead workers, and the
+# names of the shards already added, so a shard that could not be removed
+# is not counted twice. Collecting holds a lock on LOCK_FILE.
+RETIRED_SHARD = 'retired.json'
+LOCK_FILE = 'collect.lock'
+
+_lock = threading.Lock()
+_metrics = []
+_values = {}
+_state = {'pid' : None, 'shard' : None, 'flushed' : 0}
+
+
+def metrics_dir():
+    return getattr(settings, 'FACT_METRICS_DIR', None)
+
+
+class Metric(object):
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        _metrics.append(self)
+
+    def key(self, labels):
+        return (self.name, tuple(str(labels.get(label, '')) for label in self.labels))
+
+    def update(self, labels, func):
+        with _lock:
+            if _state['pid'] != os.getpid():
+                # Forked from a parent that may already have counted
+                # something; the parent's shard holds those numbers.
+                _values.clear()
+                _state.update(pid=os.getpid(), shard=None, flushed=time.time())
+            key = self.key(labels)
+            _values[key] = func(_values.get(key))
+        maybe_flush()
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self.update(labels, lambda value: (value or 0) + amount)
+
+    def empty(self):
+        return 0
+
+    def merge(self, a, b):
+        return a + b
+
+    def samples(self, labels, value):
+        yield self.name, labels, value
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount, **labels):
+        # Values are stored as one count per bucket, plus an overflow
+        # count, the sum and the total count.
+        def add(value):
+            value = list(value or self.empty())
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    break
+            else:
+                i = len(self.buckets)
+            value[i] += 1
+            value[-2] += amount
+            value[-1] += 1
+            return value
+        self.update(labels, add)
+
+    def empty(self):
+        return [0] * (len(self.buckets) + 3)
+
+    def merge(self, a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def samples(self, labels, value):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), value):
+            cumulative += count
+            yield self.name + '_bucket', labels + (('le', str(bound)),), cumulative
+        yield self.name + '_sum', labels, value[-2]
+        yield self.name + '_count', labels, value[-1]
+
+
+REQUEST_SECONDS = Histogram('fact_request_seconds', 'Time spent handling a request, by view.', ('view',))
+RESPONSES = Counter('fact_responses_total', 'Responses sent, by view and status code.', ('view', 'status'))
+QUERIES = Counter('fact_db_queries_total', 'Database queries run, by alias and view.', ('alias', 'view'))
+QUERY_SECONDS = Histogram('fact_db_query_seconds', 'Time spent in a single database query, by alias.', ('alias',))
+PDFS_RENDERED = Counter('fact_pdf_rendered_total', 'Invoice PDFs rendered.')
+PDF_SECONDS = Histogram('fact_pdf_render_seconds', 'Time spent rendering an invoice PDF.')
+PDF_BYTES = Histogram('fact_pdf_bytes', 'Size of rendered invoice PDFs.', buckets=SIZE_BUCKETS)
+CACHE = Counter('fact_cache_requests_total', 'Cache lookups, by cache and result (hit or miss).', ('cache', 'result'))
+CONNECTIONS = Counter('fact_db_connections_total', 'Database connections opened, by alias.', ('alias',))
+GNUCASH_ERRORS = Counter('fact_gnucash_errors_total', 'GnuCash queries that failed or were rejected by the circuit breaker, by kind.', ('kind',))
+GNUCASH_TRIPS = Counter('fact_gnucash_breaker_trips_total', 'Times the GnuCash circuit breaker opened.')
+
+
+def cache_result(cache, hit):
+    CACHE.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def shard_name():
+    if _state['shard'] is None:
+        _state['shard'] = '%d-%d.json' % (os.getpid(), time.time() * 1000)
+    return _state['shard']
+
+
+def read_shard(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_shard(directory, filename, data):
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmp, os.path.join(directory, filename))
+
+
+def maybe_flush():
+    if time.time() - _state['flushed'] >= getattr(settings, 'FACT_METRICS_FLUSH', 5):
+        flush()
+
+
+def flush():
+    # Writes this process' values to its shard file.
+    directory = metrics_dir()
+    if not directory:
+        return
+    with _lock:
+        if _state['pid'] != os.getpid():
+            return
+        data = [[name, list(labels), value] for (name, labels), value in _values.items()]
+        _state['flushed'] = time.time()
+        filename = shard_name()
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    write_shard(directory, filename, data)
+
+
+atexit.register(flush)
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM means the process exists, but belongs to another user.
+        return e.errno == errno.EPERM
+    return True
+
+
+def add(totals, kinds, values):
+    for name, labels, value in values:
+        metric = kinds.get(name)
+        if metric is None:
+            continue
+        key = (name, tuple(labels))
+        totals[key] = metric.merge(totals.get(key, metric.empty()), value)
+
+
+def dead(filename):
+    pid = filename.split('-', 1)[0]
+    return filename.endswith('.json') and pid.isdigit() and not alive(int(pid))
+
+
+def retire(directory, kinds):
+    # Adds the shards of dead processes to the retired shard, then removes
+    # them. Must be called with the collect lock held.
+    filenames = [filename for filename in os.listdir(directory) if dead(filename)]
+    if not filenames:
+        return
+    retired = read_shard(os.path.join(directory, RETIRED_SHARD)) or {'shards' : [], 'values' : []}
+    merged = set(retired['shards'])
+    totals = {}
+    add(totals, kinds, retired['values'])
+    for filename in filenames:
+        if filename in merged:
+            continue
+        values = read_shard(os.path.join(directory, filename))
+        if values is None:
+            continue
+        add(totals, kinds, values)
+        merged.add(filename)
+    # Names of shards that are gone can not be counted again.
+    shards = sorted(name for name in merged if os.path.exists(os.path.join(directory, name)))
+    values = [[name, list(labels), value] for (name, labels), value in sorted(totals.items())]
+    write_shard(directory, RETIRED_SHARD, {'shards' : shards, 'values' : values})
+    for filename in filenames:
+        if filename in merged:
+            os.remove(os.path.join(directory, filename))
+
+
+def collect():
+    # Returns the values of all processes that ever wrote a shard, as
+    # (name, labels) -> value.
+    flush()
+    kinds = dict((metric.name, metric) for metric in _metrics)
+    totals = {}
+    directory = metrics_dir()
+    if not directory or not os.path.isdir(directory):
+        return totals
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        retire(directory, kinds)
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            shard = read_shard(os.path.join(directory, filename))
+            if isinstance(shard, dict):
+                shard = shard['values']
+            add(totals, kinds, shard or [])
+    return totals
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def exposition():
+    # Returns all metrics in the Prometheus text format.
+    totals = collect()
+    lines = []
+    for metric in _metrics:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        for (name, values), value in sorted(totals.items()):
+            if name != metric.name:
+                continue
+            for sample, labels, number in metric.samples(tuple(zip(metric.labels, values)), value):
+                if labels:
+                    sample += '{%s}' % ','.join('%s="%s"' % (k, escape(v)) for k, v in labels)
+                lines.append('%s %s' % (sample, repr(float(number))))
+    return '\n'.join(lines) + '\n'
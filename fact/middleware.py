@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+
+import fact.changes
+import fact.loader
+import fact.routers
+import fact.metrics
+import fact.queries
+
+
+logger = logging.getLogger('fact.queries')
+
+
+class ChangeMiddleware(object):
+
+    # Drops cached GnuCash data in this process when the change detector
+    # has reported changes. See fact.changes.
+
+    def process_request(self, request):
+        fact.changes.receive()
+
+
+class LoaderMiddleware(object):
+
+    # Gives every request its own identity map for GnuCash lookups that
+    # were not prefetched. See fact.loader.
+
+    def process_request(self, request):
+        fact.loader.begin()
+
+    def process_response(self, request, response):
+        fact.loader.end()
+        return response
+
+    def process_exception(self, request, exception):
+        fact.loader.end()
+
+
+class MetricsMiddleware(object):
+
+    # Records request latency and response codes per view for the metrics
+    # endpoint. Should come first in MIDDLEWARE_CLASSES, so the time spent
+    # in other middleware is included.
+
+    def process_request(self, request):
+        request._fact_started = time.time()
+        request._fact_metrics_view = None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._fact_metrics_view = fact.queries.view_name(view_func)
+
+    def process_response(self, request, response):
+        started = getattr(request, '_fact_started', None)
+        if started is None:
+            return response
+        view = request._fact_metrics_view
+        fact.metrics.REQUEST_SECONDS.observe(time.time() - started, view=view)
+        fact.metrics.RESPONSES.inc(view=view, status=response.status_code)
+        return response
+
+
+class ReplicaMiddleware(object):
+
+    # Lets every request pick its own GnuCash replica. See fact.routers.
+
+    def process_request(self, request):
+        fact.routers.unpin()
+
+    def process_response(self, request, response):
+        fact.routers.unpin()
+        return response
+
+    def process_exception(self, request, exception):
+        fact.routers.unpin()
+
+
+class QueryCountMiddleware(object):
+
+    # Records the number of queries and the time spent in them for each
+    # database alias, for a FACT_QUERY_SAMPLE_RATE share of the requests
+    # (default: all of them). The numbers are logged to the "fact.queries"
+    # logger and counted in the query metrics, and views that go over
+    # their FACT_QUERY_BUDGETS entry log a warning. They are only added
+    # to the response as X-Fact-Queries-<alias> headers when
+    # FACT_QUERY_HEADERS (default: DEBUG) is set, or for staff users;
+    # those requests are always recorded.
+
+    def process_request(self, request):
+        request._fact_query_headers = None
+        if random.random() >= getattr(settings, 'FACT_QUERY_SAMPLE_RATE', 1.0) and not self.show_headers(request):
+            return
+        request._fact_queries = fact.queries.QueryRecorder()
+        request._fact_queries.start()
+        request._fact_view = None
+
+    def show_headers(self, request):
+        if request._fact_query_headers is None:
+            user = getattr(request, 'user', None)
+            request._fact_query_headers = bool(getattr(settings, 'FACT_QUERY_HEADERS', settings.DEBUG)
+                    or (user is not None and user.is_staff))
+        return request._fact_query_headers
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_fact_queries'):
+            request._fact_view = fact.queries.view_name(view_func)
+
+    def process_response(self, request, response):
+        recorder = getattr(request, '_fact_queries', None)
+        if recorder is None:
+            return response
+        stats = recorder.stop()
+        view = request._fact_view
+        record = {
+            'view' : view,
+            'path' : request.path,
+            'status' : response.status_code,
+            'databases' : dict((alias, s.as_dict()) for alias, s in stats.items()),
+        }
+        logger.info(json.dumps(record))
+
+        for alias, s in stats.items():
+            fact.metrics.QUERIES.inc(s.count, alias=alias, view=view)
+            for query in s.queries:
+                fact.metrics.QUERY_SECONDS.observe(float(query['time']), alias=alias)
+
+        budget = settings.FACT_QUERY_BUDGETS.get(view, {})
+        for alias, limit in budget.items():
+            # The gnucash budget covers whichever replica served the request.
+            group = fact.routers.replicas() if alias == fact.routers.PRIMARY else (alias,)
+            count = sum(stats[a].count for a in group if a in stats)
+            if count > limit:
+                logger.warning('%s ran %d queries on %s, budget is %d', view, count, alias, limit)
+
+        if not self.show_headers(request):
+            return response
+        for alias, s in stats.items():
+            response['X-Fact-Queries-' + alias] = '%d; %.1fms' % (s.count, s.time * 1000)
+        return response
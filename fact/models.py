@@ -23,11 +23,50 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from django.db import models
-from django.db.models import Q
+import re
+import time
+
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q, Count, Max, Min, Sum
+from django.db.models.query import prefetch_related_objects
+from django.utils import timezone
 from dateutil import tz
 from dateutil.relativedelta import relativedelta
 
+import fact.gnucash
+import fact.loader
+import fact.metrics
+import fact.owners
+import fact.payments
+import fact.signals
+
+
+class PaymentTemplate(object):
+
+    # Payment text with %key% placeholders for option values, compiled
+    # into a single regular expression so it is expanded in one pass.
+
+    def __init__(self, text, keys):
+        self.text = text or ''
+        self.pattern = None
+        if keys:
+            self.pattern = re.compile('%(' + '|'.join(re.escape(key) for key in keys) + ')%')
+
+    def substitute(self, values):
+        text = self.text
+        if self.pattern is not None:
+            text = self.pattern.sub(lambda m: values.get(m.group(1)) or '', text)
+        return text.replace('\n', '<br/>')
+
+
+class OptionVersion(models.Model):
+
+    # Bumped whenever the options for a language change, so that every
+    # process knows to reload its cached copy.
+    lang = models.CharField(max_length=5, unique=True)
+    version = models.IntegerField(default=0)
+
 
 class Option(models.Model):
 
@@ -35,40 +74,165 @@ class Option(models.Model):
     lang = models.CharField(max_length=5)
     value = models.TextField(null=True)
 
+    # lang -> (version, options, expanded payment text, time of last
+    # version check), see load().
+    _store = {}
+
     @staticmethod
     def _get(key, lang):
-        qs = Option.objects.filter(key=key, lang=lang)
-        if qs.count() == 0:
-            return None
-        return qs[0]
+        return Option.objects.filter(key=key, lang=lang).first()
 
     @staticmethod
     def get(key, lang):
-        ob = Option._get(key, lang)
-        if ob is None:
-            return ob
-        return ob.value
+        return Option.load(lang)[1].get(key)
 
     @staticmethod
-    def set(key, lang, value):
+    def set(key, lang, value, bump=True):
         ob = Option._get(key, lang)
         if ob is None:
             ob = Option(key=key, lang=lang)
         ob.value = value
         ob.save()
+        if bump:
+            Option.bump(lang)
+
+    @staticmethod
+    def version(lang):
+        versions = OptionVersion.objects.filter(lang=lang).values_list('version', flat=True)
+        for version in versions:
+            return version
+        return 0
+
+    @staticmethod
+    def bump(lang):
+        # This process reloads straight away, others within FACT_OPTIONS_TTL.
+        Option._store.pop(lang, None)
+        if OptionVersion.objects.filter(lang=lang).update(version=F('version') + 1) == 0:
+            try:
+                with transaction.atomic():
+                    OptionVersion.objects.create(lang=lang, version=1)
+            except IntegrityError:
+                OptionVersion.objects.filter(lang=lang).update(version=F('version') + 1)
+
+    @staticmethod
+    def load(lang):
+        # Returns the cached options for a language. Like the company
+        # profile, they are used without a query for FACT_OPTIONS_TTL
+        # seconds, and then reloaded only if the version counter has moved
+        # on since they were loaded.
+        now = time.time()
+        entry = Option._store.get(lang)
+        if entry is not None and now - entry[3] < getattr(settings, 'FACT_OPTIONS_TTL', 10):
+            fact.metrics.cache_result('options', True)
+            return entry
+        version = Option.version(lang)
+        fact.metrics.cache_result('options', entry is not None and entry[0] == version)
+        if entry is None or entry[0] != version:
+            options = dict(Option.objects.filter(lang=lang).values_list('key', 'value'))
+            template = PaymentTemplate(options.get('payment_text'), options.keys())
+            entry = (version, options, template.substitute(options), now)
+        else:
+            entry = entry[:3] + (now,)
+        Option._store[lang] = entry
+        return entry
 
     @staticmethod
     def opt_list(lang):
-        values = Option.objects.filter(lang=lang).values_list('key', 'value')
-        initial = {}
-        for key, value in values:
-            initial[key] = value
-        return initial
+        return dict(Option.load(lang)[1])
+
+    @staticmethod
+    def payment_text(lang):
+        return Option.load(lang)[2]
 
     class Meta:
         unique_together = ('key', 'lang')
 
 
+class InvoiceSummary(models.Model):
+
+    # Denormalized copy of invoice totals, kept up to date by the
+    # sync_invoices management command. See fact.summary.sync().
+    guid = models.CharField(primary_key=True, max_length=32)
+    id = models.CharField(max_length=2048)
+    # Invoice number as an integer, for numeric sorting. Zero if the
+    # invoice ID is not a number.
+    number = models.BigIntegerField(default=0)
+    customer_guid = models.CharField(max_length=32, null=True, db_index=True)
+    customer_name = models.CharField(max_length=2048, null=True)
+    job_guid = models.CharField(max_length=32, null=True)
+    job_name = models.CharField(max_length=2048, null=True)
+    notes = models.CharField(max_length=2048, null=True)
+    date_posted = models.DateTimeField(null=True)
+    date_invoice = models.DateTimeField(null=True, db_index=True)
+    date_due = models.DateTimeField(null=True)
+    net = models.FloatField(default=0)
+    tax = models.FloatField(default=0)
+    gross = models.FloatField(default=0)
+    paid_amount = models.FloatField(default=0)
+    balance = models.FloatField(default=0)
+    paid = models.BooleanField(default=False)
+    fingerprint = models.CharField(max_length=32)
+    synced = models.DateTimeField(auto_now=True)
+
+    @property
+    def overpaid(self):
+        return self.date_posted is not None and self.balance < 0
+
+    @property
+    def overdue(self):
+        return not self.paid and self.date_due is not None and self.date_due < timezone.now()
+
+    @staticmethod
+    def customer_totals(queryset=None):
+        # Returns one dictionary per customer with the number of invoices and
+        # the invoiced, paid and outstanding totals, in a single grouped query.
+        if queryset is None:
+            queryset = InvoiceSummary.objects.all()
+        return queryset.values('customer_guid', 'customer_name').annotate(
+                invoice_count=Count('guid'), total_gross=Sum('gross'),
+                total_paid=Sum('paid_amount'), total_balance=Sum('balance'))
+
+    @staticmethod
+    def oldest_overdue(queryset=None):
+        # Returns a dictionary of customer GUID -> due date of the customer's
+        # oldest overdue invoice, in a single grouped query.
+        if queryset is None:
+            queryset = InvoiceSummary.objects.all()
+        return dict(queryset.filter(paid=False, date_due__lt=timezone.now()).values('customer_guid') \
+                .annotate(oldest=Min('date_due')).values_list('customer_guid', 'oldest'))
+
+    def __unicode__(self):
+        return 'Invoice ' + self.id
+
+    class Meta:
+        index_together = [
+            ('number', 'guid'),
+            ('date_invoice', 'guid'),
+            ('date_due', 'guid'),
+        ]
+
+
+class ChangeEvent(models.Model):
+
+    # Log of changes found in the GnuCash database, read by every process
+    # to drop its cached copies. See fact.changes.
+    kind = models.CharField(max_length=16)
+    guids = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class SearchDocument(models.Model):
+
+    # Searchable text of an invoice, copied from GnuCash and indexed for
+    # full-text search. See fact.search.
+    guid = models.CharField(primary_key=True, max_length=32)
+    invoice_id = models.CharField(max_length=2048)
+    notes = models.TextField(blank=True)
+    entries = models.TextField(blank=True)
+    customer = models.TextField(blank=True)
+    fingerprint = models.CharField(max_length=32)
+
+
 
 
 ##############################
@@ -76,30 +240,82 @@ class Option(models.Model):
 ##############################
 
 
+# Models read from the GnuCash database, see fact.routers. Add a model to
+# the set with the @gnucash decorator.
+GNUCASH_MODELS = set()
+
+
+def gnucash(model):
+    GNUCASH_MODELS.add(model)
+    return model
+
+
+# Maps company profile fields to GnuCash slot names. Override with
+# FACT_COMPANY_SLOTS in the settings, e.g. to read a bank account number
+# from a slot that GnuCash does not otherwise use.
+COMPANY_SLOTS = {
+    'id' : 'options/Business/Company ID',
+    'name' : 'options/Business/Company Name',
+    'address' : 'options/Business/Company Address',
+    'email' : 'options/Business/Company Email Address',
+    'url' : 'options/Business/Company Website URL',
+    'phone' : 'options/Business/Company Phone Number',
+}
+
+
+@gnucash
 class Slot(models.Model):
 
+    # (profile, version, time of last version check), see company().
+    _company = (None, None, 0)
+
     name = models.CharField(max_length=4096)
     string_val = models.CharField(max_length=4096)
 
+    @staticmethod
+    def version():
+        # Cheap fingerprint of the business slots. GnuCash rewrites the
+        # slots of an object when it is saved, so the row ids change.
+        agg = Slot.objects.filter(name__startswith='options/Business/').aggregate(count=Count('id'), last=Max('id'))
+        return (agg['count'], agg['last'])
+
     @staticmethod
     def company():
-        return {
-                'id' : Slot.objects.get(name='options/Business/Company ID').string_val,
-                # Due to lack of this option in the GnuCash GUI, we need
-                # to hi-jack something else - Fax number is not very important.
-                'bank_account_number' : Slot.objects.get(name='options/Business/Company Fax Number').string_val,
-                'name' : Slot.objects.get(name='options/Business/Company Name').string_val,
-                'address' : Slot.objects.get(name='options/Business/Company Address').string_val,
-                'email' : Slot.objects.get(name='options/Business/Company Email Address').string_val,
-                'url' : Slot.objects.get(name='options/Business/Company Website URL').string_val,
-                'phone' : Slot.objects.get(name='options/Business/Company Phone Number').string_val,
-            }
+        # The company profile is cached in process. After FACT_COMPANY_TTL
+        # seconds the slot version is checked, and the profile is only
+        # reloaded if the slots actually changed.
+        now = time.time()
+        profile, version, checked = Slot._company
+        if profile is not None and now - checked < getattr(settings, 'FACT_COMPANY_TTL', 10):
+            fact.metrics.cache_result('company', True)
+            return profile
+        current = Slot.version()
+        hit = profile is not None and current == version
+        fact.metrics.cache_result('company', hit)
+        if not hit:
+            profile = Slot.load_company()
+        Slot._company = (profile, current, now)
+        return profile
+
+    @staticmethod
+    def load_company():
+        mapping = getattr(settings, 'FACT_COMPANY_SLOTS', COMPANY_SLOTS)
+        values = dict(Slot.objects.filter(name__in=mapping.values()).values_list('name', 'string_val'))
+        return dict((field, values.get(name) or '') for field, name in mapping.iteritems())
+
+    @staticmethod
+    def company_changed(sender, **kwargs):
+        Slot._company = (None, None, 0)
 
     class Meta:
         managed = False
         db_table = 'slots'
 
 
+fact.signals.company_changed.connect(Slot.company_changed)
+
+
+@gnucash
 class Transaction(models.Model):
 
     guid = models.CharField(primary_key=True, max_length=32)
@@ -110,11 +326,12 @@ class Transaction(models.Model):
         db_table = 'transactions'
 
 
+@gnucash
 class Split(models.Model):
 
     guid = models.CharField(primary_key=True, max_length=32)
-    tx_guid = models.CharField(max_length=32)
-    lot_guid = models.CharField(max_length=32)
+    transaction = models.ForeignKey(Transaction, db_column='tx_guid', db_constraint=False, related_name='splits')
+    lot = models.ForeignKey('Lot', db_column='lot_guid', null=True, db_constraint=False, related_name='splits')
     action = models.CharField(max_length=2048)
     value_num = models.IntegerField()
     value_denom = models.IntegerField()
@@ -123,10 +340,6 @@ class Split(models.Model):
     def amount(self):
         return 1.00 * self.value_num / self.value_denom
 
-    @property
-    def transaction(self):
-        return Transaction.objects.get(pk=self.tx_guid)
-
     @property
     def post_date(self):
         return self.transaction.post_date
@@ -139,6 +352,18 @@ class Split(models.Model):
         db_table = 'splits'
 
 
+@gnucash
+class Lot(models.Model):
+
+    guid = models.CharField(primary_key=True, max_length=32)
+    is_closed = models.IntegerField()
+
+    class Meta:
+        managed = False
+        db_table = 'lots'
+
+
+@gnucash
 class Term(models.Model):
 
     guid = models.CharField(primary_key=True, max_length=32)
@@ -149,9 +374,48 @@ class Term(models.Model):
         db_table = 'billterms'
 
 
+def prefetched(obj, name):
+    # Returns the related objects prefetch_related() loaded under name, or
+    # None if they were not prefetched.
+    cache = getattr(obj, '_prefetched_objects_cache', {})
+    if name not in cache:
+        return None
+    return list(cache[name])
+
+
+def cached(obj, field):
+    # Returns (True, object) if the object a foreign key points to was
+    # already loaded, by select_related(), prefetch_related() or an earlier
+    # access, and (False, None) otherwise.
+    name = obj._meta.get_field(field).get_cache_name()
+    if hasattr(obj, name):
+        return True, getattr(obj, name)
+    return False, None
+
+
+@gnucash
+class Taxtable(models.Model):
+
+    guid = models.CharField(primary_key=True, max_length=32)
+    name = models.CharField(max_length=50)
+
+    @property
+    def percent(self):
+        # The sum of all entries, like the invoice summary SQL.
+        entries = prefetched(self, 'entries')
+        if entries is None:
+            entries = fact.loader.current().filter(TaxtableEntry, self.guid, 'taxtable')
+        return sum([x.amount for x in entries])
+
+    class Meta:
+        managed = False
+        db_table = 'taxtables'
+
+
+@gnucash
 class TaxtableEntry(models.Model):
 
-    taxtable = models.CharField(max_length=32)
+    taxtable = models.ForeignKey(Taxtable, db_column='taxtable', db_constraint=False, related_name='entries')
     amount_num = models.IntegerField()
     amount_denom = models.IntegerField()
 
@@ -164,6 +428,19 @@ class TaxtableEntry(models.Model):
         db_table = 'taxtable_entries'
 
 
+class Owner(object):
+
+    # The customer or job owning an invoice or a job, given by the
+    # owner_type and owner_guid columns, from the ownership graph in
+    # fact.owners.
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        return fact.owners.graph().owner(instance.owner_type, instance.owner_guid)
+
+
+@gnucash
 class Customer(models.Model):
 
     guid = models.CharField(primary_key=True, max_length=32)
@@ -176,9 +453,7 @@ class Customer(models.Model):
 
     @property
     def invoices(self):
-        jobs = [x.guid for x in self.jobs]
-        jobs.append(self.guid)
-        return Invoice.objects.filter(owner_guid__in=jobs)
+        return Invoice.objects.filter(owner_guid__in=fact.owners.graph().owned_by(self.guid))
 
     @property
     def jobs(self):
@@ -192,6 +467,7 @@ class Customer(models.Model):
         db_table = 'customers'
 
 
+@gnucash
 class Job(models.Model):
 
     guid = models.CharField(primary_key=True, max_length=32)
@@ -199,18 +475,18 @@ class Job(models.Model):
     owner_guid = models.CharField(max_length=32)
     owner_type = models.IntegerField()
 
+    owner = Owner()
+
     @property
     def customer(self):
-        if self.owner_type == 2:
-            return Customer.objects.get(pk=self.owner_guid)
-        elif self.owner_type == 3:
-            return self.job.customer
-        return None
+        if self.owner is None:
+            return None
+        return fact.owners.graph().customer(self.owner_guid)
 
     @property
     def job(self):
         if self.owner_type == 3:
-            return Job.objects.get(pk=self.owner_guid)
+            return self.owner
         return None
 
     @property
@@ -222,10 +498,11 @@ class Job(models.Model):
         db_table = 'jobs'
 
 
+@gnucash
 class Entry(models.Model):
 
     guid = models.CharField(primary_key=True, max_length=32)
-    invoice = models.CharField(max_length=32)
+    invoice = models.ForeignKey('Invoice', db_column='invoice', db_constraint=False)
     description = models.CharField(max_length=2048)
     action = models.CharField(max_length=2048)
     quantity_num = models.IntegerField()
@@ -234,7 +511,7 @@ class Entry(models.Model):
     i_price_denom = models.IntegerField()
     i_discount_num = models.IntegerField()
     i_discount_denom = models.IntegerField()
-    i_taxtable = models.CharField(max_length=32)
+    taxtable = models.ForeignKey(Taxtable, db_column='i_taxtable', null=True, db_constraint=False, related_name='invoice_entries')
     i_taxable = models.IntegerField()
     i_taxincluded = models.IntegerField()
 
@@ -252,9 +529,14 @@ class Entry(models.Model):
 
     @property
     def tax_percent(self):
-        if not self.i_taxable:
+        if not self.i_taxable or self.taxtable_id is None:
             return 0
-        return TaxtableEntry.objects.get(taxtable=self.i_taxtable).amount
+        loaded, taxtable = cached(self, 'taxtable')
+        if loaded:
+            # A prefetched taxtable that does not exist is None.
+            return taxtable.percent if taxtable is not None else 0
+        entries = fact.loader.current().filter(TaxtableEntry, self.taxtable_id, 'taxtable')
+        return sum([x.amount for x in entries])
 
     @property
     def tax(self):
@@ -269,33 +551,81 @@ class Entry(models.Model):
         db_table = 'entries'
 
 
+@gnucash
 class Invoice(models.Model):
 
     guid = models.CharField(primary_key=True, max_length=32)
     id = models.CharField(max_length=2048)
-    terms = models.CharField(max_length=32)
+    term = models.ForeignKey(Term, db_column='terms', null=True, db_constraint=False, related_name='invoices')
     notes = models.CharField(max_length=2048)
     date_opened = models.DateTimeField()
     date_posted = models.DateTimeField()
     owner_guid = models.CharField(max_length=32)
     owner_type = models.IntegerField()
-    post_lot = models.CharField(max_length=32)
+    lot = models.ForeignKey(Lot, db_column='post_lot', null=True, db_constraint=False, related_name='invoices')
+
+    owner = Owner()
+
+    # Everything needed to show or render an invoice, for prefetch_related.
+    # Payments are loaded by fact.payments, and owners come from
+    # fact.owners.
+    RELATED = ('term', 'entry_set__taxtable__entries')
 
     @staticmethod
     def invoices():
         return Invoice.objects.filter(Q(owner_type=3) | Q(owner_type=2)).order_by('-id')
 
+    @staticmethod
+    def related(queryset=None):
+        if queryset is None:
+            queryset = Invoice.objects.all()
+        return queryset.prefetch_related(*Invoice.RELATED)
+
+    @staticmethod
+    def prefetch(invoices, lookups=RELATED, payments=True, batch_size=100):
+        # Like related(), for a list of invoices, optionally loading their
+        # payment status as well. Works in batches, to keep the IN lists of
+        # the entry and taxtable queries below SQLite's limit on query
+        # parameters.
+        for i in range(0, len(invoices), batch_size):
+            prefetch_related_objects(invoices[i:i + batch_size], lookups)
+        if payments:
+            fact.payments.attach(invoices)
+        return invoices
+
     @property
     def entries(self):
-        return Entry.objects.filter(invoice=self.guid)
+        entries = prefetched(self, 'entry')
+        if entries is None:
+            # Not prefetched: load the entries and the tax tables they use
+            # through the request's loader, two queries per invoice.
+            loader = fact.loader.current()
+            entries = loader.filter(Entry, self.guid, 'invoice')
+            loader.prime(TaxtableEntry, [x.taxtable_id for x in entries if x.i_taxable], 'taxtable')
+            entries = list(entries)
+        return entries
 
     @property
-    def paid(self):
-        return sum([x.amount for x in self.payments])
+    def payment_status(self):
+        if not hasattr(self, '_payment_status'):
+            fact.payments.attach([self])
+        return self._payment_status
+
+    @property
+    def payments(self):
+        return self.payment_status.payments
 
     @property
     def due(self):
-        return sum([x.amount for x in self.transactions])
+        return self.payment_status.balance
+
+    @property
+    def paid(self):
+        return self.payment_status.paid
+
+    @property
+    def overpaid(self):
+        return self.payment_status.overpaid
 
     @property
     def net(self):
@@ -311,16 +641,14 @@ class Invoice(models.Model):
 
     @property
     def customer(self):
-        if self.owner_type == 2:
-            return Customer.objects.get(pk=self.owner_guid)
-        elif self.owner_type == 3:
-            return self.job.customer
-        return None
+        if self.owner is None:
+            return None
+        return fact.owners.graph().customer(self.owner_guid)
 
     @property
     def job(self):
         if self.owner_type == 3:
-            return Job.objects.get(pk=self.owner_guid)
+            return self.owner
         return None
 
     @property
@@ -330,30 +658,21 @@ class Invoice(models.Model):
 
     @property
     def date_due(self):
-        days = Term.objects.get(pk=self.terms).duedays
-        return self.date_invoice + relativedelta(days=+days)
-
-    @property
-    def transactions(self):
-        if self.post_lot is None:
-            return Split.objects.none()
-        return Split.objects.filter(action='Invoice', lot_guid=self.post_lot)
-
-    @property
-    def all_transactions(self):
-        if self.post_lot is None:
-            return Split.objects.none()
-        return Split.objects.filter(~Q(action='Auto Split'), lot_guid=self.post_lot)
-
-    @property
-    def payments(self):
-        return self.transactions.filter(value_num__lte=0)
+        if self.term_id is None or self.date_posted is None:
+            return None
+        loaded, term = cached(self, 'term')
+        if not loaded:
+            term = fact.loader.current().get(Term, self.term_id)
+        # A term that does not exist is None.
+        if term is None:
+            return None
+        return self.date_invoice + relativedelta(days=+term.duedays)
 
     @property
-    def paid(self):
-        if self.date_posted is not None and self.due == 0:
-            return sum(self.transactions) == 0
-        return False
+    def printable(self):
+        # A PDF needs both the invoice date and the due date, so only
+        # posted invoices with a billing term can be rendered.
+        return self.date_due is not None
 
     def __unicode__(self):
         return 'Invoice ' + self.id
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The customer/job ownership graph, held in process memory.
+#
+# An invoice or job is owned by a customer (owner type 2) or by a job
+# (owner type 3), and jobs may own other jobs. The graph is loaded with
+# one query per table, every owner is mapped to its root customer once,
+# and lookups are then dictionary reads. The loaded graph is kept until
+# the change detector reports changed customers or jobs, and at most
+# FACT_OWNERS_TTL seconds, for when the detector is not running.
+
+import hashlib
+import time
+
+from django.conf import settings
+
+import fact.metrics
+import fact.models
+import fact.signals
+
+
+# (customer guid, customer name, job guid, job name) of an unknown owner.
+NO_OWNER = (None, None, None, None)
+
+CUSTOMER = 2
+JOB = 3
+
+
+class Graph(object):
+
+    def __init__(self, customers, jobs):
+        self.customers = dict((x.guid, x) for x in customers)
+        self.jobs = dict((x.guid, x) for x in jobs)
+        self.roots = {}
+        for guid in self.customers:
+            self.roots[guid] = guid
+        for guid in self.jobs:
+            self.roots[guid] = self.find_root(guid)
+        self.members = {}
+        for guid, root in self.roots.iteritems():
+            self.members.setdefault(root, []).append(guid)
+        self.rows = {}
+        for guid, customer in self.customers.iteritems():
+            self.rows[guid] = (guid, customer.name, None, None)
+        for guid, job in self.jobs.iteritems():
+            root = self.roots[guid]
+            self.rows[guid] = (root, self.customers[root].name if root else None, guid, job.name)
+
+    @staticmethod
+    def load():
+        return Graph(fact.models.Customer.objects.all(), fact.models.Job.objects.all())
+
+    def digest(self):
+        # Changes whenever a customer or job was added, removed or edited.
+        values = [(x.guid, x.name, x.addr_name, x.addr_addr1, x.addr_addr2, x.addr_addr3, x.addr_addr4)
+                for x in self.customers.itervalues()]
+        values.extend((x.guid, x.name, x.owner_guid, x.owner_type) for x in self.jobs.itervalues())
+        return hashlib.md5(repr(sorted(values)).encode('utf-8')).hexdigest()
+
+    def find_root(self, guid):
+        # Follows jobs owned by other jobs up to the customer, or returns
+        # None for jobs without one.
+        seen = set()
+        while guid in self.jobs:
+            if guid in seen:
+                return None
+            seen.add(guid)
+            job = self.jobs[guid]
+            if job.owner_type not in (CUSTOMER, JOB):
+                return None
+            guid = job.owner_guid
+        if guid in self.customers:
+            return guid
+        return None
+
+    def owner(self, owner_type, guid):
+        # The Customer or Job given by an owner_type and owner_guid pair.
+        if owner_type == CUSTOMER:
+            return self.customers.get(guid)
+        elif owner_type == JOB:
+            return self.jobs.get(guid)
+        return None
+
+    def customer(self, guid):
+        # The root Customer of a customer or job GUID.
+        return self.customers.get(self.roots.get(guid))
+
+    def get(self, guid, default=NO_OWNER):
+        # The (customer guid, customer name, job guid, job name) tuple of a
+        # customer or job GUID.
+        return self.rows.get(guid, default)
+
+    def owned_by(self, customer):
+        # The GUIDs of a customer and of every job under it.
+        return self.members.get(customer, [])
+
+    def group(self, invoices):
+        # Groups objects with an owner_guid attribute by the GUID of their
+        # root customer, keeping their order.
+        result = {}
+        for invoice in invoices:
+            result.setdefault(self.roots.get(invoice.owner_guid), []).append(invoice)
+        return result
+
+
+_state = {'graph' : None, 'loaded' : 0}
+
+
+def graph():
+    now = time.time()
+    current = _state['graph']
+    if current is not None and now - _state['loaded'] < getattr(settings, 'FACT_OWNERS_TTL', 300):
+        fact.metrics.cache_result('owners', True)
+        return current
+    fact.metrics.cache_result('owners', False)
+    current = Graph.load()
+    _state['graph'], _state['loaded'] = current, now
+    return current
+
+
+def invalidate():
+    _state['graph'] = None
+
+
+def owners_changed(sender, **kwargs):
+    invalidate()
+
+
+fact.signals.owners_changed.connect(owners_changed)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Keyset (cursor) pagination. A page is described by the sort key of the
+# last row on the previous page, so fetching any page is an index range
+# scan no matter how deep into the result set it is. Ties are broken by
+# the primary key.
+
+import base64
+import json
+
+from django.db.models import Q
+from django.utils import dateparse
+
+
+class Page(object):
+
+    def __init__(self, rows, next_cursor):
+        self.rows = rows
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def encode(value, pk):
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, pk]))
+
+
+def decode(cursor, is_date=False):
+    # Returns a tuple of (value, pk), or None for an invalid cursor.
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        return None
+    if is_date and value is not None:
+        value = dateparse.parse_datetime(value)
+        if value is None:
+            return None
+    return value, pk
+
+
+def paginate(queryset, field, descending=False, cursor=None, size=50):
+    # Returns one Page of queryset, ordered by field and the primary key.
+    # A values() queryset must include both.
+    # Rows where field is NULL come last in either direction, ordered by
+    # the primary key. Their cursors carry a NULL value.
+    pk = queryset.model._meta.pk.name
+    model_field = queryset.model._meta.get_field(field)
+    is_date = model_field.get_internal_type() in ('DateField', 'DateTimeField')
+    key = decode(cursor, is_date) if cursor else None
+    op = 'lt' if descending else 'gt'
+    prefix = '-' if descending else ''
+    rows = []
+    if key is None or key[0] is not None:
+        values = queryset.filter(**{field + '__isnull' : False})
+        if key is not None:
+            values = values.filter(Q(**{field + '__' + op : key[0]}) |
+                    Q(**{field : key[0], pk + '__' + op : key[1]}))
+        rows = list(values.order_by(prefix + field, prefix + pk)[:size + 1])
+    if len(rows) <= size and model_field.null:
+        nulls = queryset.filter(**{field + '__isnull' : True})
+        if key is not None and key[0] is None:
+            nulls = nulls.filter(**{pk + '__' + op : key[1]})
+        rows += list(nulls.order_by(prefix + pk)[:size + 1 - len(rows)])
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        last = rows[-1]
+        if isinstance(last, dict):
+            next_cursor = encode(last[field], last[pk])
+        else:
+            next_cursor = encode(getattr(last, field), getattr(last, pk))
+    return Page(rows, next_cursor)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Payment status of invoices, computed from the splits in their posting
+# lots.
+#
+# GnuCash posts an invoice as an 'Invoice' split in a lot, and every
+# payment applied to the invoice adds another 'Invoice' split, with a
+# negative value, to the same lot. The splits of any number of invoices
+# are read with their transaction dates in a single query, and summed as
+# fractions, so a fully paid invoice has a balance of exactly zero.
+
+import decimal
+import fractions
+
+from django.db import connections
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+import fact.models
+
+
+# The splits are selected by lot in a subquery, as GnuCash has no index on
+# splits.lot_guid; joining them to each invoice directly would scan the
+# splits table once per invoice.
+LOTS_SQL = """
+    SELECT i.guid, i.date_posted IS NOT NULL, s.guid, s.value_num, s.value_denom, s.post_date
+    FROM invoices i
+    LEFT JOIN (
+        SELECT sp.lot_guid, sp.guid, sp.value_num, sp.value_denom, tx.post_date
+        FROM splits sp
+        JOIN transactions tx ON tx.guid = sp.tx_guid
+        WHERE sp.action = 'Invoice'
+        AND sp.lot_guid IN (SELECT post_lot FROM invoices WHERE guid IN (%(invoices)s))
+    ) s ON s.lot_guid = i.post_lot
+    WHERE i.guid IN (%(invoices)s)
+    ORDER BY i.guid, s.post_date, s.guid
+"""
+
+# Keep IN lists below SQLite's parameter limit.
+CHUNK_SIZE = 500
+
+
+class Payment(object):
+
+    def __init__(self, guid, date, value):
+        self.guid = guid
+        self.date = date
+        # Negative, like the split.
+        self.value = value
+
+    @property
+    def amount(self):
+        return decimal_value(self.value)
+
+
+class Status(object):
+
+    # Values are kept as exact fractions, and only converted to decimals
+    # when read.
+
+    def __init__(self, guid, posted):
+        self.guid = guid
+        self.posted = posted
+        self.charged_value = fractions.Fraction(0)
+        self.paid_value = fractions.Fraction(0)
+        self.payments = []
+
+    def add(self, guid, date, value):
+        if value > 0:
+            self.charged_value += value
+        else:
+            self.paid_value -= value
+            self.payments.append(Payment(guid, date, value))
+
+    @property
+    def charged(self):
+        return decimal_value(self.charged_value)
+
+    @property
+    def paid_amount(self):
+        return decimal_value(self.paid_value)
+
+    @property
+    def balance(self):
+        return decimal_value(self.charged_value - self.paid_value)
+
+    @property
+    def paid(self):
+        return self.posted and self.charged_value == self.paid_value
+
+    @property
+    def overpaid(self):
+        return self.posted and self.charged_value < self.paid_value
+
+    @property
+    def last_payment(self):
+        if not self.payments:
+            return None
+        return self.payments[-1].date
+
+
+def decimal_value(value):
+    return decimal.Decimal(value.numerator) / decimal.Decimal(value.denominator)
+
+
+def aware(date):
+    if date is not None and timezone.is_naive(date):
+        return timezone.make_aware(date, timezone.utc)
+    return date
+
+
+def load(invoices):
+    # Returns a dictionary of invoice GUID -> Status, for a queryset of
+    # invoices or a list of invoice GUIDs. A queryset is passed to the
+    # database as a subquery; a list is sent in chunks.
+    db = fact.models.Invoice.objects.db
+    if isinstance(invoices, QuerySet):
+        db = invoices.db
+        subquery = invoices.order_by().values('guid').query
+        sql, params = subquery.get_compiler(using=db).as_sql()
+        queries = [(sql, params)]
+    else:
+        invoices = list(invoices)
+        queries = [(', '.join(['%s'] * len(chunk)), chunk)
+                for chunk in (invoices[i:i+CHUNK_SIZE] for i in range(0, len(invoices), CHUNK_SIZE))]
+    cursor = connections[db].cursor()
+    result = {}
+    for sql, params in queries:
+        cursor.execute(LOTS_SQL % {'invoices' : sql}, tuple(params) * 2)
+        for guid, posted, split, num, denom, post_date in cursor.fetchall():
+            status = result.get(guid)
+            if status is None:
+                status = result[guid] = Status(guid, bool(posted))
+            if split is not None:
+                status.add(split, aware(post_date), fractions.Fraction(num, denom))
+    return result
+
+
+def attach(invoices):
+    # Loads the status of a list of Invoice objects, for their payments,
+    # due and paid properties.
+    statuses = load([x.guid for x in invoices])
+    for invoice in invoices:
+        invoice._payment_status = statuses.get(invoice.guid) or Status(invoice.guid, invoice.date_posted is not None)
+    return invoices
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Disk-backed cache of rendered invoice PDFs.
+#
+# Files are named after the invoice GUID and a fingerprint of everything
+# the PDF depends on, so a changed invoice simply gets a new key and the
+# stale file ages out, or is deleted as soon as the GnuCash change detector
+# reports the change.
+# The file mtime records when the PDF was rendered and is used for the
+# Last-Modified header; the atime is bumped on every hit and drives LRU
+# eviction once the cache grows past FACT_PDF_CACHE_SIZE bytes.
+
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+
+import fact.metrics
+import fact.signals
+
+
+# Bump this whenever the PDF layout changes, to invalidate every entry.
+RENDER_VERSION = 1
+
+
+def cache_dir():
+    return getattr(settings, 'FACT_PDF_CACHE_DIR', os.path.join(settings.PROJECT_ROOT, 'cache', 'pdf'))
+
+
+def cache_size():
+    return getattr(settings, 'FACT_PDF_CACHE_SIZE', 256 * 1024 * 1024)
+
+
+def path(key):
+    return os.path.join(cache_dir(), key + '.pdf')
+
+
+def fingerprint(invoice, company, options, lang):
+    # Reads the invoice's related objects, so the invoice should come from
+    # fact.models.Invoice.related() to fetch them in a few queries; the
+    # render then reuses them.
+    entries = [(x.guid, x.description, x.action, x.quantity_num, x.quantity_denom, x.i_price_num,
+            x.i_price_denom, x.i_taxable, x.taxtable_id, x.tax_percent) for x in invoice.entries]
+    status = invoice.payment_status
+    payments = (status.charged, [(x.guid, x.date, x.amount) for x in status.payments])
+    customer = invoice.customer
+    if customer is not None:
+        customer = (customer.addr_name, customer.addr_addr1, customer.addr_addr2, customer.addr_addr3, customer.addr_addr4)
+    try:
+        logo = os.stat(settings.FACT_LOGO).st_mtime
+    except (AttributeError, OSError):
+        logo = None
+
+    parts = [
+        RENDER_VERSION,
+        lang,
+        (invoice.guid, invoice.id, invoice.notes, invoice.date_posted, invoice.term_id, invoice.lot_id),
+        invoice.date_due,
+        customer,
+        sorted(entries),
+        payments,
+        sorted(company.items()),
+        sorted(options.items()),
+        logo,
+    ]
+    return invoice.guid + '-' + hashlib.sha1(repr(parts)).hexdigest()
+
+
+def mtime(key):
+    # Returns the render time of a cached PDF, or None on a cache miss.
+    try:
+        return os.stat(path(key)).st_mtime
+    except OSError:
+        return None
+
+
+def read(key):
+    filename = path(key)
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+        st = os.stat(filename)
+        os.utime(filename, (time.time(), st.st_mtime))
+    except (IOError, OSError):
+        fact.metrics.cache_result('pdf', False)
+        return None
+    fact.metrics.cache_result('pdf', True)
+    return data
+
+
+def write(key, data):
+    directory = cache_dir()
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another worker may have created it in the meantime.
+            if not os.path.isdir(directory):
+                raise
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, path(key))
+    evict()
+    return mtime(key) or time.time()
+
+
+def delete(key):
+    try:
+        os.unlink(path(key))
+    except OSError:
+        pass
+
+
+def evict():
+    # Remove least recently used files until the cache fits its size cap.
+    directory = cache_dir()
+    files = []
+    total = 0
+    for name in os.listdir(directory):
+        if not name.endswith('.pdf'):
+            continue
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        files.append((st.st_atime, st.st_size, name))
+        total += st.st_size
+    files.sort()
+    limit = cache_size()
+    while files and total > limit:
+        atime, size, name = files.pop(0)
+        try:
+            os.unlink(os.path.join(directory, name))
+        except OSError:
+            pass
+        total -= size
+
+
+def latest(guid):
+    # Returns the key of the most recently rendered PDF of an invoice, or
+    # None if there is none.
+    try:
+        names = os.listdir(cache_dir())
+    except OSError:
+        return None
+    keys = [name[:-4] for name in names if name.startswith(guid + '-') and name.endswith('.pdf')]
+    if not keys:
+        return None
+    return max(keys, key=lambda key: mtime(key) or 0)
+
+
+def invalidate(guids=None):
+    # Deletes the cached PDFs of the given invoices, or every cached PDF.
+    if guids is not None:
+        guids = set(guids)
+    try:
+        names = os.listdir(cache_dir())
+    except OSError:
+        return
+    for name in names:
+        if name.endswith('.pdf') and (guids is None or name.split('-', 1)[0] in guids):
+            try:
+                os.unlink(os.path.join(cache_dir(), name))
+            except OSError:
+                pass
+
+
+def invoices_changed(sender, guids, detected, **kwargs):
+    if detected:
+        invalidate(guids)
+
+
+def company_changed(sender, detected, **kwargs):
+    if detected:
+        invalidate()
+
+
+fact.signals.invoices_changed.connect(invoices_changed)
+fact.signals.company_changed.connect(company_changed)
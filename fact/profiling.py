@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Named-stage profiling of PDF generation. Every stage records wall time,
+# the number of queries run and, with FACT_PDF_PROFILE_MEMORY on and
+# tracemalloc available (Python 3.4 or pytracemalloc), the change in
+# traced memory. One request in FACT_PDF_PROFILE_RATE is profiled; 0 turns
+# profiling off. Results are logged to the "fact.profile" logger and sent
+# in an X-Fact-Profile response header.
+
+import itertools
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import fact.queries
+
+
+logger = logging.getLogger('fact.profile')
+
+_counter = itertools.count()
+
+
+class NullProfile(object):
+
+    def mark(self, name):
+        pass
+
+    def finish(self, response=None):
+        pass
+
+
+NULL = NullProfile()
+
+
+class Profile(object):
+
+    # Stages are laps: mark(name) ends the stage called name, which began
+    # at the previous mark or when the profile was created.
+
+    def __init__(self, name, memory=False):
+        self.name = name
+        self.stages = []
+        self.memory = memory and tracemalloc is not None
+        self.started_tracing = False
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.recorder = fact.queries.QueryRecorder()
+        self.recorder.start()
+        self.last = self.snapshot()
+
+    def snapshot(self):
+        queries = sum(len(connections[alias].queries) for alias in connections)
+        memory = None
+        if self.memory:
+            memory = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        return time.time(), queries, memory
+
+    def mark(self, name):
+        now = self.snapshot()
+        stage = {
+            'stage' : name,
+            'ms' : round((now[0] - self.last[0]) * 1000, 2),
+            'queries' : now[1] - self.last[1],
+        }
+        if self.memory:
+            stage['alloc'] = now[2] - self.last[2]
+        self.stages.append(stage)
+        self.last = self.snapshot()
+
+    def finish(self, response=None):
+        self.recorder.stop()
+        if self.started_tracing:
+            tracemalloc.stop()
+        logger.info(json.dumps({'profile' : self.name, 'stages' : self.stages}))
+        if response is not None:
+            response['X-Fact-Profile'] = ', '.join('%s=%.1fms/%dq' % (s['stage'], s['ms'], s['queries']) for s in self.stages)
+
+
+def start(name):
+    # Returns a Profile for one request in FACT_PDF_PROFILE_RATE, and the
+    # no-op NULL profile otherwise.
+    rate = getattr(settings, 'FACT_PDF_PROFILE_RATE', 0)
+    if not rate or next(_counter) % rate:
+        return NULL
+    return Profile(name, getattr(settings, 'FACT_PDF_PROFILE_MEMORY', False))
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Per-alias query recording. While a recorder is running, every database
+# connection uses Django's debug cursor, so statements and their timings
+# end up in connection.queries even when DEBUG is off.
+
+from django.db import connections
+
+
+class QueryStats(object):
+
+    def __init__(self, alias, queries, slowest=5):
+        self.alias = alias
+        self.queries = queries
+        self.count = len(queries)
+        self.time = sum(float(q['time']) for q in queries)
+        self.slowest = sorted(queries, key=lambda q: float(q['time']), reverse=True)[:slowest]
+
+    def as_dict(self):
+        return {
+            'count' : self.count,
+            'time' : round(self.time, 6),
+            'slowest' : [{'sql' : q['sql'], 'time' : float(q['time'])} for q in self.slowest],
+        }
+
+
+class QueryRecorder(object):
+
+    def __init__(self, slowest=5):
+        self.slowest = slowest
+        self.state = {}
+
+    def start(self):
+        for alias in connections:
+            conn = connections[alias]
+            self.state[alias] = (conn.use_debug_cursor, len(conn.queries))
+            conn.use_debug_cursor = True
+
+    def stop(self):
+        # Returns a dictionary of alias -> QueryStats.
+        stats = {}
+        for alias, (use_debug_cursor, offset) in self.state.items():
+            conn = connections[alias]
+            stats[alias] = QueryStats(alias, conn.queries[offset:], self.slowest)
+            conn.use_debug_cursor = use_debug_cursor
+        self.state = {}
+        return stats
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats = self.stop()
+        return False
+
+
+def view_name(view_func):
+    return '%s.%s' % (view_func.__module__, view_func.__name__)
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Invoice PDF renderer. Nothing in here depends on the request, so it can
+# be called from views as well as from management commands and worker
+# processes.
+
+import io
+import os
+import time
+
+from django.conf import settings
+from django.utils import translation
+from django.utils.translation import ugettext as _
+
+import fact.loader
+import fact.metrics
+import fact.models
+import fact.pdfcache
+import fact.profiling
+
+
+FONT = 'Helvetica'
+
+
+class Resources(object):
+
+    # Static resources used by every PDF, loaded once per process. The logo
+    # is reloaded when the file changes. The company profile is cached by
+    # Slot.company(), which reloads it when the GnuCash business slots
+    # change.
+
+    def __init__(self):
+        self._logo = None
+        self._logo_mtime = None
+        self._stylesheet = None
+        self._table_style = None
+
+    def logo(self):
+        # Returns a tuple of (decoded image, height/width aspect ratio).
+        from reportlab.lib import utils
+        mtime = os.stat(settings.FACT_LOGO).st_mtime
+        hit = self._logo is not None and mtime == self._logo_mtime
+        fact.metrics.cache_result('logo', hit)
+        if not hit:
+            img = utils.ImageReader(settings.FACT_LOGO)
+            iw, ih = img.getSize()
+            # Decode the image data now, so the reader can be reused.
+            img.getRGBData()
+            self._logo = (img, ih / float(iw))
+            self._logo_mtime = mtime
+        return self._logo
+
+    def stylesheet(self):
+        from reportlab.lib.styles import getSampleStyleSheet
+        if self._stylesheet is None:
+            self._stylesheet = getSampleStyleSheet()
+        return self._stylesheet
+
+    def table_style(self):
+        # Table style commands shared by all invoices. Per-invoice commands
+        # are added to a TableStyle built from these.
+        from reportlab.lib import colors
+        if self._table_style is None:
+            self._table_style = [
+                ('FONT', (0,0), (-1,0), FONT + '-Bold'),
+                ('LINEBELOW', (0,0), (-1,0), 1, colors.black),
+            ]
+        return self._table_style
+
+    def company(self):
+        return fact.models.Slot.company()
+
+
+resources = Resources()
+
+
+def render(invoice, lang, company=None, profile=fact.profiling.NULL):
+    if company is None:
+        company = resources.company()
+    payment_text = fact.models.Option.payment_text(lang)
+    profile.mark('options')
+    output = io.BytesIO()
+    started = time.time()
+    with translation.override(lang), fact.loader.scope():
+        draw(output, invoice, company, payment_text, profile)
+    data = output.getvalue()
+    fact.metrics.PDFS_RENDERED.inc()
+    fact.metrics.PDF_SECONDS.observe(time.time() - started)
+    fact.metrics.PDF_BYTES.observe(len(data))
+    return data
+
+
+def render_cached(invoice, lang):
+    # Returns a tuple of (cache key, render time, PDF data), rendering and
+    # storing the PDF on a cache miss.
+    company = resources.company()
+    options = fact.models.Option.opt_list(lang)
+    key = fact.pdfcache.fingerprint(invoice, company, options, lang)
+    data = fact.pdfcache.read(key)
+    if data is not None:
+        return key, fact.pdfcache.mtime(key), data
+    data = render(invoice, lang, company)
+    return key, fact.pdfcache.write(key, data), data
+
+
+def draw(output, invoice, company, payment_text, profile=fact.profiling.NULL):
+    import reportlab.pdfgen.canvas
+    from reportlab.lib import pagesizes, units, colors
+    from reportlab.platypus import Paragraph
+    from reportlab.platypus.tables import Table, TableStyle
+    from django.contrib.humanize.templatetags.humanize import intcomma
+    profile.mark('imports')
+
+    p = reportlab.pdfgen.canvas.Canvas(output, pagesize=pagesizes.A4)
+    width, height = pagesizes.A4
+    font = FONT
+
+    # Right-hand stuff
+    x = units.cm * 14;
+    p.setFont(font + '-Bold', 18)
+    p.drawString(x, height-(units.cm*4.5), _('Invoice %s') % invoice.id)
+    p.setFont(font, 10)
+    p.drawString(x, height-(units.cm*5.5), _('Invoice date: %s') % invoice.date_invoice.strftime('%d.%m.%Y'))
+    p.drawString(x, height-(units.cm*6), _('Due date: %s') % invoice.date_due.strftime('%d.%m.%Y'))
+
+    profile.mark('header')
+
+    # Logo
+    img, aspect = resources.logo()
+    p.drawImage(img, x+(units.cm*1), height-(units.cm*2.25), width=units.cm*4, height=units.cm*4*aspect, mask='auto')
+    profile.mark('logo')
+
+    # Left-hand header stuff
+    x = units.cm * 2;
+    p.setFont(font + '-Oblique', 8)
+    p.drawString(x, height-(units.cm*1.25), company['name'])
+    address = company['address'].split("\n")
+    base = 1.65
+    for a in address:
+        p.drawString(x, height-(units.cm*base), a)
+        base += 0.4
+
+
+    # Recipient name and address
+    y = units.cm*4.5
+    base = 0.5
+    customer = invoice.customer
+    p.setFont(font, 10)
+    p.drawString(x, height-y, customer.addr_name); y += units.cm*base
+    p.drawString(x, height-y, customer.addr_addr1); y += units.cm*base
+    p.drawString(x, height-y, customer.addr_addr2); y += units.cm*base
+    p.drawString(x, height-y, customer.addr_addr3); y += units.cm*base
+    p.drawString(x, height-y, customer.addr_addr4); y += units.cm*base
+    y += units.cm*2
+    profile.mark('customer')
+
+    # Main
+    p.setFont(font + '-Bold', 14)
+    p.drawString(x, height-y, _('Specification'))
+    y += units.cm*1
+    p.setFont(font, 10)
+    fmt = '{0:.2f}'
+
+    # Get our invoice entries, headers, etc
+    style = TableStyle(resources.table_style())
+    invoice_entries = []
+    headers = [_('Description'), _('Amount'), _('Type'), _('Unit price'), _('VAT'), _('Net')]
+    for entry in invoice.entries:
+        invoice_entries.append([
+            entry.description,
+            intcomma(fmt.format(entry.quantity)),
+            _(entry.action),
+            intcomma(fmt.format(entry.unitprice)),
+            intcomma(fmt.format(entry.tax_percent)) + '%',
+            intcomma(fmt.format(entry.net))
+        ])
+    style.add('LINEBELOW', (0, len(invoice_entries)), (-1, len(invoice_entries)), 1, colors.black)
+    sums = []
+    sums.append([_('Net'), '', '', '', '', intcomma(fmt.format(invoice.net))])
+    sums.append([_('VAT'), '', '', '', '', intcomma(fmt.format(invoice.tax))])
+    payments = invoice.payments
+    if payments:
+        sums.append([_('Subtotal'), '', '', '', '', intcomma(fmt.format(invoice.gross))])
+        style.add('LINEBELOW', (0, len(invoice_entries)+3), (-1, len(invoice_entries)+3), 1, colors.black)
+        for payment in payments:
+            sums.append([_('Paid %s') + payment.date.strftime('%d.%m.%Y'), '', '', '', '', intcomma(fmt.format(payment.amount))])
+        ln = len(invoice_entries) + len(sums)
+        style.add('LINEBELOW', (0, ln), (-1, ln), 1, colors.black)
+    else:
+        style.add('LINEBELOW', (0, len(invoice_entries)+2), (-1, len(invoice_entries)+2), 1, colors.black)
+    sums.append([_('Amount due'), '', '', '', '', intcomma(fmt.format(invoice.due))])
+    ln = len(invoice_entries) + len(sums)
+    style.add('BACKGROUND', (0, ln), (-1, ln), colors.wheat)
+    style.add('FONT', (0, ln), (-1, ln), font + '-Bold')
+    style.add('LINEBELOW', (0, ln), (-1, ln), 2, colors.black)
+    profile.mark('entries')
+
+    # Draw the table
+    t = Table([headers] + invoice_entries + sums,
+            ([units.cm*6.5, units.cm*1.75, units.cm*2, units.cm*2.5, units.cm*2, units.cm*2.25])
+            )
+    t.setStyle(style)
+    w, h = t.wrapOn(p, units.cm*19, units.cm*8)
+    y += h
+    t.drawOn(p, x, height-y)
+    profile.mark('table')
+
+    # Bank account number
+    stylesheet = resources.stylesheet()
+    if invoice.notes:
+        txt = invoice.notes + '<br/><br/>'
+    else:
+        txt = ''
+    txt += payment_text
+    pr = Paragraph(txt, stylesheet['BodyText'])
+    w, h = pr.wrapOn(p, units.cm*17, units.cm*6)
+    y += pr.height + (units.cm*1)
+    pr.drawOn(p, x, height-y)
+    profile.mark('paragraph')
+
+    # Footer stuff
+    p.setFont(font + '-BoldOblique', 8)
+    p.drawString(x, units.cm*2.8, company['name'])
+    p.setFont(font + '-Oblique', 8)
+    p.drawString(x, units.cm*2.4, address[0])
+    p.drawString(x, units.cm*2, address[1])
+
+    p.drawString(units.cm*8, units.cm*2.4, 'Web: ' + company['url'])
+    p.drawString(units.cm*8, units.cm*2, 'E-post: ' + company['email'])
+
+    p.drawString(units.cm*14, units.cm*2.4, 'Telefon: ' + company['phone'])
+    p.drawString(units.cm*14, units.cm*2, 'Org.nr: ' + company['id'])
+
+    # Close the PDF object cleanly, and we're done.
+    p.showPage()
+    p.save()
+    profile.mark('save')
@@ -23,19 +23,128 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-def get_db_name(model):
-    if model.__name__ == 'Invoice' or model.__name__ == 'Transaction' \
-            or model.__name__ == 'Entry' or model.__name__ == 'TaxtableEntry' \
-            or model.__name__ == 'Customer' or model.__name__ == 'Job' \
-            or model.__name__ == 'Term' or model.__name__ == 'Slot' \
-            or model.__name__ == 'Split':
-        return 'gnucash'
-    return 'default'
+# Database routing. Models listed in fact.models.GNUCASH_MODELS are read
+# from the GnuCash database, everything else lives in "default".
+#
+# FACT_GNUCASH_REPLICAS lists the database aliases holding a copy of the
+# GnuCash database, the first being the primary. Reads go to one healthy
+# replica picked at random, and every read in the same request (or, outside
+# requests, the same thread) stays on that replica so the data it sees is
+# consistent. Replicas are checked at most every FACT_REPLICA_CHECK
+# seconds; one that does not answer, or lags more than FACT_REPLICA_MAX_LAG
+# seconds behind, is skipped until it recovers.
+
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+import fact.models
+
+
+PRIMARY = 'gnucash'
+
+# Replication lag in seconds, or 0 where it cannot be measured.
+LAG_SQL = {
+    'postgresql' : """
+        SELECT CASE WHEN pg_is_in_recovery()
+            THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+            ELSE 0 END
+    """,
+}
+
+_local = threading.local()
+_lock = threading.Lock()
+
+# alias -> (healthy, lag, checked)
+_health = {}
+
+
+def replicas():
+    return tuple(getattr(settings, 'FACT_GNUCASH_REPLICAS', (PRIMARY,)))
+
+
+def is_gnucash(alias):
+    return alias in replicas()
+
+
+def check(alias):
+    # Returns a tuple of (healthy, lag in seconds).
+    connection = connections[alias]
+    try:
+        cursor = connection.cursor()
+        cursor.execute(LAG_SQL.get(connection.vendor, 'SELECT 0'))
+        lag = float(cursor.fetchone()[0] or 0)
+    except DatabaseError:
+        connection.close()
+        return False, None
+    return lag <= getattr(settings, 'FACT_REPLICA_MAX_LAG', 30), lag
+
+
+def health(alias):
+    now = time.time()
+    with _lock:
+        state = _health.get(alias)
+    if state is None or now - state[2] >= getattr(settings, 'FACT_REPLICA_CHECK', 10):
+        healthy, lag = check(alias)
+        state = (healthy, lag, now)
+        with _lock:
+            _health[alias] = state
+    return state
+
+
+def mark_down(alias):
+    # Called when a query on alias failed. The replica is skipped until its
+    # next health check.
+    with _lock:
+        _health[alias] = (False, None, time.time())
+    if getattr(_local, 'alias', None) == alias:
+        unpin()
+
+
+def choose():
+    aliases = replicas()
+    if len(aliases) == 1:
+        return aliases[0]
+    healthy = [alias for alias in aliases if health(alias)[0]]
+    if not healthy:
+        return aliases[0]
+    return random.choice(healthy)
+
+
+def pinned():
+    # Returns the replica the current request reads from, picking one on
+    # first use.
+    alias = getattr(_local, 'alias', None)
+    if alias is None:
+        alias = _local.alias = choose()
+    return alias
+
+
+def unpin():
+    _local.alias = None
+
 
 class FactRouter(object):
+
+    def gnucash(self, model):
+        # Deferred-field subclasses share the concrete model's database.
+        return model._meta.concrete_model in fact.models.GNUCASH_MODELS
+
     def db_for_read(self, model, **hints):
-        return get_db_name(model)
+        if self.gnucash(model):
+            return pinned()
+        return 'default'
 
     def db_for_write(self, model, **hints):
-        return get_db_name(model)
+        if self.gnucash(model):
+            return PRIMARY
+        return 'default'
 
+    def allow_syncdb(self, db, model):
+        # GnuCash connections are read-only; nothing is created there.
+        if is_gnucash(db):
+            return False
+        return None
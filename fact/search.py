@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Full-text search over invoices.
+#
+# The searchable text of every invoice -- its ID, notes, entry
+# descriptions, and the names and addresses of its customer and job -- is
+# copied into the SearchDocument table in the default database. sync()
+# updates only the documents whose text changed, and runs whenever the
+# change detector reports changed invoices or owners.
+#
+# The table is indexed by the database itself: an FTS5 table ranked by
+# BM25 on SQLite, and a trigram index ranked by word similarity on
+# PostgreSQL. The index is created on first use. Other databases, and
+# SQLite builds without FTS5, fall back on unindexed substring matching.
+
+import hashlib
+
+from django.db import connections, transaction, DatabaseError
+from django.db.models import Q
+
+import fact.models
+import fact.owners
+import fact.signals
+
+
+# Keep IN lists below SQLite's parameter limit.
+CHUNK_SIZE = 500
+
+TABLE = fact.models.SearchDocument._meta.db_table
+
+# Database alias -> whether the full-text index can be used; see indexed().
+_indexed = {}
+
+SQLITE_SETUP = [
+    """CREATE VIRTUAL TABLE fact_search USING fts5(
+        invoice_id, notes, entries, customer,
+        content='%(table)s', tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER fact_search_insert AFTER INSERT ON %(table)s BEGIN
+        INSERT INTO fact_search (rowid, invoice_id, notes, entries, customer)
+        VALUES (new.rowid, new.invoice_id, new.notes, new.entries, new.customer);
+    END""",
+    """CREATE TRIGGER fact_search_delete AFTER DELETE ON %(table)s BEGIN
+        INSERT INTO fact_search (fact_search, rowid, invoice_id, notes, entries, customer)
+        VALUES ('delete', old.rowid, old.invoice_id, old.notes, old.entries, old.customer);
+    END""",
+    """CREATE TRIGGER fact_search_update AFTER UPDATE ON %(table)s BEGIN
+        INSERT INTO fact_search (fact_search, rowid, invoice_id, notes, entries, customer)
+        VALUES ('delete', old.rowid, old.invoice_id, old.notes, old.entries, old.customer);
+        INSERT INTO fact_search (rowid, invoice_id, notes, entries, customer)
+        VALUES (new.rowid, new.invoice_id, new.notes, new.entries, new.customer);
+    END""",
+    """INSERT INTO fact_search (fact_search) VALUES ('rebuild')""",
+]
+
+# Matches weigh the invoice ID most, then customers, notes and entries. The
+# best matches are picked before joining, so the join only sees LIMIT rows.
+SQLITE_SEARCH = """
+    SELECT d.guid
+    FROM (
+        SELECT rowid, bm25(fact_search, 10.0, 2.0, 1.0, 4.0) AS rank
+        FROM fact_search
+        WHERE fact_search MATCH %%s
+        ORDER BY rank
+        LIMIT %%s
+    ) f
+    JOIN %(table)s d ON d.rowid = f.rowid
+    ORDER BY f.rank
+"""
+
+DOCUMENT = "(invoice_id || ' ' || notes || ' ' || customer || ' ' || entries)"
+
+POSTGRES_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX fact_search_trgm ON %(table)s USING gin (" + DOCUMENT + " gin_trgm_ops)",
+]
+
+POSTGRES_SEARCH = """
+    SELECT guid, word_similarity(%%s, """ + DOCUMENT + """) AS rank
+    FROM %(table)s
+    WHERE %(where)s
+    ORDER BY rank DESC, invoice_id DESC
+    LIMIT %%s
+"""
+
+
+def connection():
+    return connections[fact.models.SearchDocument.objects.db]
+
+
+def installed(cursor, vendor):
+    if vendor == 'sqlite':
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'fact_search'")
+    else:
+        cursor.execute("SELECT COUNT(*) FROM pg_indexes WHERE indexname = 'fact_search_trgm'")
+    return cursor.fetchone()[0] > 0
+
+
+def install():
+    # Creates the full-text index, if the database has one and it does not
+    # exist yet. The SearchDocument table itself is created by syncdb.
+    # Returns whether the index exists, which it does not on other
+    # databases, or when SQLite was built without FTS5.
+    conn = connection()
+    setup = {'sqlite' : SQLITE_SETUP, 'postgresql' : POSTGRES_SETUP}.get(conn.vendor)
+    if setup is None:
+        return False
+    cursor = conn.cursor()
+    if installed(cursor, conn.vendor):
+        return True
+    try:
+        with transaction.atomic(using=fact.models.SearchDocument.objects.db):
+            for sql in setup:
+                cursor.execute(sql % {'table' : TABLE})
+    except DatabaseError:
+        return False
+    return True
+
+
+def indexed():
+    # Installs the full-text index on first use in this process, and
+    # returns whether search() can use it.
+    alias = fact.models.SearchDocument.objects.db
+    if alias not in _indexed:
+        _indexed[alias] = install()
+    return _indexed[alias]
+
+
+def documents(guids=None):
+    # Returns a dictionary of invoice GUID -> unsaved SearchDocument, for
+    # all invoices or the given ones. Like fact.summary.sync(), only a full
+    # sync reloads the ownership graph.
+    graph = fact.owners.Graph.load() if guids is None else fact.owners.graph()
+    invoices = fact.models.Invoice.invoices().order_by()
+    entries = fact.models.Entry.objects.order_by('invoice', 'guid')
+    if guids is None:
+        chunks = [(invoices, entries)]
+    else:
+        guids = list(guids)
+        chunks = [(invoices.filter(guid__in=guids[i:i+CHUNK_SIZE]), entries.filter(invoice__in=guids[i:i+CHUNK_SIZE]))
+                for i in range(0, len(guids), CHUNK_SIZE)]
+    result = {}
+    for invoices, entries in chunks:
+        lines = {}
+        for invoice, description in entries.values_list('invoice', 'description').iterator():
+            if description:
+                lines.setdefault(invoice, []).append(description)
+        for guid, id, notes, owner_guid in invoices.values_list('guid', 'id', 'notes', 'owner_guid').iterator():
+            customer_guid, customer_name, job_guid, job_name = graph.get(owner_guid)
+            customer = graph.customer(owner_guid)
+            owner = [customer_name, job_name]
+            if customer is not None:
+                owner.extend([customer.addr_name, customer.addr_addr1, customer.addr_addr2, customer.addr_addr3, customer.addr_addr4])
+            doc = fact.models.SearchDocument(
+                    guid=guid,
+                    invoice_id=id or '',
+                    notes=notes or '',
+                    entries='\n'.join(lines.get(guid, [])),
+                    customer='\n'.join(x for x in owner if x))
+            doc.fingerprint = hashlib.md5(repr((doc.invoice_id, doc.notes, doc.entries, doc.customer)).encode('utf-8')).hexdigest()
+            result[guid] = doc
+    return result
+
+
+def sync(guids=None):
+    # Brings the search documents up to date with GnuCash, for all
+    # invoices or the given ones. Returns a tuple of (updated, deleted)
+    # GUID lists.
+    indexed()
+    current = documents(guids)
+    stored = fact.models.SearchDocument.objects.all()
+    if guids is not None:
+        stored = stored.filter(guid__in=list(guids))
+    stored = dict(stored.values_list('guid', 'fingerprint'))
+
+    changed = [guid for guid, doc in current.iteritems() if stored.get(guid) != doc.fingerprint]
+    deleted = [guid for guid in stored if guid not in current]
+
+    with transaction.atomic(using=fact.models.SearchDocument.objects.db):
+        for i in range(0, len(deleted), CHUNK_SIZE):
+            fact.models.SearchDocument.objects.filter(guid__in=deleted[i:i+CHUNK_SIZE]).delete()
+        for i in range(0, len(changed), CHUNK_SIZE):
+            chunk = changed[i:i+CHUNK_SIZE]
+            fact.models.SearchDocument.objects.filter(guid__in=chunk).delete()
+            fact.models.SearchDocument.objects.bulk_create([current[guid] for guid in chunk])
+
+    return changed, deleted
+
+
+def terms(query):
+    return [x for x in query.split() if x]
+
+
+def fts_query(words):
+    # Every word must match, as a prefix of a token.
+    return ' '.join('"%s"*' % x.replace('"', '""') for x in words)
+
+
+def like_pattern(word):
+    return '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def search(query, limit=50):
+    # Returns the GUIDs of the invoices matching every word of the query,
+    # best match first.
+    words = terms(query)
+    if not words:
+        return []
+    conn = connection()
+    cursor = conn.cursor()
+    if indexed() and conn.vendor == 'sqlite':
+        cursor.execute(SQLITE_SEARCH % {'table' : TABLE}, [fts_query(words), limit])
+    elif indexed() and conn.vendor == 'postgresql':
+        where = ' AND '.join([DOCUMENT + ' ILIKE %s'] * len(words))
+        cursor.execute(POSTGRES_SEARCH % {'table' : TABLE, 'where' : where},
+                [query] + [like_pattern(x) for x in words] + [limit])
+    else:
+        documents = fact.models.SearchDocument.objects.order_by('-invoice_id')
+        for word in words:
+            documents = documents.filter(
+                    Q(invoice_id__icontains=word) | Q(notes__icontains=word) |
+                    Q(entries__icontains=word) | Q(customer__icontains=word))
+        return list(documents.values_list('guid', flat=True)[:limit])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def invoices_changed(sender, guids, detected, **kwargs):
+    if detected:
+        sync(guids)
+
+
+def owners_changed(sender, detected, **kwargs):
+    if detected:
+        sync()
+
+
+fact.signals.invoices_changed.connect(invoices_changed)
+fact.signals.owners_changed.connect(owners_changed)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Streaming rendering of long tables. The page template is rendered once
+# with ROWS_MARKER where the table rows go; everything before the marker
+# is sent straight away, followed by the rows rendered in chunks as they
+# come out of the database cursor, and finally the rest of the page.
+
+from django.db import connections, transaction
+from django.http import StreamingHttpResponse
+from django.template import RequestContext
+from django.template.loader import get_template, render_to_string
+
+ROWS_MARKER = '<!--ROWS-->'
+
+# Rows per rendered chunk. Keep it even, so odd/even row classes line up
+# between chunks.
+CHUNK_SIZE = 200
+
+
+def iterate(queryset, fields):
+    # Yields each row of queryset as a dictionary of the given fields. On
+    # PostgreSQL the rows are read through a server-side cursor, so only
+    # CHUNK_SIZE rows are held in memory at a time.
+    queryset = queryset.values_list(*fields)
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        for row in queryset.iterator():
+            yield dict(zip(fields, row))
+        return
+
+    sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    with transaction.atomic(using=queryset.db):
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(name='fact_stream')
+        cursor.itersize = CHUNK_SIZE
+        try:
+            cursor.execute(sql, params)
+            for row in cursor:
+                yield dict(zip(fields, row))
+        finally:
+            cursor.close()
+
+
+def chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def render_rows(request, page_template, row_template, context, rows):
+    context = dict(context, streaming=True)
+    page = render_to_string(page_template, context, context_instance=RequestContext(request))
+    head, tail = page.split(ROWS_MARKER, 1)
+    template = get_template(row_template)
+    yield head
+    for chunk in chunks(rows):
+        yield template.render(RequestContext(request, dict(context, rows=chunk)))
+    yield tail
+
+
+def response(request, page_template, row_template, context, rows):
+    return StreamingHttpResponse(render_rows(request, page_template, row_template, context, rows))
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+
+from django.db import connections, transaction
+from django.utils import timezone
+from dateutil import tz
+from dateutil.relativedelta import relativedelta
+
+import fact.models
+import fact.owners
+import fact.payments
+import fact.signals
+
+
+# Totals for a set of invoices, computed in the database. The invoice
+# set is passed in as a subquery, so the number of queries does not
+# depend on the number of invoices. Payments come from fact.payments.
+SUMMARY_SQL = """
+    SELECT i.guid, b.duedays, e.net, e.tax
+    FROM invoices i
+    LEFT JOIN billterms b ON b.guid = i.terms
+    LEFT JOIN (
+        SELECT en.invoice AS invoice,
+            SUM(1.0 * en.i_price_num / en.i_price_denom
+                * en.quantity_num / en.quantity_denom) AS net,
+            SUM(CASE WHEN en.i_taxable <> 0
+                THEN 1.0 * en.i_price_num / en.i_price_denom
+                    * en.quantity_num / en.quantity_denom
+                    * COALESCE(t.percent, 0) * 0.01
+                ELSE 0 END) AS tax
+        FROM entries en
+        LEFT JOIN (
+            SELECT taxtable, SUM(1.0 * amount_num / amount_denom) AS percent
+            FROM taxtable_entries
+            GROUP BY taxtable
+        ) t ON t.taxtable = en.i_taxtable
+        WHERE en.invoice IN (%(invoices)s)
+        GROUP BY en.invoice
+    ) e ON e.invoice = i.guid
+    WHERE i.guid IN (%(invoices)s)
+"""
+
+
+# Per-invoice fingerprint of everything the summary depends on, used by
+# sync() and fact.changes to find invoices that changed. Entries and
+# payment splits are hashed line by line in Python, so edits that leave
+# column sums unchanged, like swapping quantities between two lines, still
+# change the fingerprint. The entry descriptions are included for the
+# search index. %(invoices)s restricts the queries to a list of invoice
+# GUIDs, or is empty for all invoices.
+FINGERPRINT_SQL = """
+    SELECT i.guid, i.id, i.notes, i.date_posted, i.owner_guid, i.owner_type,
+        i.post_lot, b.duedays
+    FROM invoices i
+    LEFT JOIN billterms b ON b.guid = i.terms
+    WHERE i.owner_type IN (2, 3) %(invoices)s
+"""
+
+FINGERPRINT_INVOICES = "AND i.guid IN (%s)"
+
+FINGERPRINT_ENTRIES_SQL = """
+    SELECT invoice, guid, quantity_num, quantity_denom, i_price_num,
+        i_price_denom, i_taxable, i_taxtable, description
+    FROM entries
+    %(invoices)s
+    ORDER BY invoice, guid
+"""
+
+FINGERPRINT_ENTRIES_INVOICES = "WHERE invoice IN (%s)"
+
+FINGERPRINT_TAXTABLES_SQL = """
+    SELECT taxtable, amount_num, amount_denom
+    FROM taxtable_entries
+    ORDER BY taxtable, id
+"""
+
+FINGERPRINT_SPLITS_SQL = """
+    SELECT lot_guid, guid, value_num, value_denom
+    FROM splits
+    WHERE action = 'Invoice' AND lot_guid IS NOT NULL %(invoices)s
+    ORDER BY lot_guid, guid
+"""
+
+FINGERPRINT_SPLITS_INVOICES = "AND lot_guid IN (SELECT post_lot FROM invoices WHERE guid IN (%s))"
+
+# Keep IN lists below SQLite's parameter limit.
+CHUNK_SIZE = 500
+
+
+class InvoiceRow(object):
+
+    def __init__(self, invoice, owner, net, tax, status, duedays):
+        self.invoice = invoice
+        self.guid = invoice.guid
+        self.id = invoice.id
+        self.notes = invoice.notes
+        self.date_posted = invoice.date_posted
+        self.customer_guid, self.customer_name, self.job_guid, self.job_name = owner
+        self.net = net
+        self.tax = tax
+        self.gross = net + tax
+        self.status = status
+        self.balance = float(status.balance)
+        self.paid_amount = float(status.paid_amount)
+        self.duedays = duedays
+
+    @property
+    def date_invoice(self):
+        if self.date_posted is None:
+            return None
+        date = self.date_posted.replace(tzinfo=tz.gettz('UTC'))
+        return date.astimezone(tz.tzlocal())
+
+    @property
+    def date_due(self):
+        if self.date_invoice is None or self.duedays is None:
+            return None
+        return self.date_invoice + relativedelta(days=+self.duedays)
+
+    @property
+    def paid(self):
+        return self.status.paid
+
+    @property
+    def overpaid(self):
+        return self.status.overpaid
+
+
+def totals(invoices):
+    # Return a dictionary of invoice GUID -> (duedays, net, tax) for every
+    # invoice in the given queryset.
+    subquery = invoices.order_by().values('guid').query
+    sql, params = subquery.get_compiler(using=invoices.db).as_sql()
+    cursor = connections[invoices.db].cursor()
+    cursor.execute(SUMMARY_SQL % {'invoices' : sql}, tuple(params) * 2)
+    result = {}
+    for guid, duedays, net, tax in cursor.fetchall():
+        result[guid] = (duedays, float(net or 0), float(tax or 0))
+    return result
+
+
+def load(invoices, owner_map=None):
+    # Build InvoiceRow objects for a queryset of invoices, in queryset
+    # order, using a fixed number of queries.
+    sums = totals(invoices)
+    statuses = fact.payments.load(invoices)
+    if owner_map is None:
+        owner_map = fact.owners.graph()
+    rows = []
+    for invoice in invoices:
+        duedays, net, tax = sums.get(invoice.guid, (None, 0.0, 0.0))
+        status = statuses.get(invoice.guid) or fact.payments.Status(invoice.guid, invoice.date_posted is not None)
+        rows.append(InvoiceRow(invoice, owner_map.get(invoice.owner_guid), net, tax, status, duedays))
+    return rows
+
+
+def line_digests(cursor, sql, params=(), extra=None):
+    # Hash the rows of sql, grouped by their first column, and return a
+    # dictionary of key -> hex digest. Rows must be ordered by the key.
+    cursor.execute(sql, params)
+    result = {}
+    key, digest = None, None
+    for row in cursor:
+        if row[0] != key:
+            if digest is not None:
+                result[key] = digest.hexdigest()
+            key, digest = row[0], hashlib.md5()
+        if extra is not None:
+            row = row + (extra(row),)
+        digest.update(repr(row[1:]).encode('utf-8'))
+    if digest is not None:
+        result[key] = digest.hexdigest()
+    return result
+
+
+def restrict(sql, restriction, guids):
+    # Returns sql and its parameters, restricted to the given invoice
+    # GUIDs, or not restricted at all if guids is None.
+    if guids is None:
+        return sql % {'invoices' : ''}, ()
+    restriction = restriction % ', '.join(['%s'] * len(guids))
+    return sql % {'invoices' : restriction}, tuple(guids)
+
+
+def fingerprints(owner_map, guids=None):
+    # Returns a dictionary of invoice GUID -> fingerprint, for all invoices
+    # or the given ones. Only the entries and splits of those invoices are
+    # read, so fingerprinting a few invoices is cheap on a large book.
+    cursor = connections[fact.models.Invoice.objects.db].cursor()
+    cursor.execute(FINGERPRINT_TAXTABLES_SQL)
+    taxtables = {}
+    for taxtable, num, denom in cursor.fetchall():
+        taxtables.setdefault(taxtable, []).append((num, denom))
+    if guids is None:
+        chunks = [None]
+    else:
+        guids = list(guids)
+        chunks = [guids[i:i+CHUNK_SIZE] for i in range(0, len(guids), CHUNK_SIZE)]
+    result = {}
+    for chunk in chunks:
+        sql, params = restrict(FINGERPRINT_ENTRIES_SQL, FINGERPRINT_ENTRIES_INVOICES, chunk)
+        entries = line_digests(cursor, sql, params, lambda row: taxtables.get(row[7]))
+        sql, params = restrict(FINGERPRINT_SPLITS_SQL, FINGERPRINT_SPLITS_INVOICES, chunk)
+        splits = line_digests(cursor, sql, params)
+        cursor.execute(*restrict(FINGERPRINT_SQL, FINGERPRINT_INVOICES, chunk))
+        for row in cursor.fetchall():
+            owner = owner_map.get(row[4])
+            key = row + owner + (entries.get(row[0]), splits.get(row[6]))
+            result[row[0]] = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+    return result
+
+
+def invoice_number(id):
+    id = (id or '').strip()
+    if id.isdigit():
+        return int(id)
+    return 0
+
+
+def summary_from_row(row, fingerprint):
+    date_posted = row.date_posted
+    if date_posted is not None:
+        date_posted = date_posted.replace(tzinfo=tz.gettz('UTC'))
+    return fact.models.InvoiceSummary(
+            guid=row.guid,
+            id=row.id,
+            number=invoice_number(row.id),
+            customer_guid=row.customer_guid,
+            customer_name=row.customer_name,
+            job_guid=row.job_guid,
+            job_name=row.job_name,
+            notes=row.notes,
+            date_posted=date_posted,
+            date_invoice=row.date_invoice,
+            date_due=row.date_due,
+            net=row.net,
+            tax=row.tax,
+            gross=row.gross,
+            paid_amount=row.paid_amount,
+            balance=row.balance,
+            paid=row.paid,
+            fingerprint=fingerprint,
+            synced=timezone.now()
+        )
+
+
+def sync(guids=None):
+    # Bring the InvoiceSummary table up to date with GnuCash. Only
+    # invoices whose fingerprint changed since the last run are
+    # recomputed. Returns a tuple of (updated, deleted) GUID lists. Syncing
+    # given invoices uses the cached ownership graph, which is dropped when
+    # the change detector reports changed owners.
+    if guids is None:
+        owner_map = fact.owners.Graph.load()
+    else:
+        guids = set(guids)
+        owner_map = fact.owners.graph()
+    current = fingerprints(owner_map, guids)
+
+    stored = fact.models.InvoiceSummary.objects.all()
+    if guids is not None:
+        stored = stored.filter(guid__in=list(guids))
+    stored = dict(stored.values_list('guid', 'fingerprint'))
+
+    changed = [guid for guid, fp in current.iteritems() if stored.get(guid) != fp]
+    deleted = [guid for guid in stored if guid not in current]
+
+    with transaction.atomic(using=fact.models.InvoiceSummary.objects.db):
+        for i in range(0, len(deleted), CHUNK_SIZE):
+            fact.models.InvoiceSummary.objects.filter(guid__in=deleted[i:i+CHUNK_SIZE]).delete()
+        for i in range(0, len(changed), CHUNK_SIZE):
+            chunk = changed[i:i+CHUNK_SIZE]
+            rows = load(fact.models.Invoice.objects.filter(guid__in=chunk), owner_map)
+            fact.models.InvoiceSummary.objects.filter(guid__in=chunk).delete()
+            fact.models.InvoiceSummary.objects.bulk_create([summary_from_row(row, current[row.guid]) for row in rows])
+
+    return changed, deleted
+
+
+def invoices_changed(sender, guids, detected, **kwargs):
+    if detected:
+        sync(guids)
+
+
+fact.signals.invoices_changed.connect(invoices_changed)
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Synthetic GnuCash books for benchmarking. Writes a SQLite database with
+# the GnuCash tables this application reads, filled with random but
+# reproducible customers, jobs, invoices, entries, tax tables and
+# payments.
+#
+# Payments are written the way fact.models expects them: as splits with
+# action "Invoice" and a negative value in the invoice's posting lot.
+#
+# Date columns are declared as timestamps rather than GnuCash's text(19),
+# so Django's SQLite backend returns them as datetimes, the way the
+# PostgreSQL backend this application is written for does.
+
+import datetime
+import random
+import sqlite3
+import uuid
+
+
+SCHEMA = """
+CREATE TABLE slots (
+    id integer PRIMARY KEY AUTOINCREMENT NOT NULL,
+    obj_guid text(32) NOT NULL,
+    name text(4096) NOT NULL,
+    slot_type integer NOT NULL,
+    int64_val bigint,
+    string_val text(4096),
+    double_val float8,
+    timespec_val text(14),
+    guid_val text(32),
+    numeric_val_num bigint,
+    numeric_val_denom bigint,
+    gdate_val text(8)
+);
+CREATE INDEX slots_guid_index ON slots (obj_guid);
+
+CREATE TABLE transactions (
+    guid text(32) PRIMARY KEY NOT NULL,
+    currency_guid text(32) NOT NULL,
+    num text(2048) NOT NULL,
+    post_date timestamp,
+    enter_date timestamp,
+    description text(2048)
+);
+CREATE INDEX tx_post_date_index ON transactions (post_date);
+
+CREATE TABLE splits (
+    guid text(32) PRIMARY KEY NOT NULL,
+    tx_guid text(32) NOT NULL,
+    account_guid text(32) NOT NULL,
+    memo text(2048) NOT NULL,
+    action text(2048) NOT NULL,
+    reconcile_state text(1) NOT NULL,
+    reconcile_date timestamp,
+    value_num bigint NOT NULL,
+    value_denom bigint NOT NULL,
+    quantity_num bigint NOT NULL,
+    quantity_denom bigint NOT NULL,
+    lot_guid text(32)
+);
+CREATE INDEX splits_tx_guid_index ON splits (tx_guid);
+CREATE INDEX splits_account_guid_index ON splits (account_guid);
+
+CREATE TABLE lots (
+    guid text(32) PRIMARY KEY NOT NULL,
+    account_guid text(32),
+    is_closed integer NOT NULL
+);
+
+CREATE TABLE billterms (
+    guid text(32) PRIMARY KEY NOT NULL,
+    name text(2048) NOT NULL,
+    description text(2048) NOT NULL,
+    refcount integer NOT NULL,
+    invisible integer NOT NULL,
+    parent text(32),
+    type text(2048) NOT NULL,
+    duedays integer,
+    discountdays integer,
+    discount_num bigint,
+    discount_denom bigint,
+    cutoff integer
+);
+
+CREATE TABLE taxtables (
+    guid text(32) PRIMARY KEY NOT NULL,
+    name text(50) NOT NULL,
+    refcount bigint NOT NULL,
+    invisible integer NOT NULL,
+    parent text(32)
+);
+
+CREATE TABLE taxtable_entries (
+    id integer PRIMARY KEY AUTOINCREMENT NOT NULL,
+    taxtable text(32) NOT NULL,
+    account text(32) NOT NULL,
+    amount_num bigint NOT NULL,
+    amount_denom bigint NOT NULL,
+    type integer NOT NULL
+);
+
+CREATE TABLE customers (
+    guid text(32) PRIMARY KEY NOT NULL,
+    name text(2048) NOT NULL,
+    id text(2048) NOT NULL,
+    notes text(2048) NOT NULL,
+    active integer NOT NULL,
+    discount_num bigint NOT NULL,
+    discount_denom bigint NOT NULL,
+    credit_num bigint NOT NULL,
+    credit_denom bigint NOT NULL,
+    currency text(32) NOT NULL,
+    tax_override integer NOT NULL,
+    addr_name text(1024),
+    addr_addr1 text(1024),
+    addr_addr2 text(1024),
+    addr_addr3 text(1024),
+    addr_addr4 text(1024),
+    addr_phone text(128),
+    addr_fax text(128),
+    addr_email text(256),
+    terms text(32),
+    tax_included integer,
+    taxtable text(32)
+);
+
+CREATE TABLE jobs (
+    guid text(32) PRIMARY KEY NOT NULL,
+    id text(2048) NOT NULL,
+    name text(2048) NOT NULL,
+    reference text(2048) NOT NULL,
+    active integer NOT NULL,
+    owner_type integer,
+    owner_guid text(32)
+);
+
+CREATE TABLE invoices (
+    guid text(32) PRIMARY KEY NOT NULL,
+    id text(2048) NOT NULL,
+    date_opened timestamp,
+    date_posted timestamp,
+    notes text(2048) NOT NULL,
+    active integer NOT NULL,
+    currency text(32) NOT NULL,
+    owner_type integer,
+    owner_guid text(32),
+    terms text(32),
+    billing_id text(2048),
+    post_txn text(32),
+    post_lot text(32),
+    post_acc text(32),
+    billto_type integer,
+    billto_guid text(32),
+    charge_amt_num bigint,
+    charge_amt_denom bigint
+);
+
+CREATE TABLE entries (
+    guid text(32) PRIMARY KEY NOT NULL,
+    date timestamp NOT NULL,
+    date_entered timestamp,
+    description text(2048),
+    action text(2048),
+    notes text(2048),
+    quantity_num bigint,
+    quantity_denom bigint,
+    i_acct text(32),
+    i_price_num bigint,
+    i_price_denom bigint,
+    i_discount_num bigint,
+    i_discount_denom bigint,
+    invoice text(32),
+    i_disc_type text(2048),
+    i_disc_how text(2048),
+    i_taxable integer,
+    i_taxincluded integer,
+    i_taxtable text(32),
+    b_acct text(32),
+    b_price_num bigint,
+    b_price_denom bigint,
+    bill text(32),
+    b_taxable integer,
+    b_taxincluded integer,
+    b_taxtable text(32),
+    b_paytype integer,
+    billable integer,
+    billto_type integer,
+    billto_guid text(32),
+    order_guid text(32)
+);
+"""
+
+COMPANY = [
+    ('Company ID', '987 654 321'),
+    ('Company Name', 'Synthetic Consulting AS'),
+    ('Company Address', 'Storgata 1\n0155 Oslo'),
+    ('Company Email Address', 'post@example.com'),
+    ('Company Website URL', 'http://www.example.com'),
+    ('Company Phone Number', '+47 22 00 00 00'),
+    ('Company Fax Number', '1234.56.78901'),
+]
+
+ACTIONS = ['Hours', 'Material', 'Project']
+WORDS = ['consulting', 'development', 'support', 'hosting', 'design', 'review', 'licence', 'travel',
+        'maintenance', 'training', 'analysis', 'migration', 'backup', 'server', 'network']
+
+
+def guid(rng):
+    return uuid.UUID(int=rng.getrandbits(128)).hex
+
+
+def timestamp(date):
+    return date.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def generate(path, customers=50, jobs=100, invoices=1000, entries=4, taxtables=3, payments=1, seed=1):
+    # Writes a new book to path. Every invoice gets `entries` order lines
+    # on average, and `payments` payment splits on average if it is paid.
+    rng = random.Random(seed)
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    account = guid(rng)
+    currency = guid(rng)
+    book = guid(rng)
+
+    db.executemany('INSERT INTO slots (obj_guid, name, slot_type, string_val) VALUES (?, ?, 4, ?)',
+            [(book, 'options/Business/' + name, value) for name, value in COMPANY])
+
+    terms = []
+    for days in (10, 14, 30):
+        terms.append(guid(rng))
+        db.execute('INSERT INTO billterms (guid, name, description, refcount, invisible, type, duedays) '
+                'VALUES (?, ?, ?, 0, 0, ?, ?)', (terms[-1], '%d days' % days, '%d days' % days, 'GNC_TERM_TYPE_DAYS', days))
+
+    tables = []
+    percent = {}
+    for i in range(taxtables):
+        tables.append(guid(rng))
+        percent[tables[-1]] = rng.choice([0, 8, 15, 25])
+        db.execute('INSERT INTO taxtables (guid, name, refcount, invisible) VALUES (?, ?, 0, 0)', (tables[-1], 'VAT %d' % i))
+        db.execute('INSERT INTO taxtable_entries (taxtable, account, amount_num, amount_denom, type) VALUES (?, ?, ?, 1, 2)',
+                (tables[-1], account, percent[tables[-1]]))
+
+    owners = []
+    rows = []
+    for i in range(customers):
+        owners.append((2, guid(rng)))
+        name = '%s %s AS' % (rng.choice(WORDS).title(), rng.choice(WORDS).title())
+        rows.append((owners[-1][1], name, '%06d' % (i + 1), '', 1, 0, 1, 0, 1, currency, 0,
+                name, 'Gate %d' % rng.randint(1, 200), '%04d Oslo' % rng.randint(1, 9999), '', ''))
+    db.executemany('INSERT INTO customers (guid, name, id, notes, active, discount_num, discount_denom, credit_num, '
+            'credit_denom, currency, tax_override, addr_name, addr_addr1, addr_addr2, addr_addr3, addr_addr4) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    rows = []
+    for i in range(jobs if customers else 0):
+        # Most jobs belong to a customer, some to another job.
+        if rows and rng.random() < 0.2:
+            owner = (3, rng.choice(rows)[0])
+        else:
+            owner = rng.choice(owners)
+        rows.append((guid(rng), '%06d' % (i + 1), 'Project %s' % rng.choice(WORDS), '', 1, owner[0], owner[1]))
+    db.executemany('INSERT INTO jobs (guid, id, name, reference, active, owner_type, owner_guid) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    owners += [(3, row[0]) for row in rows]
+
+    start = datetime.datetime(2005, 1, 1)
+    span = (datetime.datetime(2014, 12, 31) - start).days
+    invoice_rows = []
+    entry_rows = []
+    tx_rows = []
+    split_rows = []
+    lot_rows = []
+    for i in range(invoices):
+        invoice = guid(rng)
+        owner_type, owner_guid = rng.choice(owners)
+        opened = start + datetime.timedelta(days=span * i // max(invoices, 1), seconds=rng.randint(0, 86399))
+        posted = rng.random() < 0.97
+        lot = tx = None
+
+        total = 0
+        for j in range(rng.randint(1, 2 * entries - 1) if entries else 0):
+            quantity = rng.randint(1, 4000)
+            price = rng.randint(100, 150000)
+            taxable = rng.random() < 0.9
+            table = rng.choice(tables) if tables else None
+            entry_rows.append((guid(rng), timestamp(opened), timestamp(opened),
+                    '%s %s' % (rng.choice(WORDS).title(), rng.choice(WORDS)), rng.choice(ACTIONS), '',
+                    quantity, 100, account, price, 100, 0, 1, invoice, 'PRETAX', '%', int(taxable), 0, table))
+            net = quantity * price // 100
+            total += net + (net * percent[table] // 100 if taxable and table else 0)
+
+        if posted:
+            lot = guid(rng)
+            tx = guid(rng)
+            lot_rows.append((lot, account, 0))
+            tx_rows.append((tx, currency, '', timestamp(opened), timestamp(opened), 'Invoice %d' % (i + 1)))
+            split_rows.append((guid(rng), tx, account, '', 'Invoice', 'n', total, 100, total, 100, lot))
+            if rng.random() < 0.8:
+                count = rng.randint(1, 2 * payments - 1) if payments else 0
+                paid = 0
+                for k in range(count):
+                    amount = total - paid if k == count - 1 else rng.randint(0, total - paid)
+                    paid += amount
+                    ptx = guid(rng)
+                    date = opened + datetime.timedelta(days=rng.randint(1, 60))
+                    tx_rows.append((ptx, currency, '', timestamp(date), timestamp(date), 'Payment'))
+                    split_rows.append((guid(rng), ptx, account, '', 'Invoice', 'n', -amount, 100, -amount, 100, lot))
+
+        invoice_rows.append((invoice, '%06d' % (i + 1), timestamp(opened), timestamp(opened) if posted else None,
+                'Synthetic invoice' if rng.random() < 0.3 else '', 1, currency, owner_type, owner_guid,
+                rng.choice(terms), tx, lot, account if posted else None))
+
+    db.executemany('INSERT INTO invoices (guid, id, date_opened, date_posted, notes, active, currency, owner_type, '
+            'owner_guid, terms, post_txn, post_lot, post_acc) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', invoice_rows)
+    db.executemany('INSERT INTO entries (guid, date, date_entered, description, action, notes, quantity_num, '
+            'quantity_denom, i_acct, i_price_num, i_price_denom, i_discount_num, i_discount_denom, invoice, '
+            'i_disc_type, i_disc_how, i_taxable, i_taxincluded, i_taxtable) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', entry_rows)
+    db.executemany('INSERT INTO lots (guid, account_guid, is_closed) VALUES (?, ?, ?)', lot_rows)
+    db.executemany('INSERT INTO transactions (guid, currency_guid, num, post_date, enter_date, description) '
+            'VALUES (?, ?, ?, ?, ?, ?)', tx_rows)
+    db.executemany('INSERT INTO splits (guid, tx_guid, account_guid, memo, action, reconcile_state, value_num, '
+            'value_denom, quantity_num, quantity_denom, lot_guid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', split_rows)
+    db.commit()
+    db.close()
+    return {
+        'customers' : customers,
+        'jobs' : jobs,
+        'invoices' : len(invoice_rows),
+        'entries' : len(entry_rows),
+        'transactions' : len(tx_rows),
+        'splits' : len(split_rows),
+    }
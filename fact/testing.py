@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Test helpers for query budgets and synthetic GnuCash books.
+#
+#     class InvoiceViewTest(SyntheticBookMixin, QueryBudgetMixin, TransactionTestCase):
+#         def test_index(self):
+#             with self.assertQueryBudget('fact.views.index'):
+#                 self.client.get('/')
+
+import contextlib
+import fractions
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from django.conf import settings
+from django.db import connections
+
+import fact.models
+import fact.owners
+import fact.queries
+import fact.routers
+import fact.synthetic
+
+
+@contextlib.contextmanager
+def assert_query_budget(budget):
+    # Fails if the block runs more queries on any alias than budget, a
+    # dictionary of alias -> maximum number of queries, allows.
+    recorder = fact.queries.QueryRecorder()
+    recorder.start()
+    try:
+        yield recorder
+    finally:
+        stats = recorder.stop()
+    errors = []
+    for alias, limit in budget.items():
+        if alias in stats and stats[alias].count > limit:
+            errors.append('%d queries on %s, budget is %d:\n%s' % (stats[alias].count, alias, limit,
+                '\n'.join('  ' + q['sql'] for q in stats[alias].queries)))
+    if errors:
+        raise AssertionError('\n'.join(errors))
+
+
+class QueryBudgetMixin(object):
+
+    def assertQueryBudget(self, view, **budget):
+        # Uses the FACT_QUERY_BUDGETS entry for view, with any aliases
+        # given as keyword arguments overriding it.
+        limits = dict(settings.FACT_QUERY_BUDGETS.get(view, {}))
+        limits.update(budget)
+        return assert_query_budget(limits)
+
+
+def use_book(path):
+    # Points the gnucash alias at the SQLite database in path, and drops
+    # everything cached from the previous one.
+    if hasattr(connections._connections, 'gnucash'):
+        getattr(connections._connections, 'gnucash').close()
+        delattr(connections._connections, 'gnucash')
+    connections.databases['gnucash']['NAME'] = path
+    fact.routers.unpin()
+    fact.models.Option._store.clear()
+    fact.models.Slot._company = (None, None, 0)
+    fact.owners.invalidate()
+
+
+class SyntheticBookMixin(object):
+    # Runs every test against a new synthetic book, generated with the
+    # arguments in book. GnuCash writes to the book behind the
+    # application's back; execute() does the same. Use it with
+    # TransactionTestCase: TestCase probes every connection for
+    # transaction support by creating a table, which the read-only GnuCash
+    # connection refuses.
+    book = {'customers' : 5, 'jobs' : 10, 'invoices' : 40}
+
+    def setUp(self):
+        super(SyntheticBookMixin, self).setUp()
+        self.book_dir = tempfile.mkdtemp()
+        self.book_path = os.path.join(self.book_dir, 'book.db')
+        fact.synthetic.generate(self.book_path, **self.book)
+        self.previous_book = connections.databases['gnucash']['NAME']
+        use_book(self.book_path)
+
+    def tearDown(self):
+        use_book(self.previous_book)
+        shutil.rmtree(self.book_dir)
+        super(SyntheticBookMixin, self).tearDown()
+
+    def execute(self, sql, params=()):
+        db = sqlite3.connect(self.book_path)
+        try:
+            with db:
+                return db.execute(sql, params).fetchall()
+        finally:
+            db.close()
+
+    def swap_quantities(self):
+        # Swaps the quantities of the first two lines of an invoice with
+        # lines of different quantities and prices, and returns the invoice
+        # GUID.
+        rows = self.execute('SELECT invoice, guid, quantity_num, i_price_num FROM entries ORDER BY invoice, guid')
+        for first, second in zip(rows, rows[1:]):
+            if first[0] == second[0] and first[2] != second[2] and first[3] != second[3]:
+                self.execute('UPDATE entries SET quantity_num = ? WHERE guid = ?', (second[2], first[1]))
+                self.execute('UPDATE entries SET quantity_num = ? WHERE guid = ?', (first[2], second[1]))
+                return first[0]
+        raise AssertionError('no invoice with two different lines')
+
+    def lot_balances(self):
+        # Balances of the posted invoices, summed straight from the book.
+        balances = {}
+        rows = self.execute("SELECT i.guid, sp.value_num, sp.value_denom FROM invoices i "
+                "JOIN splits sp ON sp.lot_guid = i.post_lot AND sp.action = 'Invoice'")
+        for guid, num, denom in rows:
+            balances[guid] = balances.get(guid, 0) + fractions.Fraction(num, denom)
+        return balances
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+
+import fact.aging
+from fact.testing import SyntheticBookMixin
+
+
+class AgingTest(SyntheticBookMixin, TransactionTestCase):
+
+    def test_bucket(self):
+        self.assertEqual([fact.aging.bucket(days) for days in (-5, 0, 1, 30, 31, 60, 61, 90, 91)],
+                [0, 0, 1, 1, 2, 2, 3, 3, 4])
+
+    def test_report(self):
+        rows, total = fact.aging.report(datetime.date(2030, 1, 1))
+        open_balances = [float(balance) for balance in self.lot_balances().values() if round(balance, 2) != 0]
+        self.assertEqual(total.invoice_count, len(open_balances))
+        self.assertAlmostEqual(total.total, sum(open_balances), places=2)
+        self.assertAlmostEqual(sum(row.total for row in rows), total.total, places=2)
+        # Everything is long overdue by then.
+        self.assertAlmostEqual(total.buckets[-1], total.total, places=2)
+
+    def test_report_before_payments(self):
+        # Before the first invoice was posted, nothing was open.
+        rows, total = fact.aging.report(datetime.date(2004, 12, 31))
+        self.assertEqual((rows, total.invoice_count), ([], 0))
+
+    def test_view(self):
+        User.objects.create_user('test', 'test@example.com', 'test')
+        self.client.login(username='test', password='test')
+        response = self.client.get('/aging/', {'date' : '2030-01-01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total'].invoice_count, fact.aging.report(datetime.date(2030, 1, 1))[1].invoice_count)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+
+import fact.api
+import fact.models
+import fact.summary
+from fact.testing import SyntheticBookMixin
+
+
+class ApiTest(SyntheticBookMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(ApiTest, self).setUp()
+        fact.summary.sync()
+        User.objects.create_user('test', 'test@example.com', 'test')
+        self.client.login(username='test', password='test')
+        self.guids = list(fact.models.InvoiceSummary.objects.order_by('guid').values_list('guid', flat=True))
+
+    def get_json(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def post_bulk(self, body):
+        return self.client.post('/api/invoices/bulk/', body, content_type='application/json')
+
+    def test_invoice_fields(self):
+        data = self.get_json('/api/invoices/%s/' % self.guids[0], fields='guid,gross,entries')
+        self.assertEqual(sorted(data), ['entries', 'gross', 'guid'])
+        summary = fact.models.InvoiceSummary.objects.get(guid=self.guids[0])
+        self.assertAlmostEqual(sum(x['gross'] for x in data['entries']), summary.gross, places=6)
+        self.assertEqual(self.client.get('/api/invoices/', {'fields' : 'guid,password'}).status_code, 400)
+
+    def test_invoices_pages(self):
+        seen, after = [], None
+        while True:
+            params = {'fields' : 'guid', 'size' : 7}
+            if after:
+                params['after'] = after
+            data = self.get_json('/api/invoices/', **params)
+            seen.extend(row['guid'] for row in data['invoices'])
+            after = data['next']
+            if not after:
+                break
+        self.assertEqual(sorted(seen), self.guids)
+
+    def test_bulk(self):
+        guids = [self.guids[2], self.guids[0], '0' * 32]
+        data = self.get_json('/api/invoices/bulk/', guid=guids, fields='guid')
+        self.assertEqual([row['guid'] for row in data['invoices']], guids[:2])
+        response = self.client.post('/api/invoices/bulk/?fields=guid', json.dumps(guids), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), data)
+
+    def test_bulk_bad_input(self):
+        for body in ('[', '{}', json.dumps([self.guids[0], {}]), json.dumps([self.guids[0], None]),
+                json.dumps(['x' * 32]), json.dumps([self.guids[0].upper()]), json.dumps([self.guids[0] + '\n'])):
+            self.assertEqual(self.post_bulk(body).status_code, 400, body)
+        self.assertEqual(self.client.get('/api/invoices/bulk/', {'guid' : 'nope'}).status_code, 400)
+        self.assertEqual(self.post_bulk(json.dumps(['0' * 32] * 501)).status_code, 400)
+
+    def test_customer_totals(self):
+        fields = 'guid,invoice_count,total_gross'
+        expected = self.get_json('/api/customers/', fields=fields)['customers']
+        self.assertEqual(sum(x['invoice_count'] for x in expected), len(self.guids))
+        chunk_size = fact.api.CHUNK_SIZE
+        fact.api.CHUNK_SIZE = 2
+        try:
+            self.assertEqual(self.get_json('/api/customers/', fields=fields)['customers'], expected)
+        finally:
+            fact.api.CHUNK_SIZE = chunk_size
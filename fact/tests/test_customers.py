@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+import fact.models
+import fact.summary
+from fact.testing import SyntheticBookMixin
+
+
+class CustomerTest(SyntheticBookMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(CustomerTest, self).setUp()
+        fact.summary.sync()
+        User.objects.create_user('test', 'test@example.com', 'test')
+        self.client.login(username='test', password='test')
+        self.summaries = list(fact.models.InvoiceSummary.objects.all())
+
+    def expected(self):
+        # Per customer totals, added up in Python.
+        result = {}
+        now = timezone.now()
+        for x in self.summaries:
+            row = result.setdefault(x.customer_guid, {'invoice_count' : 0, 'total_gross' : 0, 'total_paid' : 0,
+                    'total_balance' : 0, 'oldest_overdue' : None})
+            row['invoice_count'] += 1
+            row['total_gross'] += x.gross
+            row['total_paid'] += x.paid_amount
+            row['total_balance'] += x.balance
+            if not x.paid and x.date_due is not None and x.date_due < now:
+                row['oldest_overdue'] = min(row['oldest_overdue'] or x.date_due, x.date_due)
+        return result
+
+    def assertTotals(self, row, expected):
+        self.assertEqual(row['invoice_count'], expected['invoice_count'])
+        for key in ('total_gross', 'total_paid', 'total_balance'):
+            self.assertAlmostEqual(row[key], expected[key], places=6)
+
+    def test_customer_totals(self):
+        expected = self.expected()
+        rows = list(fact.models.InvoiceSummary.customer_totals())
+        self.assertEqual(sorted(row['customer_guid'] for row in rows), sorted(expected))
+        for row in rows:
+            self.assertTotals(row, expected[row['customer_guid']])
+        overdue = fact.models.InvoiceSummary.oldest_overdue()
+        self.assertEqual(overdue, dict((guid, row['oldest_overdue']) for guid, row in expected.items() if row['oldest_overdue']))
+
+    def test_customers_page(self):
+        response = self.client.get('/customers/')
+        self.assertEqual(response.status_code, 200)
+        for guid in self.expected():
+            if guid is not None:
+                self.assertContains(response, 'href="/customers/%s' % guid)
+
+    def test_customer_page(self):
+        guid = fact.models.Customer.objects.filter(
+                guid__in=[x.customer_guid for x in self.summaries]).values_list('guid', flat=True)[0]
+        expected = self.expected()[guid]
+        seen, url = [], '/customers/%s/?size=2' % guid
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTotals(response.context['totals'], expected)
+            self.assertEqual(response.context['totals']['oldest_overdue'], expected['oldest_overdue'])
+            seen.extend(x.guid for x in response.context['invoices'])
+            url = response.context['next_url'] and '/customers/%s/%s' % (guid, response.context['next_url'])
+        self.assertEqual(sorted(seen), sorted(x.guid for x in self.summaries if x.customer_guid == guid))
+        self.assertEqual(self.client.get('/customers/%s/' % ('0' * 32)).status_code, 404)
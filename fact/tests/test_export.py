@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+import warnings
+
+from django.test import TransactionTestCase
+
+import fact.export
+import fact.models
+from fact.testing import SyntheticBookMixin, assert_query_budget
+
+
+class ExportTest(SyntheticBookMixin, TransactionTestCase):
+
+    def test_iter_invoices(self):
+        guids = fact.export.select_invoices()
+        self.execute("UPDATE invoices SET terms = 'missing' WHERE guid = ?", (guids[0],))
+        skipped = []
+        with assert_query_budget({'gnucash' : 6}):
+            invoices = list(fact.export.iter_invoices(guids, skipped))
+            for invoice in invoices:
+                invoice.gross, invoice.due, invoice.date_due
+        self.assertEqual([invoice.guid for invoice in invoices], guids[1:])
+        self.assertEqual(skipped, [fact.models.Invoice.objects.get(guid=guids[0]).id])
+
+    def test_select_dates(self):
+        # 23:30 UTC on March 9th is half past midnight on the 10th in Oslo.
+        guid = fact.export.select_invoices()[0]
+        self.execute("UPDATE invoices SET date_posted = '2026-03-09 23:30:00' WHERE guid = ?", (guid,))
+        day = datetime.date(2026, 3, 10)
+        with self.settings(TIME_ZONE='Europe/Oslo'):
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                self.assertIn(guid, fact.export.select_invoices(day, day + datetime.timedelta(days=1)))
+                self.assertNotIn(guid, fact.export.select_invoices(day - datetime.timedelta(days=1), day))
+                self.assertNotIn(guid, fact.export.select_invoices(day + datetime.timedelta(days=1)))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+
+import fact.gnucash
+import fact.models
+import fact.pdfcache
+import fact.routers
+import fact.summary
+from fact.testing import SyntheticBookMixin, use_book
+
+
+class BreakerTest(TransactionTestCase):
+
+    def test_open_and_half_open(self):
+        breaker = fact.gnucash.Breaker()
+        with self.settings(FACT_GNUCASH_FAILURES=2, FACT_GNUCASH_RETRY=30):
+            breaker.failure()
+            self.assertTrue(breaker.allow())
+            breaker.failure()
+            self.assertFalse(breaker.allow())
+            # After FACT_GNUCASH_RETRY seconds one request is let through,
+            # and the breaker stays open for the others.
+            breaker.opened -= 31
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            # If it fails, the breaker opens for another period.
+            breaker.failure()
+            self.assertFalse(breaker.allow())
+            breaker.opened -= 31
+            self.assertTrue(breaker.allow())
+            breaker.success()
+            self.assertTrue(breaker.allow())
+            self.assertTrue(breaker.allow())
+            breaker.failure()
+            self.assertTrue(breaker.allow())
+
+
+class GuardTest(SyntheticBookMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(GuardTest, self).setUp()
+        fact.gnucash.breaker = fact.gnucash.Breaker()
+        User.objects.create_user('test', 'test@example.com', 'test')
+        self.client.login(username='test', password='test')
+
+    def tearDown(self):
+        fact.gnucash.breaker = fact.gnucash.Breaker()
+        fact.routers._health.clear()
+        super(GuardTest, self).tearDown()
+
+    def test_failures_open_the_breaker(self):
+        use_book(os.path.join(self.book_dir, 'missing', 'book.db'))
+        with self.settings(FACT_GNUCASH_FAILURES=2):
+            for i in range(2):
+                with self.assertRaises(fact.gnucash.Unavailable):
+                    with fact.gnucash.guard():
+                        fact.models.Invoice.objects.count()
+            use_book(self.book_path)
+            # Rejected straight away, even though GnuCash is back.
+            with self.assertRaises(fact.gnucash.Unavailable):
+                with fact.gnucash.guard():
+                    self.fail('The breaker let the block run')
+            fact.gnucash.breaker.opened -= 3600
+            with fact.gnucash.guard():
+                fact.models.Invoice.objects.count()
+            self.assertTrue(fact.gnucash.breaker.allow())
+
+    def test_views_when_open(self):
+        fact.summary.sync()
+        guid = [x.guid for x in fact.models.Invoice.related() if x.printable][0]
+        fact.gnucash.breaker.opened = time.time()
+        response = self.client.get('/invoice/%s/' % guid)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(settings.FACT_GNUCASH_RETRY))
+        # The PDF view serves the last rendered PDF instead.
+        with self.settings(FACT_PDF_CACHE_DIR=os.path.join(self.book_dir, 'pdf')):
+            self.assertEqual(self.client.get('/invoice/pdf/%s/' % guid).status_code, 503)
+            fact.pdfcache.write(guid + '-old', b'%PDF-1.4')
+            response = self.client.get('/invoice/pdf/%s/' % guid)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b'%PDF-1.4')
+            self.assertEqual(response['ETag'], '"%s-old"' % guid)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.test import TransactionTestCase
+
+import fact.loader
+import fact.models
+from fact.testing import SyntheticBookMixin, assert_query_budget
+
+
+class LoaderTest(SyntheticBookMixin, TransactionTestCase):
+
+    def totals(self, invoice):
+        return invoice.net, invoice.tax, invoice.gross, invoice.date_due
+
+    def test_totals(self):
+        # Without prefetching, an invoice loads its entries, their tax
+        # tables and its billing term once per request.
+        guid = self.execute("SELECT invoice FROM entries WHERE i_taxable = 1 LIMIT 1")[0][0]
+        expected = self.totals(fact.models.Invoice.related().get(pk=guid))
+        with fact.loader.scope():
+            invoice = fact.models.Invoice.objects.get(pk=guid)
+            again = fact.models.Invoice.objects.get(pk=guid)
+            with assert_query_budget({'gnucash' : 3}):
+                self.assertEqual(self.totals(invoice), expected)
+            with assert_query_budget({'gnucash' : 0}):
+                self.assertEqual(self.totals(invoice), expected)
+                self.assertEqual(self.totals(again), expected)
+
+    def test_identity(self):
+        with fact.loader.scope() as loader:
+            guid = fact.models.Invoice.objects.values_list('guid', flat=True)[0]
+            self.assertTrue(loader.get(fact.models.Invoice, guid) is loader.get(fact.models.Invoice, guid))
+            self.assertEqual(loader.get(fact.models.Invoice, 'x' * 32), None)
+        self.assertFalse(fact.loader.current() is fact.loader.current())
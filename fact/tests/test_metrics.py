@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.test import TransactionTestCase
+
+import fact.metrics
+
+
+class MetricsTest(TransactionTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, pid, values):
+        filename = os.path.join(self.directory, '%d-1.json' % pid)
+        with open(filename, 'w') as f:
+            json.dump(values, f)
+        return filename
+
+    def test_dead_shards(self):
+        counter = ('fact_pdf_rendered_total', ())
+        histogram = ('fact_pdf_render_seconds', ())
+        values = [[counter[0], [], 2], [histogram[0], [], [1] + [0] * 11 + [0.001, 1]]]
+        process = subprocess.Popen(['sleep', '60'])
+        try:
+            with self.settings(FACT_METRICS_DIR=self.directory):
+                before = fact.metrics.collect()
+                dead = self.write(process.pid, values)
+                live = self.write(os.getppid(), values)
+                running = fact.metrics.collect()
+                process.kill()
+                process.wait()
+                exited = fact.metrics.collect()
+                again = fact.metrics.collect()
+        finally:
+            if process.returncode is None:
+                process.kill()
+                process.wait()
+        self.assertFalse(os.path.exists(dead))
+        self.assertTrue(os.path.exists(live))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, fact.metrics.RETIRED_SHARD)))
+        self.assertEqual(running[counter] - before.get(counter, 0), 4)
+        # Totals do not go down when a worker exits, and its shard is only
+        # counted once.
+        self.assertEqual(exited, running)
+        self.assertEqual(again, running)
+
+    def test_access(self):
+        with self.settings(FACT_METRICS_DIR=self.directory, FACT_METRICS_TOKEN='secret', FACT_METRICS_IPS=()):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
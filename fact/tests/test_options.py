@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.test import TransactionTestCase
+
+import fact.models
+from fact.testing import assert_query_budget
+
+
+class OptionTest(TransactionTestCase):
+
+    def setUp(self):
+        fact.models.Option._store.clear()
+
+    def test_load_cached(self):
+        fact.models.Option.set('payment_text', 'nb', 'Betal')
+        self.assertEqual(fact.models.Option.get('payment_text', 'nb'), 'Betal')
+        with assert_query_budget({'default' : 0}):
+            fact.models.Option.opt_list('nb')
+            fact.models.Option.payment_text('nb')
+
+    def test_reload_after_ttl(self):
+        Option = fact.models.Option
+        Option.get('payment_text', 'nb')
+        Option.objects.create(key='payment_text', lang='nb', value='Betal')
+        fact.models.OptionVersion.objects.create(lang='nb', version=1)
+        self.assertEqual(Option.get('payment_text', 'nb'), None)
+        version, options, text, checked = Option._store['nb']
+        Option._store['nb'] = (version, options, text, 0)
+        self.assertEqual(Option.get('payment_text', 'nb'), 'Betal')
+
+    def test_options_ttl(self):
+        Option = fact.models.Option
+        Option.get('payment_text', 'nb')
+        Option.objects.create(key='payment_text', lang='nb', value='Betal')
+        fact.models.OptionVersion.objects.create(lang='nb', version=1)
+        with self.settings(FACT_OPTIONS_TTL=3600, FACT_COMPANY_TTL=0):
+            self.assertEqual(Option.get('payment_text', 'nb'), None)
+        with self.settings(FACT_OPTIONS_TTL=0, FACT_COMPANY_TTL=3600):
+            self.assertEqual(Option.get('payment_text', 'nb'), 'Betal')
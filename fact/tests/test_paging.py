@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+import fact.models
+import fact.paging
+
+
+class PagingTest(TransactionTestCase):
+
+    def setUp(self):
+        date = datetime.datetime(2014, 1, 1, tzinfo=timezone.utc)
+        for i in range(12):
+            # Every third row has no due date, and pairs share one.
+            date_due = date + datetime.timedelta(days=i // 2) if i % 3 else None
+            fact.models.InvoiceSummary.objects.create(guid='%032d' % i, id=str(i), number=i, date_due=date_due)
+
+    def pages(self, field, descending):
+        guids = []
+        cursor = None
+        while True:
+            page = fact.paging.paginate(fact.models.InvoiceSummary.objects.all(), field, descending, cursor, 5)
+            guids.extend(row.guid for row in page)
+            cursor = page.next_cursor
+            if cursor is None:
+                return guids
+
+    def test_null_dates(self):
+        for descending in (False, True):
+            guids = self.pages('date_due', descending)
+            self.assertEqual(sorted(guids), ['%032d' % i for i in range(12)])
+            dates = [fact.models.InvoiceSummary.objects.get(guid=guid).date_due for guid in guids]
+            self.assertEqual(dates[-4:], [None] * 4)
+            self.assertEqual(dates[:8], sorted(dates[:8], reverse=descending))
+
+    def test_not_null(self):
+        self.assertEqual(self.pages('number', True), ['%032d' % i for i in reversed(range(12))])
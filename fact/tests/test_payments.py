@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import decimal
+
+from django.test import TransactionTestCase
+
+import fact.models
+import fact.payments
+import fact.summary
+from fact.testing import SyntheticBookMixin
+
+
+class PaymentsTest(SyntheticBookMixin, TransactionTestCase):
+
+    def test_load(self):
+        invoices = fact.models.Invoice.invoices()
+        statuses = fact.payments.load(invoices)
+        self.assertEqual(sorted(statuses), sorted(invoices.values_list('guid', flat=True)))
+        balances = self.lot_balances()
+        for guid, status in statuses.items():
+            balance = balances.get(guid, 0)
+            self.assertEqual(status.balance, decimal.Decimal(balance.numerator) / decimal.Decimal(balance.denominator))
+            self.assertEqual(status.paid, guid in balances and balance == 0)
+            self.assertEqual(status.paid_amount, sum(payment.amount for payment in status.payments) * -1)
+
+    def test_load_guids(self):
+        guids = list(fact.models.Invoice.invoices().values_list('guid', flat=True))
+        by_query = fact.payments.load(fact.models.Invoice.invoices())
+        by_guid = fact.payments.load(guids)
+        self.assertEqual(sorted(by_guid), sorted(by_query))
+        for guid in guids:
+            self.assertEqual(by_guid[guid].balance, by_query[guid].balance)
+            self.assertEqual(len(by_guid[guid].payments), len(by_query[guid].payments))
+
+    def test_overpaid(self):
+        guid, lot = self.execute("SELECT guid, post_lot FROM invoices WHERE post_lot IS NOT NULL LIMIT 1")[0]
+        tx = self.execute("SELECT tx_guid FROM splits WHERE lot_guid = ? LIMIT 1", (lot,))[0][0]
+        self.execute("INSERT INTO splits (guid, tx_guid, account_guid, memo, action, reconcile_state, value_num, "
+                "value_denom, quantity_num, quantity_denom, lot_guid) VALUES (?, ?, '', '', 'Invoice', 'n', -100000000, 100, "
+                "-100000000, 100, ?)", ('f' * 32, tx, lot))
+        status = fact.payments.load([guid])[guid]
+        self.assertTrue(status.overpaid)
+        self.assertFalse(status.paid)
+        self.assertTrue(status.balance < 0)
+
+    def test_summary_rows(self):
+        # The invoice list uses the same statuses, one query for all rows.
+        invoices = fact.models.Invoice.invoices()
+        statuses = fact.payments.load(invoices)
+        for row in fact.summary.load(invoices):
+            self.assertEqual(row.paid, statuses[row.guid].paid)
+            self.assertAlmostEqual(row.balance, float(statuses[row.guid].balance), places=6)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import unittest
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+
+import fact.export
+import fact.metrics
+import fact.summary
+from fact.testing import QueryBudgetMixin, SyntheticBookMixin
+
+
+class ViewBudgetTest(SyntheticBookMixin, QueryBudgetMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(ViewBudgetTest, self).setUp()
+        fact.summary.sync()
+        User.objects.create_user('test', 'test@example.com', 'test')
+        self.client.login(username='test', password='test')
+        self.guid = fact.export.select_invoices()[0]
+        # The first request stores the language in the session, and finds
+        # where the change log ends; budgets are for the requests after.
+        self.client.get('/invoice/')
+
+    def test_index(self):
+        with self.assertQueryBudget('fact.views.index'):
+            self.assertEqual(self.client.get('/invoice/').status_code, 200)
+
+    def test_customers(self):
+        with self.assertQueryBudget('fact.views.customers'):
+            self.assertEqual(self.client.get('/customers/').status_code, 200)
+
+    def test_detailed(self):
+        with self.assertQueryBudget('fact.views.detailed'):
+            self.assertEqual(self.client.get('/invoice/%s/' % self.guid).status_code, 200)
+
+    @unittest.skipUnless(getattr(settings, 'FACT_LOGO', None), 'FACT_LOGO is not set')
+    def test_pdf(self):
+        with self.settings(FACT_PDF_CACHE_DIR=os.path.join(self.book_dir, 'pdf')):
+            with self.assertQueryBudget('fact.views.pdf'):
+                self.assertEqual(self.client.get('/invoice/pdf/%s/' % self.guid).status_code, 200)
+
+    def test_query_headers(self):
+        with self.settings(FACT_QUERY_HEADERS=False):
+            self.assertFalse(self.client.get('/customers/').has_header('X-Fact-Queries-default'))
+            User.objects.filter(username='test').update(is_staff=True)
+            self.assertTrue(self.client.get('/customers/').has_header('X-Fact-Queries-default'))
+        with self.settings(FACT_QUERY_HEADERS=True):
+            self.assertTrue(self.client.get('/customers/').has_header('X-Fact-Queries-default'))
+
+    def test_query_metrics(self):
+        key = ('fact_db_queries_total', ('default', 'fact.views.customers'))
+        directory = os.path.join(self.book_dir, 'metrics')
+        with self.settings(FACT_QUERY_HEADERS=False, FACT_METRICS_DIR=directory):
+            before = fact.metrics.collect().get(key, 0)
+            with self.settings(FACT_QUERY_SAMPLE_RATE=0):
+                self.client.get('/customers/')
+            self.assertEqual(fact.metrics.collect().get(key, 0), before)
+            self.client.get('/customers/')
+            self.assertTrue(fact.metrics.collect().get(key, 0) > before)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import time
+import unittest
+
+from django.conf import settings
+from django.test import TransactionTestCase
+
+import fact.export
+import fact.models
+import fact.pdfcache
+from fact.management.commands import render_invoices
+from fact.testing import SyntheticBookMixin
+
+
+class RenderTest(SyntheticBookMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(RenderTest, self).setUp()
+        self.cache_dir = os.path.join(self.book_dir, 'pdf')
+        self.output = os.path.join(self.book_dir, 'output')
+        os.makedirs(self.output)
+
+    def test_eviction(self):
+        # The least recently read PDFs go first once the cache is full.
+        with self.settings(FACT_PDF_CACHE_DIR=self.cache_dir, FACT_PDF_CACHE_SIZE=3000):
+            now = time.time()
+            for i, key in enumerate(('a', 'b', 'c')):
+                fact.pdfcache.write(key, b'x' * 1000)
+                os.utime(fact.pdfcache.path(key), (now - 100 + i, now - 100 + i))
+            self.assertEqual(fact.pdfcache.read('a'), b'x' * 1000)
+            fact.pdfcache.write('d', b'x' * 1000)
+            self.assertEqual(sorted(os.listdir(self.cache_dir)), ['a.pdf', 'c.pdf', 'd.pdf'])
+            fact.pdfcache.write('e', b'x' * 2500)
+            self.assertEqual(sorted(os.listdir(self.cache_dir)), ['e.pdf'])
+
+    def test_skip_without_due_date(self):
+        guid = fact.export.select_invoices()[0]
+        self.execute("UPDATE invoices SET terms = NULL WHERE guid = ?", (guid,))
+        with self.settings(FACT_PDF_CACHE_DIR=self.cache_dir):
+            result = render_invoices.render_one((guid, settings.LANGUAGE_CODE, self.output))
+        self.assertEqual(result[2], None)
+        self.assertEqual(os.listdir(self.output), [])
+
+    @unittest.skipUnless(getattr(settings, 'FACT_LOGO', None), 'FACT_LOGO is not set')
+    def test_render_one(self):
+        guid = [x.guid for x in fact.models.Invoice.related() if x.printable][0]
+        with self.settings(FACT_PDF_CACHE_DIR=self.cache_dir):
+            guid, id, size, elapsed = render_invoices.render_one((guid, settings.LANGUAGE_CODE, self.output))
+            key = fact.pdfcache.latest(guid)
+            with open(os.path.join(self.output, 'invoice-%s.pdf' % id), 'rb') as f:
+                data = f.read()
+            self.assertEqual(size, len(data))
+            self.assertTrue(data.startswith(b'%PDF'))
+            self.assertEqual(fact.pdfcache.read(key), data)
+            # A second run is served from the cache, without writing it again.
+            os.utime(fact.pdfcache.path(key), (1000000000, 1000000000))
+            self.assertEqual(render_invoices.render_one((guid, settings.LANGUAGE_CODE, None))[2], size)
+            self.assertEqual(fact.pdfcache.mtime(key), 1000000000)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+
+from django.db import connections
+from django.test import TransactionTestCase
+
+import fact.middleware
+import fact.models
+import fact.routers
+from fact.testing import SyntheticBookMixin
+
+
+class ReplicaTest(SyntheticBookMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(ReplicaTest, self).setUp()
+        self.replica_path = os.path.join(self.book_dir, 'replica.db')
+        shutil.copy(self.book_path, self.replica_path)
+        connections.databases['replica'] = dict(connections.databases['gnucash'], NAME=self.replica_path)
+        self.replicas = self.settings(FACT_GNUCASH_REPLICAS=('gnucash', 'replica'))
+        self.replicas.enable()
+        fact.routers.unpin()
+
+    def tearDown(self):
+        self.replicas.disable()
+        if hasattr(connections._connections, 'replica'):
+            getattr(connections._connections, 'replica').close()
+            delattr(connections._connections, 'replica')
+        del connections.databases['replica']
+        fact.routers._health.clear()
+        fact.routers.unpin()
+        super(ReplicaTest, self).tearDown()
+
+    def test_model_routing(self):
+        router = fact.routers.FactRouter()
+        alias = router.db_for_read(fact.models.Invoice)
+        self.assertIn(alias, ('gnucash', 'replica'))
+        self.assertEqual(router.db_for_write(fact.models.Invoice), 'gnucash')
+        self.assertEqual(router.db_for_read(fact.models.InvoiceSummary), 'default')
+        self.assertEqual(router.db_for_read(fact.models.Invoice.objects.only('guid').model), alias)
+        self.assertFalse(router.allow_syncdb('replica', fact.models.Invoice))
+
+    def test_pinned_per_request(self):
+        seen = set()
+        for i in range(50):
+            alias = fact.routers.pinned()
+            # Every read in the request goes to the same replica.
+            self.assertEqual(fact.models.Invoice.objects.all().db, alias)
+            self.assertEqual(fact.models.Entry.objects.all().db, alias)
+            self.assertEqual(fact.routers.pinned(), alias)
+            seen.add(alias)
+            fact.routers.unpin()
+        self.assertEqual(seen, set(['gnucash', 'replica']))
+
+    def test_middleware_unpins(self):
+        # Every request picks its replica anew.
+        middleware = fact.middleware.ReplicaMiddleware()
+        fact.routers.pinned()
+        middleware.process_request(None)
+        self.assertEqual(fact.routers._local.alias, None)
+        fact.routers.pinned()
+        middleware.process_response(None, None)
+        self.assertEqual(fact.routers._local.alias, None)
+
+    def test_unhealthy_replica(self):
+        connections.databases['replica']['NAME'] = os.path.join(self.book_dir, 'missing', 'replica.db')
+        for i in range(10):
+            self.assertEqual(fact.routers.pinned(), 'gnucash')
+            fact.routers.unpin()
+        self.assertFalse(fact.routers._health['replica'][0])
+
+    def test_mark_down(self):
+        while fact.routers.pinned() != 'replica':
+            fact.routers.unpin()
+        fact.routers.mark_down('replica')
+        # A failed replica is dropped from the request, and skipped until
+        # its next health check.
+        self.assertEqual(fact.routers._local.alias, None)
+        self.assertEqual(fact.routers.pinned(), 'gnucash')
+        with self.settings(FACT_REPLICA_CHECK=0):
+            fact.routers.unpin()
+            self.assertTrue(fact.routers.health('replica')[0])
+
+    def test_read_only(self):
+        cursor = connections['replica'].cursor()
+        cursor.execute('PRAGMA query_only')
+        self.assertEqual(cursor.fetchone()[0], 1)
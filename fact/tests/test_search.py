@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.db import connections
+from django.test import TransactionTestCase
+
+import fact.changes
+import fact.models
+import fact.search
+from fact.testing import SyntheticBookMixin
+
+
+class SearchTest(SyntheticBookMixin, TransactionTestCase):
+
+    def uninstall(self):
+        cursor = connections[fact.models.SearchDocument.objects.db].cursor()
+        for trigger in ('insert', 'delete', 'update'):
+            cursor.execute('DROP TRIGGER IF EXISTS fact_search_' + trigger)
+        cursor.execute('DROP TABLE IF EXISTS fact_search')
+        fact.search._indexed.clear()
+
+    def tearDown(self):
+        fact.search._indexed.clear()
+        super(SearchTest, self).tearDown()
+
+    def test_search_before_sync(self):
+        self.uninstall()
+        self.assertEqual(fact.search.search('invoice'), [])
+        fact.search.sync()
+        guid, id = fact.models.Invoice.invoices().values_list('guid', 'id')[0]
+        self.assertIn(guid, fact.search.search(id))
+
+    def test_without_fts(self):
+        # SQLite without FTS5 can not create the index; search() matches
+        # substrings instead.
+        self.uninstall()
+        setup = fact.search.SQLITE_SETUP
+        fact.search.SQLITE_SETUP = ['CREATE VIRTUAL TABLE fact_search USING no_such_module(invoice_id)']
+        try:
+            fact.search.sync()
+            guid, id = fact.models.Invoice.invoices().values_list('guid', 'id')[0]
+            self.assertFalse(fact.search.indexed())
+            self.assertIn(guid, fact.search.search(id))
+        finally:
+            fact.search.SQLITE_SETUP = setup
+
+    def test_same_length_description(self):
+        fact.search.sync()
+        detector = fact.changes.Detector()
+        detector.poll()
+        guid, description = self.execute('SELECT guid, description FROM entries ORDER BY guid LIMIT 1')[0]
+        self.execute('UPDATE entries SET description = ? WHERE guid = ?', ('Q' * len(description), guid))
+        invoice = fact.models.Entry.objects.get(guid=guid).invoice_id
+        self.assertEqual(fact.search.search('Qqq'), [])
+        fact.changes.publish(detector.poll(full=True))
+        self.assertEqual(fact.search.search('Qqq'), [invoice])
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+
+import fact.models
+import fact.streaming
+import fact.summary
+from fact.testing import SyntheticBookMixin
+
+
+class StreamingTest(SyntheticBookMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(StreamingTest, self).setUp()
+        fact.summary.sync()
+        User.objects.create_user('test', 'test@example.com', 'test')
+        self.client.login(username='test', password='test')
+        self.chunk_size = fact.streaming.CHUNK_SIZE
+        fact.streaming.CHUNK_SIZE = 4
+
+    def tearDown(self):
+        fact.streaming.CHUNK_SIZE = self.chunk_size
+        super(StreamingTest, self).tearDown()
+
+    def stream(self, path):
+        response = self.client.get(path, {'stream' : '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return list(response.streaming_content)
+
+    def test_index(self):
+        rows = fact.models.InvoiceSummary.objects.order_by('-number', '-guid').values_list('guid', flat=True)
+        parts = self.stream('/invoice/')
+        # The page head, one part per chunk of rows, and the page tail.
+        self.assertEqual(len(parts), 2 + (len(rows) + 3) // 4)
+        self.assertNotIn(fact.streaming.ROWS_MARKER, ''.join(parts))
+        self.assertIn('</html>', parts[-1])
+        page = ''.join(parts[1:-1])
+        positions = [page.find(guid) for guid in rows]
+        self.assertNotIn(-1, positions)
+        self.assertEqual(positions, sorted(positions))
+
+    def test_customers(self):
+        names = fact.models.InvoiceSummary.customer_totals().values_list('customer_name', flat=True)
+        page = ''.join(self.stream('/customers/')[1:-1])
+        for name in names:
+            self.assertIn(name, page)
+
+    def test_iterate(self):
+        queryset = fact.models.InvoiceSummary.objects.order_by('guid')
+        rows = list(fact.streaming.iterate(queryset, ('guid', 'gross')))
+        self.assertEqual(rows, [{'guid' : guid, 'gross' : gross} for guid, gross in queryset.values_list('guid', 'gross')])
+        self.assertEqual([len(x) for x in fact.streaming.chunks(range(10))], [4, 4, 2])
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.test import TransactionTestCase
+
+import fact.models
+import fact.owners
+import fact.summary
+from fact.testing import SyntheticBookMixin
+
+
+class SummaryTest(SyntheticBookMixin, TransactionTestCase):
+
+    def test_sync(self):
+        changed, deleted = fact.summary.sync()
+        self.assertEqual(len(changed), fact.models.Invoice.objects.filter(owner_type__in=(2, 3)).count())
+        self.assertEqual(fact.summary.sync(), ([], []))
+
+    def test_sync_swapped_lines(self):
+        fact.summary.sync()
+        guid = self.swap_quantities()
+        changed, deleted = fact.summary.sync()
+        self.assertEqual(changed, [guid])
+        summary = fact.models.InvoiceSummary.objects.get(guid=guid)
+        self.assertAlmostEqual(summary.net, fact.models.Invoice.objects.get(guid=guid).net, places=2)
+
+    def test_fingerprints_guids(self):
+        graph = fact.owners.Graph.load()
+        every = fact.summary.fingerprints(graph)
+        guids = sorted(every)[:3] + ['0' * 32]
+        self.assertEqual(fact.summary.fingerprints(graph, guids), dict((guid, every[guid]) for guid in guids[:3]))
+        self.assertEqual(fact.summary.fingerprints(graph, []), {})
+
+    def test_sync_guids(self):
+        fact.summary.sync()
+        guid = self.swap_quantities()
+        other = fact.models.InvoiceSummary.objects.exclude(guid=guid).values_list('guid', flat=True)[0]
+        self.assertEqual(fact.summary.sync([other]), ([], []))
+        self.assertEqual(fact.summary.sync([guid, other]), ([guid], []))
+        self.assertEqual(fact.summary.sync(), ([], []))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012, Kim Tore Jensen. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1) Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2) Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from django.utils.http import http_date
+
+import fact.models
+import fact.pdfcache
+import fact.render
+import fact.summary
+from fact.testing import SyntheticBookMixin
+
+
+class ViewTest(SyntheticBookMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(ViewTest, self).setUp()
+        User.objects.create_user('test', 'test@example.com', 'test')
+        self.client.login(username='test', password='test')
+        self.guid = self.execute("SELECT invoice FROM entries WHERE i_taxable = 1 LIMIT 1")[0][0]
+
+    def test_detailed_summary(self):
+        # Net, VAT and subtotal come from the summary row when there is one.
+        fact.summary.sync()
+        fact.models.InvoiceSummary.objects.filter(pk=self.guid).update(net=123456.78)
+        response = self.client.get('/invoice/%s/' % self.guid)
+        self.assertContains(response, '123,456.78')
+
+    def test_detailed_without_summary(self):
+        net = fact.models.Invoice.related().get(pk=self.guid).net
+        response = self.client.get('/invoice/%s/' % self.guid)
+        self.assertAlmostEqual(response.context['summary'].net, net, places=6)
+
+    def cache_pdf(self, guid):
+        # Stores a stand-in PDF under the key the pdf view computes, so the
+        # view serves it without rendering.
+        invoice = fact.models.Invoice.related().get(pk=guid)
+        options = fact.models.Option.opt_list(settings.LANGUAGE_CODE)
+        key = fact.pdfcache.fingerprint(invoice, fact.render.resources.company(), options, settings.LANGUAGE_CODE)
+        fact.pdfcache.write(key, b'%PDF-1.4 ' + guid.encode('ascii'))
+        return key
+
+    def test_pdf_conditional(self):
+        guid = [x.guid for x in fact.models.Invoice.related() if x.printable][0]
+        with self.settings(FACT_PDF_CACHE_DIR=os.path.join(self.book_dir, 'pdf')):
+            key = self.cache_pdf(guid)
+            response = self.client.get('/invoice/pdf/%s/' % guid)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b'%PDF-1.4 ' + guid.encode('ascii'))
+            self.assertEqual(response['ETag'], '"%s"' % key)
+            self.assertEqual(response['Last-Modified'], http_date(fact.pdfcache.mtime(key)))
+
+            response = self.client.get('/invoice/pdf/%s/' % guid, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get('/invoice/pdf/%s/' % guid, HTTP_IF_MODIFIED_SINCE=http_date(fact.pdfcache.mtime(key)))
+            self.assertEqual(response.status_code, 304)
+
+            # Anything the PDF shows changes the key.
+            self.execute("UPDATE entries SET description = 'changed' WHERE invoice = ?", (guid,))
+            self.assertNotEqual(self.cache_pdf(guid), key)
+            fact.models.Option.set('payment_text', settings.LANGUAGE_CODE, 'changed')
+            self.assertNotEqual(self.cache_pdf(guid), key)
@@ -24,17 +24,37 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from django.utils.translation import ugettext as _
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotModified, HttpResponseBadRequest, \
+        HttpResponseForbidden, StreamingHttpResponse, Http404
 from django.template import RequestContext
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render_to_response, get_object_or_404, redirect
 from django.core.urlresolvers import reverse
 from django.contrib import messages
+from django.db.models import Count, Sum
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag
+
+import datetime
+
+from django.conf import settings
 
 import django.contrib.auth
 import django.contrib.auth.models
 import fact.models
+import fact.aging
 import fact.forms
+import fact.export
+import fact.gnucash
+import fact.metrics
+import fact.paging
+import fact.pdfcache
+import fact.profiling
+import fact.render
+import fact.search
+import fact.streaming
+import fact.summary
 
 def login(request):
     if request.method == 'POST':
@@ -64,28 +84,140 @@ def logout(request):
     django.contrib.auth.logout(request)
     return redirect(reverse('home'))
 
+def start_of_day(date):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time()), timezone.get_current_timezone())
+
+def filter_invoices(request):
+    # Returns a tuple of (filter form, filtered InvoiceSummary queryset, sort key).
+    try:
+        with fact.gnucash.guard():
+            customers = list(fact.models.Customer.objects.order_by('name').values_list('guid', 'name'))
+    except fact.gnucash.Unavailable:
+        # Fall back on the customers that have invoices.
+        customers = fact.models.InvoiceSummary.objects.exclude(customer_guid=None).order_by('customer_name') \
+                .values_list('customer_guid', 'customer_name').distinct()
+    form = fact.forms.InvoiceFilterForm(request.GET, customers=customers)
+    invoices = fact.models.InvoiceSummary.objects.all()
+    sort = '-number'
+    if form.is_valid():
+        data = form.cleaned_data
+        if data['customer']:
+            invoices = invoices.filter(customer_guid=data['customer'])
+        if data['date_from']:
+            invoices = invoices.filter(date_invoice__gte=start_of_day(data['date_from']))
+        if data['date_to']:
+            invoices = invoices.filter(date_invoice__lt=start_of_day(data['date_to'] + datetime.timedelta(days=1)))
+        if data['status'] == 'paid':
+            invoices = invoices.filter(paid=True)
+        elif data['status'] == 'unpaid':
+            invoices = invoices.filter(paid=False)
+        elif data['status'] == 'overpaid':
+            invoices = invoices.filter(date_posted__isnull=False, balance__lt=0)
+        elif data['status'] == 'overdue':
+            invoices = invoices.filter(paid=False, date_due__lt=timezone.now())
+        sort = data['sort'] or sort
+    return form, invoices, sort
+
+def page_size(request):
+    try:
+        size = int(request.GET.get('size', settings.FACT_PAGE_SIZE))
+    except ValueError:
+        size = settings.FACT_PAGE_SIZE
+    return max(1, min(size, settings.FACT_MAX_PAGE_SIZE))
+
+def page_urls(request, page):
+    # Returns a tuple of (first page URL, next page URL). Either is None if
+    # there is no such page.
+    params = request.GET.copy()
+    first_url = next_url = None
+    if 'after' in params:
+        del params['after']
+        first_url = '?' + params.urlencode()
+    if page.next_cursor:
+        params['after'] = page.next_cursor
+        next_url = '?' + params.urlencode()
+    return first_url, next_url
+
+def with_overdue(rows, overdue):
+    # Adds the oldest overdue date to each customer row.
+    for row in rows:
+        row['oldest_overdue'] = overdue.get(row['customer_guid'])
+        yield row
+
+INVOICE_ROW_FIELDS = ('guid', 'id', 'customer_name', 'gross', 'net', 'date_invoice', 'date_due', 'date_posted', 'paid')
+CUSTOMER_ROW_FIELDS = ('customer_guid', 'customer_name', 'invoice_count', 'total_gross', 'total_paid', 'total_balance')
+
 @login_required
 def index(request):
-    invoices = fact.models.Invoice.invoices().all()
+    form, invoices, sort = filter_invoices(request)
+    if request.GET.get('stream'):
+        invoices = invoices.order_by(sort, '-guid' if sort.startswith('-') else 'guid')
+        return fact.streaming.response(request, 'fact/index.html', 'fact/invoice_rows.html', {
+                'title' : _('Invoices'),
+                'form' : form
+            }, fact.streaming.iterate(invoices, INVOICE_ROW_FIELDS))
+
+    page = fact.paging.paginate(invoices, sort.lstrip('-'), sort.startswith('-'), request.GET.get('after'), page_size(request))
+    first_url, next_url = page_urls(request, page)
+    params = request.GET.copy()
+    params['stream'] = '1'
+    params.pop('after', None)
+    all_url = '?' + params.urlencode()
     return render_to_response('fact/index.html', {
             'title' : _('Invoices'),
-            'invoices' : invoices
+            'form' : form,
+            'invoices' : page,
+            'first_url' : first_url,
+            'next_url' : next_url,
+            'all_url' : all_url
         }, context_instance=RequestContext(request))
 
 @login_required
 def customers(request):
-    customers = fact.models.Customer.objects.all().order_by('name')
+    customers = fact.models.InvoiceSummary.customer_totals().order_by('customer_name')
+    overdue = fact.models.InvoiceSummary.oldest_overdue()
+    if request.GET.get('stream'):
+        return fact.streaming.response(request, 'fact/customers.html', 'fact/customer_rows.html', {
+                'title' : _('Customers')
+            }, with_overdue(fact.streaming.iterate(customers, CUSTOMER_ROW_FIELDS), overdue))
     return render_to_response('fact/customers.html', {
             'title' : _('Customers'),
-            'customers' : customers
+            'customers' : with_overdue(customers, overdue)
         }, context_instance=RequestContext(request))
 
 @login_required
+@fact.gnucash.guarded
+def customer(request, guid):
+    customer = get_object_or_404(fact.models.Customer, pk=guid)
+    invoices = fact.models.InvoiceSummary.objects.filter(customer_guid=guid)
+    totals = invoices.aggregate(invoice_count=Count('guid'), total_gross=Sum('gross'),
+            total_paid=Sum('paid_amount'), total_balance=Sum('balance'))
+    totals['oldest_overdue'] = fact.models.InvoiceSummary.oldest_overdue(invoices).get(guid)
+    page = fact.paging.paginate(invoices, 'number', True, request.GET.get('after'), page_size(request))
+    first_url, next_url = page_urls(request, page)
+    return render_to_response('fact/customer.html', {
+            'title' : customer.name,
+            'customer' : customer,
+            'totals' : totals,
+            'invoices' : page,
+            'first_url' : first_url,
+            'next_url' : next_url
+        }, context_instance=RequestContext(request))
+
+@login_required
+@fact.gnucash.guarded
 def detailed(request, guid):
-    invoice = get_object_or_404(fact.models.Invoice, pk=guid)
+    # The totals come from the summary table, like on the invoice list, and
+    # are only computed from GnuCash for invoices it does not have yet.
+    invoice = get_object_or_404(fact.models.Invoice.related(), pk=guid)
+    try:
+        summary = fact.models.InvoiceSummary.objects.get(pk=guid)
+    except fact.models.InvoiceSummary.DoesNotExist:
+        summary = fact.summary.load(fact.models.Invoice.objects.filter(pk=guid))[0]
     return render_to_response('fact/detailed.html', {
             'title' : _('Invoice %s') % invoice.id,
             'invoice' : invoice,
+            'summary' : summary,
             'customer' : invoice.customer,
             'job' : invoice.job
         }, context_instance=RequestContext(request))
@@ -96,7 +228,8 @@ def admin(request):
         form = fact.forms.OptionForm(request.POST)
         if form.is_valid():
             for key, val in form.cleaned_data.iteritems():
-                fact.models.Option.set(key, request.LANGUAGE_CODE, val)
+                fact.models.Option.set(key, request.LANGUAGE_CODE, val, bump=False)
+            fact.models.Option.bump(request.LANGUAGE_CODE)
     else:
         form = fact.forms.OptionForm(fact.models.Option.opt_list(request.LANGUAGE_CODE))
 
@@ -105,148 +238,136 @@ def admin(request):
             'optionform' : form
         }, context_instance=RequestContext(request))
 
+def pdf_response(data, number, etag, mtime):
+    response = HttpResponse(data, content_type='application/pdf')
+    response['Content-Disposition'] = 'attachment; filename=' + _('invoice') + '-' + number + '.pdf'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    return response
+
 @login_required
 def pdf(request, guid):
-    import settings
-    import reportlab.pdfgen.canvas
-    from reportlab.lib import pagesizes, units, colors, utils
-    from reportlab.platypus import Paragraph, Image
-    from reportlab.platypus.tables import Table, TableStyle
-    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
-    from django.contrib.humanize.templatetags.humanize import intcomma
-
-    company = fact.models.Slot.company()
-    invoice = get_object_or_404(fact.models.Invoice, pk=guid)
-    if not invoice.date_posted or not invoice.date_due:
-        return redirect(reverse('fact.views.detailed', kwargs={'guid':guid}))
+    try:
+        with fact.gnucash.guard():
+            return render_pdf(request, guid)
+    except fact.gnucash.Unavailable:
+        # Serve the most recently rendered PDF while GnuCash is down.
+        key = fact.pdfcache.latest(guid)
+        data = key and fact.pdfcache.read(key)
+        if not data:
+            return fact.gnucash.unavailable(request)
+        number = fact.models.InvoiceSummary.objects.filter(pk=guid).values_list('id', flat=True).first()
+        return pdf_response(data, number or guid, quote_etag(key), fact.pdfcache.mtime(key))
 
-    response = HttpResponse(mimetype='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename=' + _('invoice') + '-' + invoice.id + '.pdf'
-    p = reportlab.pdfgen.canvas.Canvas(response, pagesize=pagesizes.A4)
-    width, height = pagesizes.A4
-    font = 'Helvetica'
+def render_pdf(request, guid):
+    # The profile is finished however the request ends, so the query
+    # recorder and tracemalloc it started are always stopped.
+    profile = fact.profiling.start('pdf')
+    response = None
+    try:
+        response = profiled_pdf(request, guid, profile)
+    finally:
+        profile.finish(response)
+    return response
 
-    # Load options and payment text
+def profiled_pdf(request, guid, profile):
+    invoice = get_object_or_404(fact.models.Invoice.related(), pk=guid)
+    if not invoice.printable:
+        return redirect(reverse('fact.views.detailed', kwargs={'guid':guid}))
+    profile.mark('invoice')
+
+    company = fact.render.resources.company()
+    profile.mark('company')
     options = fact.models.Option.opt_list(request.LANGUAGE_CODE)
-    for key, value in options.iteritems():
-        options['payment_text'] = options['payment_text'].replace('%' + key + '%', value)
-    options['payment_text'] = options['payment_text'].replace('\n', '<br/>')
-
-    # Right-hand stuff
-    x = units.cm * 14;
-    p.setFont(font + '-Bold', 18)
-    p.drawString(x, height-(units.cm*4.5), _('Invoice %s') % invoice.id)
-    p.setFont(font, 10)
-    p.drawString(x, height-(units.cm*5.5), _('Invoice date: %s') % invoice.date_invoice.strftime('%d.%m.%Y'))
-    p.drawString(x, height-(units.cm*6), _('Due date: %s') % invoice.date_due.strftime('%d.%m.%Y'))
-
-    # Logo
-    img = utils.ImageReader(settings.FACT_LOGO)
-    iw, ih = img.getSize()
-    aspect = ih / float(iw)
-    img = Image(settings.FACT_LOGO, width=units.cm*4, height=units.cm*4*aspect)
-    img.drawOn(p, x+(units.cm*1), height-(units.cm*2.25))
-
-    # Left-hand header stuff
-    x = units.cm * 2;
-    p.setFont(font + '-Oblique', 8)
-    p.drawString(x, height-(units.cm*1.25), company['name'])
-    address = company['address'].split("\n")
-    base = 1.65
-    for a in address:
-        p.drawString(x, height-(units.cm*base), a)
-        base += 0.4
-
-
-    # Recipient name and address
-    y = units.cm*4.5
-    base = 0.5
-    customer = invoice.customer
-    p.setFont(font, 10)
-    p.drawString(x, height-y, customer.addr_name); y += units.cm*base
-    p.drawString(x, height-y, customer.addr_addr1); y += units.cm*base
-    p.drawString(x, height-y, customer.addr_addr2); y += units.cm*base
-    p.drawString(x, height-y, customer.addr_addr3); y += units.cm*base
-    p.drawString(x, height-y, customer.addr_addr4); y += units.cm*base
-    y += units.cm*2
-
-    # Main
-    p.setFont(font + '-Bold', 14)
-    p.drawString(x, height-y, _('Specification'))
-    y += units.cm*1
-    p.setFont(font, 10)
-    fmt = '{0:.2f}'
-
-    # Get our invoice entries, headers, etc
-    style = TableStyle()
-    invoice_entries = []
-    headers = [_('Description'), _('Amount'), _('Type'), _('Unit price'), _('VAT'), _('Net')]
-    style.add('FONT', (0,0), (-1,0), font + '-Bold')
-    style.add('LINEBELOW', (0,0), (-1,0), 1, colors.black)
-    for entry in invoice.entries:
-        invoice_entries.append([
-            entry.description,
-            intcomma(fmt.format(entry.quantity)),
-            _(entry.action),
-            intcomma(fmt.format(entry.unitprice)),
-            intcomma(fmt.format(entry.tax_percent)) + '%',
-            intcomma(fmt.format(entry.net))
-        ])
-    style.add('LINEBELOW', (0, len(invoice_entries)), (-1, len(invoice_entries)), 1, colors.black)
-    sums = []
-    sums.append([_('Net'), '', '', '', '', intcomma(fmt.format(invoice.net))])
-    sums.append([_('VAT'), '', '', '', '', intcomma(fmt.format(invoice.tax))])
-    if invoice.payments.count() > 0:
-        sums.append([_('Subtotal'), '', '', '', '', intcomma(fmt.format(invoice.gross))])
-        style.add('LINEBELOW', (0, len(invoice_entries)+3), (-1, len(invoice_entries)+3), 1, colors.black)
-        for payment in invoice.payments.all():
-            sums.append([_('Paid %s') + payment.post_date.strftime('%d.%m.%Y'), '', '', '', '', intcomma(fmt.format(payment.amount))])
-        ln = len(invoice_entries) + len(sums)
-        style.add('LINEBELOW', (0, ln), (-1, ln), 1, colors.black)
-    else:
-        style.add('LINEBELOW', (0, len(invoice_entries)+2), (-1, len(invoice_entries)+2), 1, colors.black)
-    sums.append([_('Amount due'), '', '', '', '', intcomma(fmt.format(invoice.due))])
-    ln = len(invoice_entries) + len(sums)
-    style.add('BACKGROUND', (0, ln), (-1, ln), colors.wheat)
-    style.add('FONT', (0, ln), (-1, ln), font + '-Bold')
-    style.add('LINEBELOW', (0, ln), (-1, ln), 2, colors.black)
-
-    # Draw the table
-    t = Table([headers] + invoice_entries + sums,
-            ([units.cm*6.5, units.cm*1.75, units.cm*2, units.cm*2.5, units.cm*2, units.cm*2.25])
-            )
-    t.setStyle(style)
-    w, h = t.wrapOn(p, units.cm*19, units.cm*8)
-    y += h
-    t.drawOn(p, x, height-y)
-
-    # Bank account number
-    stylesheet = getSampleStyleSheet()
-    if invoice.notes:
-        txt = invoice.notes + '<br/><br/>'
+    key = fact.pdfcache.fingerprint(invoice, company, options, request.LANGUAGE_CODE)
+    etag = quote_etag(key)
+    profile.mark('fingerprint')
+
+    # Serve repeat downloads from the cache, without loading ReportLab.
+    data = None
+    mtime = fact.pdfcache.mtime(key)
+    if mtime is not None:
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if (if_none_match and key in parse_etags(if_none_match)) or \
+                (not if_none_match and if_modified_since and int(mtime) <= if_modified_since):
+            fact.metrics.cache_result('pdf', True)
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        data = fact.pdfcache.read(key)
+        profile.mark('cache')
     else:
-        txt = ''
-    txt += options['payment_text']
-    pr = Paragraph(txt, stylesheet['BodyText'])
-    w, h = pr.wrapOn(p, units.cm*17, units.cm*6)
-    y += pr.height + (units.cm*1)
-    pr.drawOn(p, x, height-y)
-
-    # Footer stuff
-    p.setFont(font + '-BoldOblique', 8)
-    p.drawString(x, units.cm*2.8, company['name'])
-    p.setFont(font + '-Oblique', 8)
-    p.drawString(x, units.cm*2.4, address[0])
-    p.drawString(x, units.cm*2, address[1])
-
-    p.drawString(units.cm*8, units.cm*2.4, 'Web: ' + company['url'])
-    p.drawString(units.cm*8, units.cm*2, 'E-post: ' + company['email'])
-
-    p.drawString(units.cm*14, units.cm*2.4, 'Telefon: ' + company['phone'])
-    p.drawString(units.cm*14, units.cm*2, 'Org.nr: ' + company['id'])
-
-    # Close the PDF object cleanly, and we're done.
-    p.showPage()
-    p.save()
+        fact.metrics.cache_result('pdf', False)
+
+    if data is None:
+        data = fact.render.render(invoice, request.LANGUAGE_CODE, company, profile)
+        mtime = fact.pdfcache.write(key, data)
+        profile.mark('store')
+
+    return pdf_response(data, invoice.id, etag, mtime)
 
+@login_required
+@fact.gnucash.guarded
+def export(request):
+    form = fact.forms.ExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest()
+    guids = request.GET.getlist('guid')
+    if not guids:
+        data = form.cleaned_data
+        guids = fact.export.select_invoices(data['date_from'], data['date_to'], data['customer'], data['unpaid'])
+    response = StreamingHttpResponse(fact.export.stream_zip(guids, request.LANGUAGE_CODE), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename=' + _('invoices') + '.zip'
     return response
+
+
+def metrics_allowed(request):
+    # Staff users, scrapers sending "Authorization: Bearer" with
+    # FACT_METRICS_TOKEN, and the addresses in FACT_METRICS_IPS.
+    if request.user.is_staff:
+        return True
+    token = getattr(settings, 'FACT_METRICS_TOKEN', None)
+    if token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token):
+        return True
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'FACT_METRICS_IPS', ())
+
+def metrics(request):
+    # Prometheus metrics, see metrics_allowed() for who may read them.
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(fact.metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@login_required
+def search(request):
+    # Reads only the default database, so searching works while GnuCash
+    # is unavailable.
+    form = fact.forms.SearchForm(request.GET)
+    invoices = []
+    if form.is_valid() and form.cleaned_data['q']:
+        guids = fact.search.search(form.cleaned_data['q'], page_size(request))
+        summaries = fact.models.InvoiceSummary.objects.in_bulk(guids)
+        invoices = [summaries[guid] for guid in guids if guid in summaries]
+    return render_to_response('fact/search.html', {
+            'title' : _('Search'),
+            'form' : form,
+            'invoices' : invoices
+        }, context_instance=RequestContext(request))
+
+@login_required
+@fact.gnucash.guarded
+def aging(request):
+    form = fact.forms.AgingForm(request.GET)
+    as_of = None
+    if form.is_valid():
+        as_of = form.cleaned_data['date']
+    as_of = as_of or timezone.localtime(timezone.now()).date()
+    rows, total = fact.aging.report(as_of)
+    return render_to_response('fact/aging.html', {
+            'title' : _('Receivables aging as of %s') % as_of.strftime('%d.%m.%Y'),
+            'form' : form,
+            'buckets' : fact.aging.BUCKETS,
+            'rows' : rows,
+            'total' : total
+        }, context_instance=RequestContext(request))
+
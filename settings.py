@@ -191,6 +191,7 @@ TEMPLATE_CONTEXT_PROCESSORS = (
 # these middleware classes will be applied in the order given, and in the
 # response phase the middleware will be applied in reverse order.
 MIDDLEWARE_CLASSES = (
+    "fact.middleware.MetricsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.locale.LocaleMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
@@ -198,6 +199,10 @@ MIDDLEWARE_CLASSES = (
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
+    "fact.middleware.ChangeMiddleware",
+    "fact.middleware.ReplicaMiddleware",
+    "fact.middleware.LoaderMiddleware",
+    "fact.middleware.QueryCountMiddleware",
 )
 
 # Store these package names here as they may change in the future since
@@ -221,6 +226,112 @@ OPTIONAL_APPS = (
 DEBUG_TOOLBAR_CONFIG = {"INTERCEPT_REDIRECTS": False}
 
 
+################
+# INVOICE LIST #
+################
+
+# Number of invoices per page, and the largest page size a client may ask
+# for with the "size" parameter.
+FACT_PAGE_SIZE = 50
+FACT_MAX_PAGE_SIZE = 500
+
+# How long API clients may cache responses, in seconds.
+FACT_API_MAX_AGE = 60
+
+# Maximum number of queries per database alias for the main views. Going
+# over budget logs a warning from fact.middleware.QueryCountMiddleware,
+# and fails tests using fact.testing.QueryBudgetMixin. The middleware
+# records the queries of a FACT_QUERY_SAMPLE_RATE share of the requests,
+# logs them and counts them in the query metrics. The counts are added to
+# the response headers when FACT_QUERY_HEADERS (default: DEBUG) is set,
+# and for staff users.
+FACT_QUERY_BUDGETS = {
+    "fact.views.index": {"default": 5, "gnucash": 2},
+    "fact.views.customers": {"default": 5, "gnucash": 0},
+    "fact.views.customer": {"default": 5, "gnucash": 1},
+    "fact.views.aging": {"default": 3, "gnucash": 3},
+    "fact.views.detailed": {"default": 5, "gnucash": 10},
+    "fact.views.pdf": {"default": 6, "gnucash": 20},
+}
+FACT_QUERY_SAMPLE_RATE = 1.0
+
+# Prometheus metrics are served at /metrics to staff users, to requests
+# with an "Authorization: Bearer <FACT_METRICS_TOKEN>" header, and to the
+# addresses in FACT_METRICS_IPS. The addresses are checked against
+# REMOTE_ADDR, which behind a reverse proxy is the proxy's own address for
+# every request: there, use the token, or block /metrics at the proxy.
+# Each worker process writes its numbers to a file in FACT_METRICS_DIR,
+# which must be local to the host, at most every FACT_METRICS_FLUSH
+# seconds. The endpoint adds up the files of all workers; those of workers
+# that have exited are added to a single retired file.
+FACT_METRICS_TOKEN = None
+FACT_METRICS_IPS = ()
+FACT_METRICS_DIR = os.path.join(PROJECT_ROOT, "cache", "metrics")
+FACT_METRICS_FLUSH = 5
+
+
+################
+# INVOICE PDFS #
+################
+
+# Rendered PDFs are cached on disk, keyed by a fingerprint of the invoice,
+# options and company details. The least recently used files are removed
+# when the cache grows beyond FACT_PDF_CACHE_SIZE bytes.
+FACT_PDF_CACHE_DIR = os.path.join(PROJECT_ROOT, "cache", "pdf")
+FACT_PDF_CACHE_SIZE = 256 * 1024 * 1024
+
+# Profile one PDF request in FACT_PDF_PROFILE_RATE, logging time, queries
+# and (with FACT_PDF_PROFILE_MEMORY and tracemalloc) memory per rendering
+# stage to the "fact.profile" logger and the X-Fact-Profile header. Set
+# to 0 to turn profiling off, or 1 to profile every request.
+FACT_PDF_PROFILE_RATE = 0
+FACT_PDF_PROFILE_MEMORY = False
+
+# The company profile is read from the GnuCash business options, and cached
+# for FACT_COMPANY_TTL seconds before checking for changes. Override the
+# mapping from profile fields to slot names with FACT_COMPANY_SLOTS; see
+# fact.models.COMPANY_SLOTS for the defaults.
+FACT_COMPANY_TTL = 10
+
+# The invoice options set in the admin are cached for FACT_OPTIONS_TTL
+# seconds in every process. Saving them reloads them in the saving process
+# straight away, and in the others once this has passed.
+FACT_OPTIONS_TTL = 10
+
+# Customers and jobs are loaded into an in-memory ownership graph, kept
+# until "manage.py watch_gnucash" reports a change, and reloaded at least
+# every FACT_OWNERS_TTL seconds.
+FACT_OWNERS_TTL = 300
+
+
+###########
+# GNUCASH #
+###########
+
+# Connections to the GnuCash database are read-only, and PostgreSQL
+# statements are cancelled after FACT_GNUCASH_TIMEOUT milliseconds. After
+# FACT_GNUCASH_FAILURES errors or timeouts in a row, views stop querying
+# GnuCash for FACT_GNUCASH_RETRY seconds and serve cached data or a
+# "temporarily unavailable" page. Set CONN_MAX_AGE on the gnucash database
+# to reuse connections between requests.
+FACT_GNUCASH_TIMEOUT = 5000
+FACT_GNUCASH_FAILURES = 5
+FACT_GNUCASH_RETRY = 30
+
+# Database aliases holding a copy of the GnuCash database, the primary
+# "gnucash" first. Each request reads from one replica, picked at random
+# among those that answer and lag at most FACT_REPLICA_MAX_LAG seconds
+# behind. Replicas are checked every FACT_REPLICA_CHECK seconds.
+FACT_GNUCASH_REPLICAS = ("gnucash",)
+FACT_REPLICA_MAX_LAG = 30
+FACT_REPLICA_CHECK = 10
+
+# With "manage.py watch_gnucash" running, every process checks for changes
+# it reported at most every FACT_CHANGES_CHECK seconds, and drops its
+# cached copies of the changed data.
+FACT_CHANGES_CHECK = 2
+
+
 ##############
 # COMPRESSOR #
 ##############
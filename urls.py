@@ -12,9 +12,20 @@ urlpatterns = patterns("",
     url("^$", 'fact.views.index', name='home'),
     ("^admin/?$", 'fact.views.admin'),
     ("^customers/?$", 'fact.views.customers'),
+    ("^aging/?$", 'fact.views.aging'),
+    ("^search/?$", 'fact.views.search'),
+    ("^customers/(?P<guid>\w{32})/?$", 'fact.views.customer'),
     ("^login/$", 'fact.views.login'),
     ("^logout/$", 'fact.views.logout'),
     ("^invoice/?$", 'fact.views.index'),
     ("^invoice/(?P<guid>\w{32})/?$", 'fact.views.detailed'),
     ("^invoice/pdf/(?P<guid>\w{32})/?$", 'fact.views.pdf'),
+    ("^invoice/zip/?$", 'fact.views.export'),
+    ("^api/invoices/?$", 'fact.api.invoices'),
+    ("^api/invoices/bulk/?$", 'fact.api.bulk'),
+    ("^api/invoices/(?P<guid>\w{32})/?$", 'fact.api.invoice'),
+    ("^api/search/?$", 'fact.api.search'),
+    ("^api/customers/?$", 'fact.api.customers'),
+    ("^api/customers/(?P<guid>\w{32})/?$", 'fact.api.customer'),
+    ("^metrics/?$", 'fact.views.metrics'),
 )